@@ -17,12 +17,18 @@ st.title('Humana Take Home AI Assignment')
 if 'messages' not in st.session_state.keys():
     st.session_state.messages = [{'role': 'assistant', 'content': 'Ask me anything about the trained materials'}]
 
-# load the agent from local storage.
-research_agent = ResearchAgent.from_local_storage()
 
-# assign the chat engine to session state if not already present.
-if 'chat_engine' not in st.session_state.keys():
-    st.session_state.chat_engine = research_agent.get_chat_engine()
+# load the agent from local storage once per process, so the index and models are shared across reruns and sessions.
+@st.cache_resource
+def load_research_agent() -> ResearchAgent:
+    return ResearchAgent.from_local_storage()
+
+
+research_agent = load_research_agent()
+
+# every session gets its own memory, the agent (and its response cache) is shared by all the sessions.
+if 'memory' not in st.session_state.keys():
+    st.session_state.memory = research_agent.new_memory()
 
 # Listen for the user input
 if prompt := st.chat_input('Ask Question'):
@@ -36,7 +42,8 @@ for message in st.session_state.messages:  # Write message history to UI
 # If last message is not from assistant, generate a new response
 if st.session_state.messages[-1]['role'] != 'assistant':
     with st.chat_message('assistant'):
-        response_stream = st.session_state.chat_engine.stream_chat(prompt)
+        # answered from the response cache when possible, the turn is written to the session memory once streamed.
+        response_stream = research_agent.stream_chat(prompt, st.session_state.memory)
         st.write_stream(response_stream.response_gen)
         message = {'role': 'assistant', 'content': response_stream.response}
         # Add response to message history
@@ -1,73 +1,415 @@
+import hashlib
 import os
+import threading
+import time
 import typing as t
 from logging import getLogger
 
+import numpy as np
 from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
-from llama_index.core.chat_engine.types import BaseChatEngine, ChatMode
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    MessageRole,
+)
+from llama_index.core.chat_engine import ContextChatEngine
+from llama_index.core.chat_engine.types import AgentChatResponse, BaseChatEngine, StreamingAgentChatResponse
+from llama_index.core.data_structs.data_structs import IndexDict
 from llama_index.core.memory.chat_memory_buffer import ChatMemoryBuffer
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.core.utils import get_tokenizer
 
+from humana_take_home.caches.response import CachedResponse, SemanticResponseCache
+from humana_take_home.context.memory import PackedChatMemoryBuffer
+from humana_take_home.context.packer import ContextPacker, PackedNode
 from humana_take_home.prompts.research_paper import SYSTEM_PROMPT
-from humana_take_home.utils import get_default_embedding_models, get_default_ollama_llm
+from humana_take_home.retrievers.dense import DenseRetriever
+from humana_take_home.retrievers.hybrid import HybridRetriever
+from humana_take_home.retrievers.rerank import CrossEncoderReranker
+from humana_take_home.retrievers.sharded import ShardedRetriever
+from humana_take_home.stores.docstore import CompactDocumentStore
+from humana_take_home.stores.ivf import IVFIndex
+from humana_take_home.stores.quantization import DEFAULT_RERANK_FACTOR
+from humana_take_home.stores.shards import IndexShard, is_sharded, list_shards, shard_path
+from humana_take_home.stores.sparse import BM25Index
+from humana_take_home.stores.vector import MMapVectorStore, index_fingerprint, load_storage_context
+from humana_take_home.telemetry import count, observe, span
+from humana_take_home.utils import (
+    DEFAULT_RERANKER_MODEL,
+    get_default_cross_encoder,
+    get_default_embedding_models,
+    get_default_ollama_llm,
+    load_environment,
+    use_stand_in_models,
+)
 
 logger = getLogger(__name__)
 
 
+# vector index loaded from every index or shard directory, along with the fingerprint of its files at the time.
+_vector_indexes: dict[str, tuple[str, VectorStoreIndex]] = {}
+_vector_indexes_lock = threading.Lock()
+
+
+def _load_compact_vector_index(persist_dir: str) -> VectorStoreIndex | None:
+    """load the vector index from its memory-mapped vector store and compact docstore, without parsing
+    `docstore.json` and `index_store.json`. Returns None if either is missing, or they do not match.
+    """
+    if not (MMapVectorStore.exists(persist_dir) and CompactDocumentStore.exists(persist_dir)):
+        return None
+
+    vector_store = MMapVectorStore.from_persist_dir(persist_dir)
+    docstore = CompactDocumentStore.from_persist_dir(persist_dir)
+    if docstore.node_ids != vector_store.node_ids:
+        logger.warning(f'compact docstore @ {persist_dir} does not match the vector store, loading docstore.json')
+        return None
+
+    # vector store ids are the docstore node ids, the index struct mapping them is not needed.
+    return VectorStoreIndex(
+        index_struct=IndexDict(),
+        storage_context=StorageContext.from_defaults(
+            docstore=docstore, index_store=SimpleIndexStore(), vector_store=vector_store
+        ),
+        embed_model=get_default_embedding_models(),
+    )
+
+
+def _load_vector_index(persist_dir: str) -> VectorStoreIndex:
+    """load the vector index once per process and directory, it is loaded again only when its files changed
+    (a new fingerprint), so agents built one after the other share the same index.
+    Indexes persisted with a compact docstore only load node ids and vectors, node texts are read on retrieval.
+    """
+    fingerprint = index_fingerprint(persist_dir)
+    with _vector_indexes_lock:
+        if (loaded := _vector_indexes.get(persist_dir)) is not None and loaded[0] == fingerprint:
+            return loaded[1]
+
+        vector_index = _load_compact_vector_index(persist_dir)
+        if vector_index is None:
+            # memory-maps the binary vector store when present, so cold start does not parse any embeddings.
+            storage_ctx = load_storage_context(persist_dir=persist_dir)
+            vector_index = load_index_from_storage(
+                storage_context=storage_ctx,
+                llm=get_default_ollama_llm(temperature=0.0),
+                embed_model=get_default_embedding_models(),
+            )
+        _vector_indexes[persist_dir] = (fingerprint, vector_index)
+        return vector_index
+
+
+def _load_shard(persist_dir: str, name: str, use_ann: bool, use_bm25: bool | None) -> IndexShard:
+    """load the vector index of a directory along with its ivf and bm25 indexes, see `from_local_storage`."""
+    ann_index = None
+    if use_ann:
+        if not IVFIndex.exists(persist_dir):
+            raise FileNotFoundError(f'no ivf index persisted @ {persist_dir}, vectorize with `--build_ann`')
+        ann_index = IVFIndex.from_persist_dir(persist_dir)
+
+    sparse_index = None
+    if use_bm25 or (use_bm25 is None and BM25Index.exists(persist_dir)):
+        if not BM25Index.exists(persist_dir):
+            raise FileNotFoundError(f'no bm25 index persisted @ {persist_dir}, vectorize with `--build_bm25`')
+        sparse_index = BM25Index.from_persist_dir(persist_dir)
+
+    return IndexShard(
+        name=name, vector_index=_load_vector_index(persist_dir), ann_index=ann_index, sparse_index=sparse_index
+    )
+
+
 class ResearchAgent:
     """Agent to query the research paper using vector index."""
 
-    def __init__(self, vector_index: VectorStoreIndex, similarity_top_k: int = 3) -> None:
+    def __init__(
+        self,
+        vector_index: VectorStoreIndex | None = None,
+        similarity_top_k: int = 3,
+        ann_index: IVFIndex | None = None,
+        n_probe: int = 8,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        sparse_index: BM25Index | None = None,
+        response_cache: SemanticResponseCache | None = None,
+        context_token_budget: int | None = None,
+        history_token_budget: int | None = None,
+        rerank_candidates: int | None = None,
+        shards: list[IndexShard] | None = None,
+    ) -> None:
         """constructor to initialize the agent with vector index and chat engine.
 
         Args:
-            vector_index (VectorStoreIndex): vector index to query the research paper.
+            vector_index (VectorStoreIndex | None, optional): vector index to query the research paper, required
+            unless `shards` are provided. Defaults to None.
             similarity_top_k (int, optional): Number of nodes to use for context. Defaults to 3.
+            ann_index (IVFIndex | None, optional): approximate index for retrieval, exact search if None.
+            Defaults to None.
+            n_probe (int, optional): number of ivf lists to scan per query. Defaults to 8.
+            rerank_factor (int, optional): candidates of a quantized index re-scored exactly per retrieved node.
+            Defaults to 4.
+            sparse_index (BM25Index | None, optional): bm25 index fused with the dense retrieval, dense only if None.
+            Defaults to None.
+            response_cache (SemanticResponseCache | None, optional): cache answering repeated first-turn
+            questions without calling the llm. Defaults to None.
+            context_token_budget (int | None, optional): tokens of the retrieved nodes sent to the llm, see
+            `ContextPacker`. Defaults to None, nodes are sent as retrieved.
+            history_token_budget (int | None, optional): tokens of the chat history sent to the llm, see
+            `PackedChatMemoryBuffer`. Defaults to None, the history is only bounded by the context window.
+            rerank_candidates (int | None, optional): nodes retrieved and re-ranked with the cross-encoder, the best
+            `similarity_top_k` are used for the context. Defaults to None, no re-ranking.
+            shards (list[IndexShard] | None, optional): shards of a sharded index, searched in parallel instead of
+            `vector_index`, each with its own ivf and bm25 indexes. Defaults to None.
+
+        Raises:
+            ValueError: if neither `vector_index` nor `shards` are provided.
         """
         self.model_name = os.getenv('MODEL_NAME')
-        self.__chat_engine = vector_index.as_chat_engine(
-            chat_mode=ChatMode.CONTEXT,
-            system_prompt=SYSTEM_PROMPT,
-            llm=get_default_ollama_llm(temperature=0.0),
-            similarity_top_k=similarity_top_k,
+        # vectorized retriever, scores all the nodes with a single matrix-vector product per query.
+        retriever_kwargs = dict(
+            similarity_top_k=max(similarity_top_k, rerank_candidates or 0), n_probe=n_probe, rerank_factor=rerank_factor
+        )
+        if shards:
+            # every shard is searched by its own retriever, the best nodes of all the shards are kept.
+            self.retriever = ShardedRetriever(
+                [
+                    self._build_retriever(shard.vector_index, shard.ann_index, shard.sparse_index, **retriever_kwargs)
+                    for shard in shards
+                ],
+                shard_names=[shard.name for shard in shards],
+                similarity_top_k=retriever_kwargs['similarity_top_k'],
+            )
+        elif vector_index is not None:
+            self.retriever = self._build_retriever(vector_index, ann_index, sparse_index, **retriever_kwargs)
+        else:
+            raise ValueError('either `vector_index` or `shards` are required')
+        self.llm = get_default_ollama_llm(temperature=0.0)
+        # wider candidate set narrowed down by the cross-encoder, so fewer but better nodes reach the llm.
+        self.reranker = (
+            CrossEncoderReranker(get_default_cross_encoder(), top_n=similarity_top_k) if rerank_candidates else None
+        )
+        # deduplicated and trimmed nodes, so the prompt is not filled with overlapping chunks.
+        self.context_packer = (
+            ContextPacker(token_budget=context_token_budget) if context_token_budget is not None else None
+        )
+        self.history_token_budget = history_token_budget
+        # memory of the default chat engine of `get_chat_engine()`, the agent methods use a memory per session.
+        self.memory = self.new_memory()
+        self.__chat_engine = self.__build_chat_engine(self.memory)
+        self.response_cache = response_cache
+        self._settings = {
+            'system_prompt': hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest(),
+            'llm': self.llm.metadata.model_name,
+            'temperature': getattr(self.llm, 'temperature', None),
+            'context_window': self.llm.metadata.context_window,
+            'embeddings_model': (vector_index or shards[0].vector_index)._embed_model.model_name,
+            'stand_in_models': use_stand_in_models(),
+            'shards': [shard.name for shard in shards] if shards else None,
+            'similarity_top_k': similarity_top_k,
+            'ann': ann_index is not None or any(shard.ann_index is not None for shard in shards or []),
+            'n_probe': n_probe,
+            'rerank_factor': rerank_factor,
+            'bm25': sparse_index is not None or any(shard.sparse_index is not None for shard in shards or []),
+            'rerank_candidates': rerank_candidates,
+            'reranker_model': (os.getenv('RERANKER_MODEL') or DEFAULT_RERANKER_MODEL) if self.reranker else None,
+            'context_token_budget': context_token_budget,
+            'history_token_budget': history_token_budget,
+        }
+
+    @staticmethod
+    def _build_retriever(
+        vector_index: VectorStoreIndex,
+        ann_index: IVFIndex | None,
+        sparse_index: BM25Index | None,
+        **retriever_kwargs: t.Any,
+    ) -> DenseRetriever:
+        """vectorized retriever over a vector index, scoring all the nodes with a single matrix-vector product."""
+        if sparse_index is None:
+            return DenseRetriever.from_vector_index(vector_index, ann_index=ann_index, **retriever_kwargs)
+        # exact terms of the query are matched by the bm25 index, and fused with the dense ranking.
+        return HybridRetriever.from_vector_index(
+            vector_index, ann_index=ann_index, sparse_index=sparse_index, **retriever_kwargs
         )
 
     @classmethod
-    def from_local_storage(cls, similarity_top_k: int = 3) -> 'ResearchAgent':
+    def from_local_storage(
+        cls,
+        similarity_top_k: int = 3,
+        use_ann: bool = False,
+        n_probe: int = 8,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        use_bm25: bool | None = None,
+        cache_responses: bool = True,
+        rerank_candidates: int | None = None,
+    ) -> 'ResearchAgent':
         """method to load the vector index from the local storage using env variables.
+        The response cache is tuned with `RESPONSE_CACHE_THRESHOLD`, `RESPONSE_CACHE_TTL` and `RESPONSE_CACHE_SIZE`,
+        and is invalidated whenever the files under `VECTOR_INDEX_PATH` change. The prompt is packed within
+        `CONTEXT_TOKEN_BUDGET` and `HISTORY_TOKEN_BUDGET` tokens, both 0 (packing disabled) unless set.
+        When `VECTOR_INDEX_PATH` holds shards (see `PDFDataLoader.build_sharded_index`) rather than an index,
+        all of them are loaded and searched in parallel.
 
         Args:
             similarity_top_k (int, optional): Number of nodes to use for the context. Defaults to 3.
+            use_ann (bool, optional): retrieve with the persisted ivf index instead of exact search. Defaults to False.
+            n_probe (int, optional): number of ivf lists to scan per query. Defaults to 8.
+            rerank_factor (int, optional): candidates of a quantized index re-scored exactly per retrieved node.
+            Defaults to 4.
+            use_bm25 (bool | None, optional): fuse the persisted bm25 index with the dense retrieval. Defaults to
+            None, used if persisted.
+            cache_responses (bool, optional): answer repeated first-turn questions from the cache. Defaults to True.
+            rerank_candidates (int | None, optional): nodes retrieved and re-ranked with the cross-encoder. Defaults
+            to None, `RERANK_CANDIDATES` or no re-ranking if unset.
 
         Raises:
             EnvironmentError: if vector index path is not set or does not exists.
+            FileNotFoundError: if `use_ann` or `use_bm25` is set but no ivf or bm25 index was persisted (in every
+            shard).
 
         Returns:
             ResearchAgent
         """
+        load_environment()
         _vector_index_path = os.getenv('VECTOR_INDEX_PATH')
         if _vector_index_path is None or not os.path.exists(_vector_index_path):
             raise EnvironmentError('valid `VECTOR_INDEX_PATH` is required load embeddings')
 
-        storage_ctx = StorageContext.from_defaults(persist_dir=_vector_index_path)
-        vector_index = load_index_from_storage(
-            storage_context=storage_ctx,
-            llm=get_default_ollama_llm(temperature=0.0),
-            embed_model=get_default_embedding_models(),
+        if is_sharded(_vector_index_path):
+            shards = [
+                _load_shard(shard_path(_vector_index_path, name), name, use_ann, use_bm25)
+                for name in list_shards(_vector_index_path)
+            ]
+            logger.info(f'Loaded {len(shards)} shards @ {_vector_index_path}')
+        else:
+            shards = [_load_shard(_vector_index_path, os.path.basename(_vector_index_path), use_ann, use_bm25)]
+
+        response_cache = None
+        if cache_responses:
+            response_cache = SemanticResponseCache(
+                embed_model=shards[0].vector_index._embed_model,
+                similarity_threshold=float(os.getenv('RESPONSE_CACHE_THRESHOLD', 0.95)),
+                ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+                max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+                fingerprint_fn=lambda: index_fingerprint(_vector_index_path),
+            )
+
+        context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 0))
+        history_token_budget = int(os.getenv('HISTORY_TOKEN_BUDGET', 0))
+        if rerank_candidates is None:
+            rerank_candidates = int(os.getenv('RERANK_CANDIDATES', 0))
+
+        # a single index is searched directly, without the fan-out of the sharded retriever.
+        single = shards[0] if len(shards) == 1 else None
+        return cls(
+            vector_index=single.vector_index if single else None,
+            similarity_top_k=similarity_top_k,
+            ann_index=single.ann_index if single else None,
+            n_probe=n_probe,
+            rerank_factor=rerank_factor,
+            sparse_index=single.sparse_index if single else None,
+            response_cache=response_cache,
+            context_token_budget=context_token_budget or None,
+            history_token_budget=history_token_budget or None,
+            rerank_candidates=rerank_candidates or None,
+            shards=shards if single is None else None,
+        )
+
+    def __build_chat_engine(self, memory: ChatMemoryBuffer) -> BaseChatEngine:
+        return ContextChatEngine.from_defaults(
+            retriever=self.retriever,
+            system_prompt=SYSTEM_PROMPT,
+            llm=self.llm,
+            memory=memory,
+            node_postprocessors=self.node_postprocessors,
         )
 
-        return cls(vector_index=vector_index, similarity_top_k=similarity_top_k)
+    @property
+    def settings(self) -> dict[str, t.Any]:
+        """models, prompt and retrieval settings the answers of the agent depend on, e.g. to key cached answers."""
+        return dict(self._settings)
+
+    @property
+    def node_postprocessors(self) -> list[BaseNodePostprocessor]:
+        """postprocessors applied to the retrieved nodes in order, re-ranking first then packing."""
+        return [postprocessor for postprocessor in (self.reranker, self.context_packer) if postprocessor is not None]
+
+    def new_memory(self) -> ChatMemoryBuffer:
+        """create an empty chat memory sized for the llm, e.g. one per chat session."""
+        token_limit = self.llm.metadata.context_window - 256
+        if self.history_token_budget is None:
+            return ChatMemoryBuffer.from_defaults(token_limit=token_limit)
+        return PackedChatMemoryBuffer(token_limit=token_limit, history_token_budget=self.history_token_budget)
+
+    @staticmethod
+    def context_stats(source_nodes: list[NodeWithScore], memory: ChatMemoryBuffer | None = None) -> dict[str, int]:
+        """method to report the tokens sent to the llm for a turn, and the tokens saved by packing.
+
+        Args:
+            source_nodes (list[NodeWithScore]): source nodes of the response.
+            memory (ChatMemoryBuffer | None, optional): memory the turn was answered with. Defaults to None.
+
+        Returns:
+            dict[str, int]: tokens of the context and of the history, as retrieved / stored and as sent.
+        """
+        packed_nodes = [node for node in source_nodes if isinstance(node, PackedNode)]
+        stats = {
+            'retrieved_tokens': sum(node.original_tokens for node in packed_nodes),
+            'context_tokens': sum(node.packed_tokens for node in packed_nodes),
+            'full_history_tokens': 0,
+            'history_tokens': 0,
+        }
+        if isinstance(memory, PackedChatMemoryBuffer):
+            packing = memory.last_packing
+            stats['full_history_tokens'], stats['history_tokens'] = packing['full_tokens'], packing['packed_tokens']
+        stats['tokens_saved'] = (
+            stats['retrieved_tokens'] - stats['context_tokens'] + stats['full_history_tokens'] - stats['history_tokens']
+        )
+        return stats
 
-    def get_chat_engine(self) -> BaseChatEngine:
+    def get_chat_engine(self, memory: ChatMemoryBuffer | None = None) -> BaseChatEngine:
         """get the chat engine to query the research paper.
         used by streamlit and evaluator.
 
+        Args:
+            memory (ChatMemoryBuffer | None, optional): memory of a chat session, a new engine sharing the
+            retriever and llm is bound to it. Defaults to None, the engine defined in the constructor.
+
         Returns:
             BaseChatEngine defined chat engined in constructor.
         """
+        if memory is not None:
+            return self.__build_chat_engine(memory)
         return self.__chat_engine
 
+    def invalidate_response_cache(self) -> None:
+        """drop all the cached responses, e.g. after the vector index was updated in place."""
+        if self.response_cache is not None:
+            self.response_cache.invalidate()
+
+    def _lookup_cache(self, query: str, memory: ChatMemoryBuffer) -> tuple[CachedResponse | None, np.ndarray | None]:
+        """method to look up first-turn questions of a chat session in the response cache.
+
+        Returns:
+            tuple[CachedResponse | None, np.ndarray | None]: cached response if hit, and the question embedding
+            to store the answer with on a first-turn miss (None when the question is not cacheable).
+        """
+        if self.response_cache is None or memory.get_all():
+            return None, None
+
+        # repeated questions are answered without embedding them.
+        cached = self.response_cache.lookup_exact(query)
+        if cached is not None:
+            count('response_cache_lookups', result='hit')
+            return cached, None
+
+        embedding = self.response_cache.embed(query)
+        cached = self.response_cache.lookup(query, embedding=embedding)
+        count('response_cache_lookups', result='miss' if cached is None else 'hit')
+        return cached, embedding
+
     def query(self, query: str, chat_history: ChatMemoryBuffer | None = None) -> t.Any:
         """a method to quert chat engine with the query and chat history.
-        Useful when creating an API.
+        Useful when creating an API. Every call is answered with its own memory, `chat_history` is copied into it.
 
         Args:
             query (str): user query to ask the question from chatbot.
@@ -76,9 +418,187 @@ class ResearchAgent:
         Returns:
             t.Any: response from the chat engine.
         """
-        response = self.__chat_engine.chat(
-            message=query,
-            chat_history=chat_history.get() if chat_history is not None else None,
-        )
+        memory = self.new_memory()
+        if chat_history is not None:
+            memory.set(chat_history.get_all())
+        return self.chat(query, memory)
+
+    def chat(self, query: str, memory: ChatMemoryBuffer) -> AgentChatResponse:
+        """a method to answer the query within a chat session, sync counterpart of `achat`.
+        Safe to run concurrently for distinct sessions, first-turn questions are answered from the response cache
+        when possible.
 
+        Args:
+            query (str): user query to ask the question from chatbot.
+            memory (ChatMemoryBuffer): memory of the chat session, the turn is written to it.
+
+        Returns:
+            AgentChatResponse: response from the chat engine.
+        """
+        cached, embedding = self._lookup_cache(query, memory)
+        if cached is not None:
+            memory.put(ChatMessage(role=MessageRole.USER, content=query))
+            memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=cached.response))
+            return AgentChatResponse(response=cached.response, source_nodes=cached.source_nodes)
+
+        # retrieval is traced as a nested span, the rest of the turn is the llm call.
+        with span('agent.chat'):
+            response = self.get_chat_engine(memory).chat(query)
+        count('llm_output_tokens', len(get_tokenizer()(response.response)))
+
+        if embedding is not None:
+            self.response_cache.store(query, response.response, response.source_nodes, embedding=embedding)
+        return response
+
+    def stream_chat(self, query: str, memory: ChatMemoryBuffer) -> StreamingAgentChatResponse:
+        """a method to stream the answer within a chat session, sync counterpart of `astream_chat` (e.g. streamlit).
+        Safe to run concurrently for distinct sessions, cache hits are streamed back as a single chunk.
+
+        Args:
+            query (str): user query to ask the question from chatbot.
+            memory (ChatMemoryBuffer): memory of the chat session, the turn is written to it once streamed.
+
+        Returns:
+            StreamingAgentChatResponse: streamed response, consume `response_gen` to get the tokens.
+        """
+        cached, embedding = self._lookup_cache(query, memory)
+        if cached is not None:
+
+            def cached_gen() -> ChatResponseGen:
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=cached.response), delta=cached.response
+                )
+                memory.put(ChatMessage(role=MessageRole.USER, content=query))
+                memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=cached.response))
+
+            return StreamingAgentChatResponse(
+                chat_stream=cached_gen(), source_nodes=cached.source_nodes, is_writing_to_memory=False
+            )
+
+        start = time.perf_counter()
+        response = self.get_chat_engine(memory).stream_chat(query)
+        if response.chat_stream is not None:
+            response.chat_stream = self.__traced_gen(
+                query, embedding, response.chat_stream, response.source_nodes, start
+            )
         return response
+
+    def _trace_stream(self, start: float, first_token: float | None, content: str) -> None:
+        """method to record the spans and token count of a fully consumed chat stream started at `start`."""
+        end = time.perf_counter()
+        if first_token is not None:
+            observe('agent.stream_first_token', first_token - start)
+            observe('agent.stream_generation', end - first_token)
+        observe('agent.stream', end - start)
+        count('llm_output_tokens', len(get_tokenizer()(content)))
+
+    def __traced_gen(
+        self,
+        query: str,
+        embedding: np.ndarray | None,
+        chat_stream: ChatResponseGen,
+        source_nodes: list[NodeWithScore],
+        start: float,
+    ) -> ChatResponseGen:
+        """wraps the chat stream to trace it, and to cache the answer once it was fully streamed."""
+        content, first_token = '', None
+        for chunk in chat_stream:
+            first_token = first_token or time.perf_counter()
+            content += chunk.delta or ''
+            yield chunk
+
+        self._trace_stream(start, first_token, content)
+        if embedding is not None:
+            self.response_cache.store(query, content.strip(), source_nodes, embedding=embedding)
+
+    async def _alookup_cache(
+        self, query: str, memory: ChatMemoryBuffer
+    ) -> tuple[CachedResponse | None, np.ndarray | None]:
+        """async counterpart of `_lookup_cache`."""
+        if self.response_cache is None or memory.get_all():
+            return None, None
+
+        cached = self.response_cache.lookup_exact(query)
+        if cached is not None:
+            count('response_cache_lookups', result='hit')
+            return cached, None
+
+        embedding = await self.response_cache.aembed(query)
+        cached = self.response_cache.lookup(query, embedding=embedding)
+        count('response_cache_lookups', result='miss' if cached is None else 'hit')
+        return cached, embedding
+
+    async def achat(self, query: str, memory: ChatMemoryBuffer) -> AgentChatResponse:
+        """a method to answer the query within a chat session, safe to run concurrently for distinct sessions.
+
+        Args:
+            query (str): user query to ask the question from chatbot.
+            memory (ChatMemoryBuffer): memory of the chat session, the turn is written to it.
+
+        Returns:
+            AgentChatResponse: response from the chat engine.
+        """
+        cached, embedding = await self._alookup_cache(query, memory)
+        if cached is not None:
+            await memory.aput(ChatMessage(role=MessageRole.USER, content=query))
+            await memory.aput(ChatMessage(role=MessageRole.ASSISTANT, content=cached.response))
+            return AgentChatResponse(response=cached.response, source_nodes=cached.source_nodes)
+
+        with span('agent.chat'):
+            response = await self.get_chat_engine(memory).achat(query)
+        count('llm_output_tokens', len(get_tokenizer()(response.response)))
+
+        if embedding is not None:
+            self.response_cache.store(query, response.response, response.source_nodes, embedding=embedding)
+        return response
+
+    async def astream_chat(self, query: str, memory: ChatMemoryBuffer) -> StreamingAgentChatResponse:
+        """a method to stream the answer within a chat session, safe to run concurrently for distinct sessions.
+
+        Args:
+            query (str): user query to ask the question from chatbot.
+            memory (ChatMemoryBuffer): memory of the chat session, the turn is written to it once streamed.
+
+        Returns:
+            StreamingAgentChatResponse: streamed response, consume `async_response_gen` to get the tokens.
+        """
+        cached, embedding = await self._alookup_cache(query, memory)
+        if cached is not None:
+
+            async def cached_gen() -> ChatResponseAsyncGen:
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=cached.response), delta=cached.response
+                )
+                await memory.aput(ChatMessage(role=MessageRole.USER, content=query))
+                await memory.aput(ChatMessage(role=MessageRole.ASSISTANT, content=cached.response))
+
+            return StreamingAgentChatResponse(
+                achat_stream=cached_gen(), source_nodes=cached.source_nodes, is_writing_to_memory=False
+            )
+
+        start = time.perf_counter()
+        response = await self.get_chat_engine(memory).astream_chat(query)
+        if response.achat_stream is not None:
+            response.achat_stream = self.__atraced_gen(
+                query, embedding, response.achat_stream, response.source_nodes, start
+            )
+        return response
+
+    async def __atraced_gen(
+        self,
+        query: str,
+        embedding: np.ndarray | None,
+        achat_stream: ChatResponseAsyncGen,
+        source_nodes: list[NodeWithScore],
+        start: float,
+    ) -> ChatResponseAsyncGen:
+        """wraps the async chat stream to trace it, and to cache the answer once it was fully streamed."""
+        content, first_token = '', None
+        async for chunk in achat_stream:
+            first_token = first_token or time.perf_counter()
+            content += chunk.delta or ''
+            yield chunk
+
+        self._trace_stream(start, first_token, content)
+        if embedding is not None:
+            self.response_cache.store(query, content.strip(), source_nodes, embedding=embedding)
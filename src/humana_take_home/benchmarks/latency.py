@@ -0,0 +1,103 @@
+import time
+import typing as t
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from ..timer import Timer
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyRecorder:
+    """Collects latency samples per stage and summarizes them with percentiles."""
+
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    @contextmanager
+    def measure(self, stage: str) -> t.Iterator[Timer]:
+        """context to time a block and record it as a sample of `stage`."""
+        with Timer() as timer:
+            yield timer
+        self.samples[stage].append(timer.exec_time)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """method to record a sample measured outside of `measure`, e.g. a time to first token."""
+        self.samples[stage].append(seconds)
+
+    def record_stream(self, stage: str, tokens: t.Iterable[t.Any], start: float | None = None) -> int:
+        """method to consume a token stream, recording `<stage>_first_token` and `<stage>` latencies.
+
+        Args:
+            stage (str): name of the stage.
+            tokens (t.Iterable[t.Any]): stream to consume.
+            start (float | None, optional): `time.perf_counter` the request was sent at, e.g. before retrieval.
+            Defaults to None, now.
+
+        Returns:
+            int: number of streamed tokens.
+        """
+        start = time.perf_counter() if start is None else start
+        count = 0
+        for _ in tokens:
+            if count == 0:
+                self.record(f'{stage}_first_token', time.perf_counter() - start)
+            count += 1
+
+        self.record(stage, time.perf_counter() - start)
+        return count
+
+    def summary(self) -> list[dict[str, t.Any]]:
+        """method to summarize the samples, latencies in milliseconds.
+
+        Returns:
+            list[dict[str, t.Any]]: stage, count, mean, p50, p95, p99 and max per stage, in recording order.
+        """
+        rows = []
+        for stage, samples in self.samples.items():
+            values = np.asarray(samples) * 1e3
+            rows.append(
+                {
+                    'stage': stage,
+                    'count': len(values),
+                    'mean_ms': float(values.mean()),
+                    **{f'p{q}_ms': float(np.percentile(values, q)) for q in PERCENTILES},
+                    'max_ms': float(values.max()),
+                }
+            )
+        return rows
+
+
+def find_regressions(
+    current: list[dict[str, t.Any]],
+    baseline: list[dict[str, t.Any]],
+    tolerance: float = 0.2,
+    min_delta_ms: float = 1.0,
+    metric: str = 'p95_ms',
+) -> list[dict[str, t.Any]]:
+    """function to compare two latency summaries stage by stage.
+
+    Args:
+        current (list[dict[str, t.Any]]): summary of the current run.
+        baseline (list[dict[str, t.Any]]): summary of the reference run, e.g. of the deployed commit.
+        tolerance (float, optional): relative slow down allowed before flagging a stage. Defaults to 0.2.
+        min_delta_ms (float, optional): absolute slow down ignored, sub-millisecond stages are mostly noise.
+        Defaults to 1.0.
+        metric (str, optional): statistic to compare. Defaults to 'p95_ms'.
+
+    Returns:
+        list[dict[str, t.Any]]: stage, baseline, current and relative change of every regressed stage.
+    """
+    reference = {row['stage']: row[metric] for row in baseline}
+    regressions = []
+    for row in current:
+        before = reference.get(row['stage'])
+        if before is None or before <= 0:
+            continue
+
+        change = row[metric] / before - 1
+        if change > tolerance and row[metric] - before > min_delta_ms:
+            regressions.append({'stage': row['stage'], 'baseline': before, 'current': row[metric], 'change': change})
+    return regressions
@@ -0,0 +1,179 @@
+import asyncio
+import re
+import threading
+import time
+import typing as t
+import zlib
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.base.llms.types import (
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+_WORD = re.compile(r'\w+')
+# numbered excerpts of the batch keyword prompt, answered one line each like a well behaved llm.
+_EXCERPT = re.compile(r'^\[(\d+)\]$', re.MULTILINE)
+
+
+def _stable_hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8', 'surrogatepass'))
+
+
+class StandInEmbedding(BaseEmbedding):
+    """Deterministic embedding model hashing the words of a text into a fixed size, L2-normalized vector.
+    Texts sharing words get similar embeddings, so retrieval, semantic splitting and caching behave
+    sensibly, while the numbers only depend on the pipeline itself and are reproducible on any machine.
+    `forward_latency` (seconds) is spent once per forward pass, whatever the number of texts, like the fixed
+    cost of a small transformer on cpu. Forward passes run one at a time, like a model using every core.
+    """
+
+    dimension: int = Field(default=384, description='Size of the embeddings.', gt=0)
+    forward_latency: float = Field(default=0.0, description='Seconds spent per forward pass.', ge=0)
+    _forward_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, dimension: int = 384, **kwargs: t.Any) -> None:
+        super().__init__(model_name=f'stand-in-{dimension}', dimension=dimension, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'StandInEmbedding'
+
+    def _embed(self, text: str) -> Embedding:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            hashed = _stable_hash(word)
+            vector[hashed % self.dimension] += 1.0 if hashed & 1 << 31 else -1.0
+
+        norm = np.linalg.norm(vector)
+        # empty texts still get a valid unit vector.
+        return (vector / norm if norm > 0 else np.full(self.dimension, self.dimension**-0.5)).tolist()
+
+    def _embed_batch(self, texts: list[str]) -> list[Embedding]:
+        """embed the texts in a single simulated forward pass."""
+        if self.forward_latency:
+            with self._forward_lock:
+                time.sleep(self.forward_latency)
+        return [self._embed(text) for text in texts]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed_batch([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await asyncio.to_thread(self._embed_batch, [query]))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed_batch([text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._embed_batch(texts)
+
+
+class StandInLLM(CustomLLM):
+    """Deterministic llm answering with words picked from its prompt, at a fixed simulated speed.
+    `prompt_latency` (seconds per prompt word) is spent before the first token and `token_latency` (seconds)
+    between tokens, both default to 0 so only the overhead of the pipeline is measured.
+    """
+
+    context_window: int = Field(default=4096, description='Simulated context window in tokens.', gt=0)
+    num_output: int = Field(default=256, description='Simulated max number of output tokens.', gt=0)
+    response_tokens: int = Field(default=64, description='Number of tokens in every answer.', gt=0)
+    prompt_latency: float = Field(default=0.0, description='Seconds spent per prompt word.', ge=0)
+    token_latency: float = Field(default=0.0, description='Seconds spent per generated token.', ge=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'StandInLLM'
+
+    @property
+    def model(self) -> str:
+        """model name, used like the `model` field of `Ollama` in cache keys."""
+        return 'stand-in'
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.num_output, model_name=self.model)
+
+    def _answer(self, prompt: str) -> list[str]:
+        """method to build the answer tokens, one line per numbered excerpt or `response_tokens` words."""
+        words = _WORD.findall(prompt) or ['ok']
+        pick = _stable_hash(prompt)
+        if excerpts := _EXCERPT.findall(prompt):
+            return [
+                f'{number}: ' + ', '.join(words[(pick + int(number) * 7 + i) % len(words)] for i in range(5)) + '\n'
+                for number in excerpts
+            ]
+        return [words[(pick + i * 7) % len(words)] + ' ' for i in range(self.response_tokens)]
+
+    def _stream(self, prompt: str) -> t.Iterator[str]:
+        if self.prompt_latency:
+            time.sleep(self.prompt_latency * len(prompt.split()))
+        for token in self._answer(prompt):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: t.Any) -> CompletionResponse:
+        return CompletionResponse(text=''.join(self._stream(prompt)).strip())
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: t.Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            text = ''
+            for token in self._stream(prompt):
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+
+        return gen()
+
+    async def _astream(self, prompt: str) -> t.AsyncIterator[str]:
+        """async counterpart of `_stream`, sleeps without blocking the event loop, e.g. of the http server."""
+        if self.prompt_latency:
+            await asyncio.sleep(self.prompt_latency * len(prompt.split()))
+        for token in self._answer(prompt):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield token
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: t.Any) -> CompletionResponse:
+        return CompletionResponse(text=''.join([token async for token in self._astream(prompt)]).strip())
+
+    @llm_completion_callback()
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: t.Any
+    ) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ''
+            async for token in self._astream(prompt):
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+
+        return gen()
+
+
+class StandInCrossEncoder:
+    """Deterministic cross-encoder scoring a (query, text) pair by the share of the query words found in the
+    text, with the same `predict` interface as `sentence_transformers.CrossEncoder`. `pair_latency` (seconds)
+    simulates the forward pass per pair.
+    """
+
+    def __init__(self, pair_latency: float = 0.0) -> None:
+        self.pair_latency = pair_latency
+
+    def predict(self, pairs: list[tuple[str, str]], batch_size: int = 32, **kwargs: t.Any) -> np.ndarray:
+        if self.pair_latency:
+            time.sleep(self.pair_latency * len(pairs))
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for i, (query, text) in enumerate(pairs):
+            query_words = set(_WORD.findall(query.lower()))
+            text_words = set(_WORD.findall(text.lower()))
+            scores[i] = len(query_words & text_words) / max(len(query_words), 1)
+        return scores
@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import typing as t
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from ..embeddings.batching import embed_queries
+from ..telemetry import count
+from .sqlite import SQLiteCache
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model wrapper caching embeddings on disk, keyed by (model name, text hash).
+    Only cache misses reach the wrapped model, so re-indexing unchanged text and repeated
+    user questions skip the transformer inference entirely.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: SQLiteCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: SQLiteCache, **kwargs: t.Any) -> None:
+        """constructor to wrap the embedding model with the cache.
+
+        Args:
+            embed_model (BaseEmbedding): embedding model to compute the cache misses.
+            cache (SQLiteCache): cache to store the embeddings in.
+        """
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'CachedEmbedding'
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        """wrapped embedding model."""
+        return self._embed_model
+
+    def _key(self, text: str, kind: str) -> str:
+        # queries and texts are kept apart, some models prepend an instruction to the queries.
+        return hashlib.sha256(f'{self.model_name}\0{kind}\0{text}'.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    @staticmethod
+    def _encode(embedding: Embedding) -> bytes:
+        return np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _decode(value: bytes) -> Embedding:
+        return np.frombuffer(value, dtype=np.float32).tolist()
+
+    def _lookup(self, texts: list[str], kind: str) -> tuple[list[Embedding | None], list[str]]:
+        """method to fetch the cached embeddings, returns embeddings (None for misses) and the missed texts."""
+        keys = [self._key(text, kind) for text in texts]
+        found = self._cache.get_many(keys)
+        embeddings = [self._decode(found[key]) if key in found else None for key in keys]
+        misses = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        count('embedding_cache_lookups', len(found), result='hit')
+        count('embedding_cache_lookups', len(keys) - len(found), result='miss')
+        return embeddings, misses
+
+    def _fill(
+        self,
+        texts: list[str],
+        embeddings: list[Embedding | None],
+        misses: list[str],
+        computed: list[Embedding],
+        kind: str = 'text',
+    ) -> list[Embedding]:
+        """method to store the computed misses and merge them with the cached embeddings."""
+        encoded = {self._key(text, kind): self._encode(embedding) for text, embedding in zip(misses, computed)}
+        self._cache.set_many(encoded)
+        # return the float32 round-tripped values, so cache hits and misses are bit for bit identical.
+        by_text = {text: self._decode(encoded[self._key(text, kind)]) for text in misses}
+        return [embedding if embedding is not None else by_text[text] for text, embedding in zip(texts, embeddings)]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = self._key(query, 'query')
+        if (cached := self._cache.get(key)) is not None:
+            return self._decode(cached)
+
+        encoded = self._encode(self._embed_model.get_query_embedding(query))
+        self._cache.set(key, encoded)
+        return self._decode(encoded)
+
+    def get_query_embedding_batch(self, queries: list[str]) -> list[Embedding]:
+        """method to embed several queries, the cache misses are embedded together by the wrapped model."""
+        embeddings, misses = self._lookup(queries, 'query')
+        computed = embed_queries(self._embed_model, misses) if misses else []
+        return self._fill(queries, embeddings, misses, computed, kind='query')
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        # sqlite reads and writes block, they run in a thread so the event loop keeps serving other requests.
+        key = self._key(query, 'query')
+        if (cached := await asyncio.to_thread(self._cache.get, key)) is not None:
+            return self._decode(cached)
+
+        encoded = self._encode(await self._embed_model.aget_query_embedding(query))
+        await asyncio.to_thread(self._cache.set, key, encoded)
+        return self._decode(encoded)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        embeddings, misses = self._lookup(texts, 'text')
+        computed = self._embed_model.get_text_embedding_batch(misses) if misses else []
+        return self._fill(texts, embeddings, misses, computed)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        embeddings, misses = await asyncio.to_thread(self._lookup, texts, 'text')
+        computed = await self._embed_model.aget_text_embedding_batch(misses) if misses else []
+        return await asyncio.to_thread(self._fill, texts, embeddings, misses, computed)
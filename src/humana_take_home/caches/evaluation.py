@@ -0,0 +1,84 @@
+import hashlib
+import json
+import typing as t
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.evaluation import EvaluationResult
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from .sqlite import SQLiteCache
+
+
+def _hash(*parts: t.Any) -> str:
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class EvaluationCache:
+    """On-disk cache of evaluation runs, every answer and judge result is written as soon as it is computed,
+    so an interrupted run resumes where it stopped and re-runs only recompute what changed.
+
+    - answers are keyed by question and `system_key`: fingerprint of the index, hash of the system prompt,
+      model and retrieval settings of the chatbot under evaluation.
+    - judge results are keyed by metric, judge model, question, reference and the judged answer with its
+      contexts, so a re-generated but identical answer is not judged again.
+    """
+
+    def __init__(self, path: str, system_key: dict[str, t.Any]) -> None:
+        """constructor to open the cache.
+
+        Args:
+            path (str): path of the SQLite database file.
+            system_key (dict[str, t.Any]): settings of the chatbot the answers depend on.
+        """
+        self._cache = SQLiteCache(path, table='evaluation', max_entries=None)
+        self.system_key = _hash(json.dumps(system_key, sort_keys=True))
+
+    def get_response(self, question: str) -> Response | None:
+        """method to fetch the cached answer to the question, along with its source nodes."""
+        if (value := self._cache.get(_hash('response', self.system_key, question))) is None:
+            return None
+
+        payload = json.loads(value)
+        return Response(
+            response=payload['response'],
+            source_nodes=[
+                NodeWithScore(node=TextNode(text=source['text'], metadata=source['metadata']), score=source['score'])
+                for source in payload['source_nodes']
+            ],
+        )
+
+    def set_response(self, question: str, response: t.Any) -> None:
+        """method to cache the answer to the question, only its text and source contexts are kept."""
+        payload = {
+            'response': response.response,
+            'source_nodes': [
+                {'text': source.node.get_content(), 'metadata': source.node.metadata, 'score': source.score}
+                for source in response.source_nodes
+            ],
+        }
+        self._cache.set(_hash('response', self.system_key, question), json.dumps(payload).encode())
+
+    @staticmethod
+    def _result_key(metric: str, judge_model: str, question: str, reference: str | None, response: t.Any) -> str:
+        contexts = [source.node.get_content() for source in response.source_nodes]
+        return _hash('result', metric, judge_model, question, reference, response.response, json.dumps(contexts))
+
+    def get_result(
+        self, metric: str, judge_model: str, question: str, reference: str | None, response: t.Any
+    ) -> EvaluationResult | None:
+        """method to fetch the cached judge result of the answer for the given metric."""
+        value = self._cache.get(self._result_key(metric, judge_model, question, reference, response))
+        return EvaluationResult.model_validate_json(value) if value is not None else None
+
+    def set_result(
+        self,
+        metric: str,
+        judge_model: str,
+        question: str,
+        reference: str | None,
+        response: t.Any,
+        result: EvaluationResult,
+    ) -> None:
+        """method to cache the judge result of the answer for the given metric."""
+        key = self._result_key(metric, judge_model, question, reference, response)
+        self._cache.set(key, result.model_dump_json().encode())
@@ -0,0 +1,194 @@
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import NodeWithScore
+
+from ..stores.search import normalize_rows
+
+
+@dataclass
+class CachedResponse:
+    """Answer to a first-turn question along with the nodes it was generated from."""
+
+    query: str
+    response: str
+    source_nodes: list[NodeWithScore]
+    embedding: np.ndarray
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticResponseCache:
+    """In-memory cache of answers to history-free questions.
+    A question hits the cache when its normalized text was asked before, or when its embedding is
+    at least `similarity_threshold` similar to an earlier question. Entries expire after `ttl` seconds,
+    least recently used ones are evicted past `max_entries`, and the whole cache is dropped when the
+    fingerprint of the vector index changes, checked at most every `fingerprint_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        similarity_threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 1024,
+        fingerprint_fn: t.Callable[[], str | None] | None = None,
+        fingerprint_interval: float = 5.0,
+    ) -> None:
+        """constructor to initialize the cache.
+
+        Args:
+            embed_model (BaseEmbedding): embedding model to embed the questions with.
+            similarity_threshold (float, optional): min cosine similarity for a semantic hit. Defaults to 0.95.
+            ttl (float, optional): seconds after which an entry expires. Defaults to 3600.0.
+            max_entries (int, optional): max number of entries to keep. Defaults to 1024.
+            fingerprint_fn (t.Callable[[], str | None] | None, optional): returns the current fingerprint of the
+            vector index, the cache is invalidated when it changes. Defaults to None.
+            fingerprint_interval (float, optional): min seconds between two fingerprint checks. Defaults to 5.0.
+        """
+        self.embed_model = embed_model
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.fingerprint_fn = fingerprint_fn
+        self.fingerprint_interval = fingerprint_interval
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._matrix: np.ndarray | None = None  # stacked embeddings of the entries, rebuilt lazily.
+        self._keys: list[str] = []  # keys of the entries, aligned with `_matrix`.
+        self._created: np.ndarray | None = None  # creation times of the entries, aligned with `_matrix`.
+        self._fingerprint = fingerprint_fn() if fingerprint_fn is not None else None
+        self._fingerprint_checked = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return ' '.join(query.lower().split())
+
+    def invalidate(self) -> None:
+        """method to drop all the entries, e.g. when the vector index changed."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def _check_fingerprint(self) -> None:
+        # the fingerprint walks the index directory, so it is not checked on every lookup.
+        now = time.monotonic()
+        if self.fingerprint_fn is None or now - self._fingerprint_checked < self.fingerprint_interval:
+            return
+
+        self._fingerprint_checked = now
+        fingerprint = self.fingerprint_fn()
+        if fingerprint != self._fingerprint:
+            self.invalidate()
+            self._fingerprint = fingerprint
+
+    def _is_expired(self, entry: CachedResponse, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def _expire(self, now: float) -> None:
+        """drops the expired entries at the least recently used end, the others are dropped when hit."""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._is_expired(entry, now):
+                return
+            del self._entries[key]
+            self._matrix = None
+
+    def embed(self, query: str) -> np.ndarray:
+        return normalize_rows(self.embed_model.get_query_embedding(query))
+
+    async def aembed(self, query: str) -> np.ndarray:
+        return normalize_rows(await self.embed_model.aget_query_embedding(query))
+
+    def lookup_exact(self, query: str) -> CachedResponse | None:
+        """method to find a cached answer for the exact (normalized) question, without embedding it.
+
+        Args:
+            query (str): user question.
+
+        Returns:
+            CachedResponse | None: cached answer if hit.
+        """
+        self._check_fingerprint()
+        key, now = self._key(query), time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry, now):
+                del self._entries[key]
+                self._matrix = None
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+    def lookup(self, query: str, embedding: np.ndarray | None = None) -> CachedResponse | None:
+        """method to find a cached answer for the question, by exact key first and by similarity otherwise.
+
+        Args:
+            query (str): user question.
+            embedding (np.ndarray | None, optional): normalized question embedding, computed if None.
+
+        Returns:
+            CachedResponse | None: cached answer if hit.
+        """
+        cached = self.lookup_exact(query)
+        if cached is not None or not self._entries:
+            return cached
+
+        embedding = self.embed(query) if embedding is None else embedding
+        with self._lock:
+            if not self._entries:
+                return None
+            # rows follow the order of the entries when stacked, hits reorder the entries but not the rows.
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([entry.embedding for entry in self._entries.values()])
+                self._created = np.array([entry.created_at for entry in self._entries.values()])
+
+            scores = self._matrix @ embedding
+            # expired entries past the least recently used end are skipped here, and dropped once evicted.
+            scores[time.monotonic() - self._created > self.ttl] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+
+            self._entries.move_to_end(self._keys[best])
+            return self._entries[self._keys[best]]
+
+    def store(
+        self, query: str, response: str, source_nodes: list[NodeWithScore], embedding: np.ndarray | None = None
+    ) -> None:
+        """method to cache the answer of a first-turn question.
+
+        Args:
+            query (str): user question.
+            response (str): generated answer.
+            source_nodes (list[NodeWithScore]): nodes the answer was generated from.
+            embedding (np.ndarray | None, optional): normalized question embedding, computed if None.
+        """
+        if not response:
+            return
+
+        entry = CachedResponse(
+            query=query,
+            response=response,
+            source_nodes=list(source_nodes),
+            embedding=self.embed(query) if embedding is None else embedding,
+        )
+        with self._lock:
+            self._entries[self._key(query)] = entry
+            self._entries.move_to_end(self._key(query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
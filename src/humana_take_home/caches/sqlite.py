@@ -0,0 +1,193 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+import weakref
+
+# share of `max_entries` evicted at once, the rows are only counted again after as many inserts.
+EVICTION_SLACK = 0.1
+# hits whose recency is buffered before being written in a single transaction, and max age of the buffer (s).
+ACCESS_FLUSH_SIZE = 256
+ACCESS_FLUSH_INTERVAL = 1.0
+
+# open caches, reconnected in forked child processes, see `_reconnect_after_fork`.
+_open_caches: weakref.WeakSet['SQLiteCache'] = weakref.WeakSet()
+
+
+def _reconnect_after_fork() -> None:
+    for cache in list(_open_caches):
+        cache._connect()
+
+
+def _flush_access_at_exit() -> None:
+    for cache in list(_open_caches):
+        with cache._lock:
+            cache._flush_access()
+
+
+os.register_at_fork(after_in_child=_reconnect_after_fork)
+atexit.register(_flush_access_at_exit)
+
+
+class SQLiteCache:
+    """Persistent key-value cache backed by a single SQLite table with LRU eviction.
+    Safe to share between threads, and between processes pointing at the same file (WAL journal).
+    A forked child process opens its own connection, an SQLite connection must not be carried across fork.
+
+    Lookups and inserts avoid full table scans: the recency of hits is buffered and written in batches, and
+    rows are only counted once an upper bound of the table size (rows at the last count plus rows inserted
+    since) exceeds `max_entries`, the table is then shrunk by `EVICTION_SLACK`. Rows inserted by other
+    processes sharing the file are only seen at their next count, until then the table may exceed the max.
+    """
+
+    def __init__(self, path: str, table: str = 'cache', max_entries: int | None = 100_000) -> None:
+        """constructor to open (or create) the cache table.
+
+        Args:
+            path (str): path of the SQLite database file.
+            table (str, optional): table to store the entries in, several caches can share a file. Defaults to 'cache'.
+            max_entries (int | None, optional): max entries to keep, least recently used ones are evicted first.
+            None disables eviction. Defaults to 100_000.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        # connections inherited from the parent process, never used nor closed: closing one in the child could
+        # checkpoint and delete the wal file still used by the parent.
+        self._inherited_conns: list[sqlite3.Connection] = []
+        self._conn: sqlite3.Connection | None = None
+        self._max_rows: int | None = None  # upper bound of the rows in the table, None until counted.
+        self._pending_access: dict[str, float] = {}  # last access of the hits not written yet.
+        self._pending_since = time.monotonic()
+        self._connect()
+        _open_caches.add(self)
+
+    def _connect(self) -> None:
+        """method to open the connection, and create the table if needed."""
+        if self._conn is not None:
+            self._inherited_conns.append(self._conn)
+        # a lock held by another thread of the parent is never released in the child.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def get(self, key: str) -> bytes | None:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: t.Sequence[str]) -> dict[str, bytes]:
+        """method to fetch several entries at once, hits are marked as recently used.
+
+        Args:
+            keys (t.Sequence[str]): keys to look up.
+
+        Returns:
+            dict[str, bytes]: values of the keys found in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, bytes] = {}
+        with self._lock:
+            # sqlite caps the number of bound parameters, look keys up in chunks.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, value FROM {self.table} WHERE key IN ({placeholders})', chunk
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                if not self._pending_access:
+                    self._pending_since = time.monotonic()
+                self._pending_access.update((key, now) for key in found)
+                if (
+                    len(self._pending_access) >= ACCESS_FLUSH_SIZE
+                    or time.monotonic() - self._pending_since >= ACCESS_FLUSH_INTERVAL
+                ):
+                    self._flush_access()
+        return found
+
+    def _flush_access(self) -> None:
+        """method to write the buffered recency of the hits in a single transaction."""
+        if not self._pending_access:
+            return
+
+        pending, self._pending_access = self._pending_access, {}
+        self._conn.execute('BEGIN')
+        self._conn.executemany(
+            f'UPDATE {self.table} SET last_access = ? WHERE key = ?', [(now, key) for key, now in pending.items()]
+        )
+        self._conn.execute('COMMIT')
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: dict[str, bytes]) -> None:
+        """method to insert or overwrite several entries at once, evicting the least recently used ones if full.
+
+        Args:
+            items (dict[str, bytes]): entries to store.
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            for key in items:
+                self._pending_access.pop(key, None)
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, last_access) VALUES (?, ?, ?)',
+                [(key, value, now) for key, value in items.items()],
+            )
+            self._conn.execute('COMMIT')
+            self._evict(len(items))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table}')
+            self._pending_access, self._max_rows = {}, 0
+
+    def _evict(self, num_inserted: int) -> None:
+        """method to evict the least recently used entries, once the table may hold more than `max_entries`.
+
+        Args:
+            num_inserted (int): rows just inserted or replaced.
+        """
+        if self.max_entries is None:
+            return
+        if self._max_rows is not None and self._max_rows + num_inserted <= self.max_entries:
+            self._max_rows += num_inserted
+            return
+
+        # evicted entries are picked by recency, buffered hits must be written first.
+        self._flush_access()
+        rows = self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        if rows > self.max_entries:
+            target = int(self.max_entries * (1 - EVICTION_SLACK))
+            self._conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN '
+                f'(SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)',
+                (rows - target,),
+            )
+            rows = target
+        self._max_rows = rows
@@ -0,0 +1,77 @@
+import typing as t
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.memory.chat_memory_buffer import ChatMemoryBuffer
+
+from ..telemetry import count
+from .packer import split_sentences, truncate_to_tokens
+
+
+class PackedChatMemoryBuffer(ChatMemoryBuffer):
+    """Chat memory sending a token budgeted history to the llm, the full history is still stored.
+    The last `recent_messages` messages are kept as is, older ones are truncated to their leading sentences
+    within `older_message_tokens`, and the oldest turns are dropped until the history fits in
+    `history_token_budget`, the last turn being truncated if it does not fit on its own.
+    Truncating instead of summarizing keeps every turn to a single llm call.
+    """
+
+    history_token_budget: int = Field(default=1024, gt=0, description='tokens of the history sent to the llm.')
+    recent_messages: int = Field(default=4, ge=0, description='latest messages kept in full.')
+    older_message_tokens: int = Field(default=64, gt=0, description='tokens kept of every older message.')
+    _last_packing: dict[str, int] = PrivateAttr(default_factory=lambda: {'full_tokens': 0, 'packed_tokens': 0})
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'PackedChatMemoryBuffer'
+
+    @property
+    def last_packing(self) -> dict[str, int]:
+        """tokens of the history before and after packing, as of the last `get`."""
+        return dict(self._last_packing)
+
+    def _truncate_message(self, message: ChatMessage, max_tokens: int) -> ChatMessage:
+        """keep the leading sentences of a message within `max_tokens`."""
+        content = message.content or ''
+        if len(self.tokenizer_fn(content)) <= max_tokens:
+            return message
+        text = ''
+        for sentence in split_sentences(content):
+            candidate = f'{text} {sentence}'.strip()
+            if len(self.tokenizer_fn(f'{candidate} …')) > max_tokens:
+                break
+            text = candidate
+        # a first sentence longer than the budget is cut at a word boundary instead.
+        text = f'{text} …' if text else truncate_to_tokens(content, max_tokens, self.tokenizer_fn)
+        return ChatMessage(role=message.role, content=text, additional_kwargs=message.additional_kwargs)
+
+    def get(self, input: str | None = None, initial_token_count: int = 0, **kwargs: t.Any) -> list[ChatMessage]:
+        """method to get the packed history, see the class docstring.
+
+        Args:
+            input (str | None, optional): user message of the turn. Defaults to None.
+            initial_token_count (int, optional): tokens already used by the prompt. Defaults to 0.
+
+        Returns:
+            list[ChatMessage]: history to send to the llm, never starting with an assistant or tool message.
+        """
+        messages = super().get(input=input, initial_token_count=initial_token_count, **kwargs)
+        full_tokens = self._token_count_for_messages(messages)
+
+        n_older = max(len(messages) - self.recent_messages, 0)
+        packed = [self._truncate_message(message, self.older_message_tokens) for message in messages[:n_older]]
+        packed += messages[n_older:]
+        while len(packed) > 2 and self._token_count_for_messages(packed) > self.history_token_budget:
+            packed.pop(0)
+            # the history has to start with a user message, like `ChatMemoryBuffer.get`.
+            while len(packed) > 1 and packed[0].role in (MessageRole.ASSISTANT, MessageRole.TOOL):
+                packed.pop(0)
+        if self._token_count_for_messages(packed) > self.history_token_budget:
+            # the last turn alone is over the budget, it is truncated rather than dropped.
+            packed = [self._truncate_message(message, self.history_token_budget // len(packed)) for message in packed]
+
+        packed_tokens = self._token_count_for_messages(packed)
+        self._last_packing = {'full_tokens': full_tokens, 'packed_tokens': packed_tokens}
+        count('history_tokens', full_tokens, stage='full')
+        count('history_tokens', packed_tokens, stage='packed')
+        return packed
@@ -0,0 +1,178 @@
+import re
+import typing as t
+from dataclasses import dataclass, field
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+from ..stores.sparse import tokenize
+from ..telemetry import count
+
+# sentence boundaries, a punctuation mark followed by whitespace.
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+# marks the sentences dropped between two kept ones.
+ELLIPSIS = ' … '
+
+
+def split_sentences(text: str) -> list[str]:
+    """helper function to split a text into sentences, whitespace within a sentence is collapsed."""
+    return [' '.join(sentence.split()) for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, tokenizer: t.Callable[[str], list]) -> str:
+    """function to keep the leading words of a text within a number of tokens.
+
+    Args:
+        text (str): text to truncate.
+        max_tokens (int): maximum number of tokens of the truncated text.
+        tokenizer (t.Callable[[str], list]): tokenizer of the llm.
+
+    Returns:
+        str: the text itself if it fits, otherwise its longest fitting prefix of whole words followed by `…`.
+    """
+    if len(tokenizer(text)) <= max_tokens:
+        return text
+    words = text.split()
+    # binary search on the number of words, the token count grows with it.
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if len(tokenizer(' '.join(words[:mid]) + ' …')) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return ' '.join(words[:low]) + ' …' if low else ''
+
+
+@dataclass
+class _Candidate:
+    """retrieved node bringing at least one new sentence to the context."""
+
+    node_with_score: NodeWithScore
+    sentences: list[str]
+    original_tokens: int
+    merged_node_ids: list[str] = field(default_factory=list)
+
+
+class PackedNode(NodeWithScore):
+    """Retrieved node as packed into the context, along with the tokens it saved."""
+
+    original_tokens: int = Field(default=0, description='tokens of the retrieved node and its merged duplicates.')
+    packed_tokens: int = Field(default=0, description='tokens of the node in the context.')
+    merged_node_ids: list[str] = Field(default_factory=list, description='duplicates merged into the node.')
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """Node postprocessor packing the retrieved nodes into a token budget before the llm call.
+    Chunks overlap, and their metadata (keywords especially) is repeated in every one, so:
+      - sentences already in a better ranked node are dropped, nodes left without a new sentence are merged
+        into the node their sentences come from.
+      - metadata only useful for retrieval, `excerpt_keywords` by default, is hidden from the llm.
+      - the budget is shared in rank order, a node over its share keeps the sentences sharing the most terms
+        with the query, in their original order, while the unused share of a node goes to the next ones.
+
+    Nodes are returned as `PackedNode` copies, the docstore and the cached responses keep the original text.
+    """
+
+    token_budget: int = Field(default=1536, gt=0, description='tokens of the packed nodes, metadata included.')
+    hidden_metadata_keys: list[str] = Field(
+        default_factory=lambda: ['excerpt_keywords'], description='metadata keys hidden from the llm.'
+    )
+    _tokenizer: t.Callable[[str], list] = PrivateAttr(default_factory=get_tokenizer)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'ContextPacker'
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self._tokenizer(text))
+
+    def _postprocess_nodes(
+        self, nodes: list[NodeWithScore], query_bundle: QueryBundle | None = None
+    ) -> list[NodeWithScore]:
+        query_terms = set(tokenize(query_bundle.query_str)) if query_bundle is not None else set()
+
+        kept: list[_Candidate] = []
+        sentence_owners: dict[str, int] = {}
+        for node_with_score in nodes:
+            original_tokens = self._count_tokens(node_with_score.node.get_content(metadata_mode=MetadataMode.LLM))
+            sentences = split_sentences(node_with_score.node.get_content(metadata_mode=MetadataMode.NONE))
+            keys = [sentence.lower() for sentence in sentences]
+            new_sentences = [sentence for sentence, key in zip(sentences, keys) if key not in sentence_owners]
+            if not new_sentences and keys:
+                # a duplicate, its tokens are saved by the node holding its first sentence.
+                owner = kept[sentence_owners[keys[0]]]
+                owner.original_tokens += original_tokens
+                owner.merged_node_ids.append(node_with_score.node.node_id)
+                continue
+            for key in keys:
+                sentence_owners.setdefault(key, len(kept))
+            kept.append(_Candidate(node_with_score, new_sentences, original_tokens))
+
+        packed, remaining = [], self.token_budget
+        for i, candidate in enumerate(kept):
+            original = candidate.node_with_score.node
+            node = original.model_copy(
+                update={
+                    'excluded_llm_metadata_keys': list(
+                        dict.fromkeys([*original.excluded_llm_metadata_keys, *self.hidden_metadata_keys])
+                    )
+                }
+            )
+            share = remaining // (len(kept) - i)
+            # tokens of the node without text: its metadata and the template around them.
+            node.set_content('')
+            text_budget = share - self._count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+            if text_budget <= 0:
+                continue
+            node.set_content(self._select_sentences(candidate.sentences, query_terms, text_budget))
+            packed_tokens = self._count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+            remaining -= packed_tokens
+            packed.append(
+                PackedNode(
+                    node=node,
+                    score=candidate.node_with_score.score,
+                    original_tokens=candidate.original_tokens,
+                    packed_tokens=packed_tokens,
+                    merged_node_ids=candidate.merged_node_ids,
+                )
+            )
+
+        count('context_tokens', sum(candidate.original_tokens for candidate in kept), stage='retrieved')
+        count('context_tokens', sum(node.packed_tokens for node in packed), stage='packed')
+        return packed
+
+    def _select_sentences(self, sentences: list[str], query_terms: set[str], max_tokens: int) -> str:
+        """method to keep the sentences most relevant to the query within `max_tokens`, in their original order."""
+        sentence_tokens = [self._count_tokens(sentence) for sentence in sentences]
+        if sum(sentence_tokens) <= max_tokens:
+            return ' '.join(sentences)
+
+        overlaps = [len(query_terms.intersection(tokenize(sentence))) for sentence in sentences]
+        # most query terms first, earlier sentences first on ties.
+        ranked = sorted(range(len(sentences)), key=lambda i: (-overlaps[i], i))
+        selected, used = [], 0
+        for i in ranked:
+            # every gap between two kept sentences costs an ellipsis.
+            if used + sentence_tokens[i] + 1 <= max_tokens:
+                selected.append(i)
+                used += sentence_tokens[i] + 1
+        if not selected:
+            return truncate_to_tokens(sentences[ranked[0]], max_tokens, self._tokenizer)
+
+        # separators are not counted exactly, the least relevant sentences go until the text fits.
+        text = self._join_sentences(sentences, sorted(selected))
+        while len(selected) > 1 and self._count_tokens(text) > max_tokens:
+            selected.pop()
+            text = self._join_sentences(sentences, sorted(selected))
+        return truncate_to_tokens(text, max_tokens, self._tokenizer)
+
+    @staticmethod
+    def _join_sentences(sentences: list[str], selected: list[int]) -> str:
+        """join the selected sentences, an ellipsis marks every gap between two of them."""
+        text = sentences[selected[0]]
+        for previous, i in zip(selected, selected[1:]):
+            text += (' ' if i == previous + 1 else ELLIPSIS) + sentences[i]
+        return text
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from ..telemetry import count, observe, span
+
+
+class _Request(t.NamedTuple):
+    """query waiting for its embedding."""
+
+    query: str
+    future: Future
+    enqueued: float
+
+
+def embed_queries(embed_model: BaseEmbedding, queries: list[str]) -> list[Embedding]:
+    """function to embed several queries at once, in as few forward passes as the model allows.
+    Models of this package batch them with `get_query_embedding_batch`, others embed them one at a time.
+
+    Args:
+        embed_model (BaseEmbedding): embedding model.
+        queries (list[str]): queries to embed.
+
+    Returns:
+        list[Embedding]: embedding per query.
+    """
+    if (get_query_embedding_batch := getattr(embed_model, 'get_query_embedding_batch', None)) is not None:
+        return get_query_embedding_batch(queries)
+    return [embed_model.get_query_embedding(query) for query in queries]
+
+
+class MicroBatchingEmbedding(BaseEmbedding):
+    """Embedding model wrapper gathering concurrent query embeddings into micro-batches.
+    A single short question is dominated by the fixed cost of a forward pass (tokenization, python and
+    kernel launch overhead), so queries are queued instead: a dispatcher thread takes the oldest one, waits
+    at most `max_wait_ms` after its arrival for others, up to `max_batch_size`, and hands the batch to one of
+    `workers` threads embedding it in a single forward pass. While every worker is busy, queries keep queueing
+    and the next batch takes them at once, so batches grow with the load while the latency of a query stays
+    bounded by the wait window and the forward passes ahead of it.
+    Text embeddings, already batched by the ingest pipeline, go straight to the wrapped model.
+    """
+
+    max_batch_size: int = Field(default=32, gt=0, description='max queries per forward pass.')
+    max_wait_ms: float = Field(default=2.0, ge=0, description='max wait for more queries after the first one.')
+    workers: int = Field(default=1, gt=0, description='threads running forward passes.')
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _embed_queries: t.Callable[[list[str]], list[Embedding]] = PrivateAttr()
+    _queue: queue.SimpleQueue | None = PrivateAttr(default=None)
+    _pid: int | None = PrivateAttr(default=None)
+    _start_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        embed_queries: t.Callable[[list[str]], list[Embedding]] | None = None,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to wrap the embedding model.
+
+        Args:
+            embed_model (BaseEmbedding): embedding model to embed the batches with.
+            embed_queries (t.Callable[[list[str]], list[Embedding]] | None, optional): function embedding a list of
+            queries in a single forward pass, e.g. `HuggingFaceEmbedding._embed` with the query prompt. Defaults to
+            None, one `get_query_embedding` call per query.
+            **kwargs: `max_batch_size`, `max_wait_ms`, `workers` and `model_name`, defaults to the wrapped one.
+        """
+        kwargs.setdefault('model_name', embed_model.model_name)
+        super().__init__(embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._embed_queries = embed_queries or (lambda queries: [embed_model.get_query_embedding(q) for q in queries])
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'MicroBatchingEmbedding'
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        """wrapped embedding model."""
+        return self._embed_model
+
+    def _requests(self) -> queue.SimpleQueue:
+        """queue of the dispatcher, started on first use and again in a forked process, threads do not survive fork."""
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    requests = queue.SimpleQueue()
+                    executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='embed-batch')
+                    threading.Thread(
+                        target=self._dispatch,
+                        args=(requests, threading.Semaphore(self.workers), executor),
+                        name='embed-dispatch',
+                        daemon=True,
+                    ).start()
+                    self._queue, self._pid = requests, os.getpid()
+        return self._queue
+
+    def _dispatch(self, requests: queue.SimpleQueue, slots: threading.Semaphore, executor: ThreadPoolExecutor) -> None:
+        """loop of the dispatcher thread, a batch is only formed once a worker is free to embed it."""
+        while True:
+            slots.acquire()
+            batch = [requests.get()]
+            deadline = batch[0].enqueued + self.max_wait_ms / 1e3
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(requests.get(timeout=timeout) if timeout > 0 else requests.get_nowait())
+                except queue.Empty:
+                    break
+            executor.submit(self._embed_batch, batch).add_done_callback(lambda _: slots.release())
+
+    def _embed_batch(self, batch: list[_Request]) -> None:
+        start = time.perf_counter()
+        # queries cancelled while queued, e.g. by a client disconnecting, are not embedded.
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        for request in batch:
+            observe('embedding.queue_wait', start - request.enqueued)
+
+        queries = list(dict.fromkeys(request.query for request in batch))
+        try:
+            with span('embedding.batch'):
+                embeddings = dict(zip(queries, self._embed_queries(queries)))
+        except Exception as error:
+            for request in batch:
+                request.future.set_exception(error)
+            return
+
+        count('embedding_batches')
+        count('embedding_batch_queries', len(batch))
+        for request in batch:
+            request.future.set_result(list(embeddings[request.query]))
+
+    def _submit(self, query: str) -> Future:
+        future = Future()
+        self._requests().put(_Request(query, future, time.perf_counter()))
+        return future
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._submit(query).result()
+
+    def get_query_embedding_batch(self, queries: list[str]) -> list[Embedding]:
+        """method to embed several queries, queued at once so they share forward passes."""
+        futures = [self._submit(query) for query in queries]
+        return [future.result() for future in futures]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        # the event loop is not blocked while the batch is gathered and embedded.
+        return await asyncio.wrap_future(self._submit(query))
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed_model.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self._embed_model.aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._embed_model.get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await self._embed_model.aget_text_embedding_batch(texts)
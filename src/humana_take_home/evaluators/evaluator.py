@@ -1,9 +1,12 @@
 import typing as t
 
+from llama_index.core.async_utils import run_jobs
 from llama_index.core.chat_engine.types import BaseChatEngine
-from llama_index.core.evaluation import BatchEvalRunner
+from llama_index.core.evaluation import BatchEvalRunner, EvaluationResult
 from tqdm import tqdm
 
+from humana_take_home.caches.evaluation import EvaluationCache
+from humana_take_home.telemetry import count, span
 from humana_take_home.utils import get_default_ollama_llm
 
 from .utils import EVAL_DICT_MAPPER
@@ -20,9 +23,17 @@ class ResponseEvaluator:
     def __init__(
         self,
         use_correctness: bool = True,
+        response_workers: int = 4,
+        cache: EvaluationCache | None = None,
     ) -> None:
+        # number of questions answered concurrently, bounded as every answer is a full llm generation.
+        self.response_workers = response_workers
+        # answers and judge results of previous runs, only what changed since is recomputed.
+        self.cache = cache
+
         # define the evaluators to use for the evaluation.
         self.llm = get_default_ollama_llm(temperature=0.0)
+        self.judge_model = getattr(self.llm, 'model', self.llm.class_name())  # part of the cache keys of results.
         self.evaluators = {
             'relevancy': EVAL_DICT_MAPPER['relevancy'](llm=self.llm),
             'faithfullness': EVAL_DICT_MAPPER['faithfullness'](llm=self.llm),
@@ -37,12 +48,15 @@ class ResponseEvaluator:
             show_progress=True,
         )
 
-    async def evaluate(self, data: dict[str, list[str]], chat_engine: BaseChatEngine) -> t.Any:
+    async def evaluate(
+        self, data: dict[str, list[str]], chat_engine: BaseChatEngine | t.Callable[[], BaseChatEngine]
+    ) -> t.Any:
         """a method to evaluate the responses from the chatbot using different metrics.
 
         Args:
             data (dict[str, list[str]]): query and ground truth data to evaluate the responses.
-            chat_engine (BaseChatEngine): chat engine to be evaluated.
+            chat_engine (BaseChatEngine | t.Callable[[], BaseChatEngine]): chat engine to be evaluated, or a
+            factory creating an engine with its own memory, which lets the questions be answered concurrently.
 
         Returns:
             t.Any: dict of evaluation results for all metrics.
@@ -55,34 +69,102 @@ class ResponseEvaluator:
             chat_engine=chat_engine,
         )
 
-        eval_results = await self.batch_eval_runner.aevaluate_responses(
-            queries=data['questions'],
-            responses=responses,
-            references=data.get('ground_truth', None),
-        )
+        if self.cache is not None:
+            return await self.__evaluate_cached(
+                questions=data['questions'],
+                responses=responses,
+                references=data.get('ground_truth', None),
+            )
+
+        with span('evaluation.judge_batch'):
+            eval_results = await self.batch_eval_runner.aevaluate_responses(
+                queries=data['questions'],
+                responses=responses,
+                references=data.get('ground_truth', None),
+            )
 
         return eval_results
 
+    async def __evaluate_cached(
+        self,
+        questions: list[str],
+        responses: list[t.Any],
+        references: list[str] | None,
+    ) -> dict[str, list[EvaluationResult]]:
+        """method to judge the responses with every metric, reusing and checkpointing results in the cache.
+
+        Args:
+            questions (list[str]): list of evaluated questions.
+            responses (list[t.Any]): responses to the questions.
+            references (list[str] | None): ground truth answers to the questions.
+
+        Returns:
+            dict[str, list[EvaluationResult]]: evaluation results per metric, same as `BatchEvalRunner`.
+        """
+        references = references or [None] * len(questions)
+
+        async def judge(metric: str, question: str, reference: str | None, response: t.Any) -> EvaluationResult:
+            result = self.cache.get_result(metric, self.judge_model, question, reference, response)
+            count('evaluation_cache_lookups', kind='result', result='miss' if result is None else 'hit')
+            if result is not None:
+                return result
+
+            with span('evaluation.judge', metric=metric):
+                result = await self.evaluators[metric].aevaluate_response(
+                    query=question, response=response, reference=reference
+                )
+            self.cache.set_result(metric, self.judge_model, question, reference, response, result)
+            return result
+
+        jobs = [
+            judge(metric, question, reference, response)
+            for metric in self.evaluators
+            for question, reference, response in zip(questions, references, responses)
+        ]
+        results = await run_jobs(jobs, show_progress=True, workers=4, desc='Evaluating responses')
+        return {
+            metric: results[i * len(questions) : (i + 1) * len(questions)] for i, metric in enumerate(self.evaluators)
+        }
+
     async def __get_responses(
         self,
         questions: list[str],
-        chat_engine: BaseChatEngine,
+        chat_engine: BaseChatEngine | t.Callable[[], BaseChatEngine],
     ) -> t.Any:
         """method to get the responses from chat engine for the given questions.
+        With an engine factory, every question gets a fresh engine (and memory) and up to `response_workers`
+        questions are answered concurrently, a single stateful engine has to answer them one at a time.
 
         Args:
             questions (list[str]): list of questions to generate responses for.
-            chat_engine (BaseChatEngine): chat engine to be used for generating responses.
+            chat_engine (BaseChatEngine | t.Callable[[], BaseChatEngine]): chat engine, or engine factory, to be
+            used for generating responses.
 
         Returns:
             t.Any: list of responses for the input questions.
         """
+
+        async def answer(question: str, engine: BaseChatEngine) -> t.Any:
+            if self.cache is not None:
+                response = self.cache.get_response(question)
+                count('evaluation_cache_lookups', kind='response', result='miss' if response is None else 'hit')
+                if response is not None:
+                    return response
+
+            with span('evaluation.answer'):
+                response = await engine.achat(message=question, chat_history=None)
+            if self.cache is not None:
+                self.cache.set_response(question, response)  # checkpoint, an interrupted run resumes from here.
+            return response
+
+        if not isinstance(chat_engine, BaseChatEngine):
+            # every question starts from an empty memory, same as the serial run resetting the engine.
+            jobs = [answer(question, chat_engine()) for question in questions]
+            return await run_jobs(jobs, show_progress=True, workers=self.response_workers, desc='Generating responses')
+
         responses = []
         for _, question in tqdm(enumerate(questions), total=len(questions), desc='Generating responses'):
-            response = await chat_engine.achat(
-                message=question,
-                chat_history=None,
-            )
+            response = await answer(question, chat_engine)
             chat_engine.reset()
             responses.append(response)
         return responses
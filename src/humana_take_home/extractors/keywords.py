@@ -0,0 +1,137 @@
+import hashlib
+import re
+import typing as t
+
+from llama_index.core.async_utils import run_jobs
+from llama_index.core.bridge.pydantic import Field, PrivateAttr, SerializeAsAny
+from llama_index.core.extractors import BaseExtractor
+from llama_index.core.extractors.metadata_extractors import DEFAULT_KEYWORD_EXTRACT_TEMPLATE
+from llama_index.core.llms import LLM
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.schema import BaseNode, TextNode
+
+from ..caches.sqlite import SQLiteCache
+from ..prompts.keywords import BATCH_KEYWORD_EXTRACT_PROMPT, EXCERPT_TEMPLATE
+from ..telemetry import count
+
+# matches answer lines like `3: kw1, kw2` or `[3] kw1, kw2`.
+_ANSWER_LINE = re.compile(r'^\s*\[?(\d+)\]?\s*[:.)\]-]?\s*(.+?)\s*$')
+
+
+class BatchKeywordExtractor(BaseExtractor):
+    """Keyword extractor packing `batch_size` nodes into a single llm call, with up to `num_workers`
+    calls in flight at once. Keywords are cached by (model, number of keywords, node content) hash,
+    so re-indexing unchanged text never reaches the llm. Drop-in replacement of `KeywordExtractor`,
+    sets the same `excerpt_keywords` metadata field.
+    """
+
+    llm: SerializeAsAny[LLM] = Field(description='The LLM to use for generation.')
+    keywords: int = Field(default=5, description='The number of keywords to extract.', gt=0)
+    batch_size: int = Field(default=8, description='The number of nodes sent in a single llm call.', gt=0)
+
+    _cache: SQLiteCache | None = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        llm: LLM,
+        keywords: int = 5,
+        batch_size: int = 8,
+        num_workers: int = 4,
+        cache: SQLiteCache | None = None,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to initialize the extractor.
+
+        Args:
+            llm (LLM): llm to extract the keywords with.
+            keywords (int, optional): number of keywords per node. Defaults to 5.
+            batch_size (int, optional): number of nodes per llm call. Defaults to 8.
+            num_workers (int, optional): max number of concurrent llm calls. Defaults to 4.
+            cache (SQLiteCache | None, optional): cache for the extracted keywords. Defaults to None.
+        """
+        super().__init__(llm=llm, keywords=keywords, batch_size=batch_size, num_workers=num_workers, **kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'BatchKeywordExtractor'
+
+    def _key(self, context_str: str) -> str:
+        model = getattr(self.llm, 'model', self.llm.class_name())
+        return hashlib.sha256(f'{model}\0{self.keywords}\0{context_str}'.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    async def _aextract_single(self, context_str: str) -> str:
+        """fallback for excerpts missing from a batch answer, same prompt as `KeywordExtractor`."""
+        keywords = await self.llm.apredict(
+            PromptTemplate(template=DEFAULT_KEYWORD_EXTRACT_TEMPLATE),
+            keywords=self.keywords,
+            context_str=context_str,
+        )
+        return keywords.strip()
+
+    async def _aextract_batch(self, context_strs: list[str]) -> list[str]:
+        """method to extract the keywords of several excerpts with a single llm call.
+
+        Args:
+            context_strs (list[str]): content of the nodes.
+
+        Returns:
+            list[str]: comma separated keywords per excerpt.
+        """
+        if len(context_strs) == 1:
+            return [await self._aextract_single(context_strs[0])]
+
+        answer = await self.llm.apredict(
+            PromptTemplate(template=BATCH_KEYWORD_EXTRACT_PROMPT),
+            num_excerpts=len(context_strs),
+            excerpts='\n'.join(
+                EXCERPT_TEMPLATE.format(number=i, context_str=context_str)
+                for i, context_str in enumerate(context_strs, start=1)
+            ),
+            keywords=self.keywords,
+        )
+
+        parsed: dict[int, str] = {}
+        for line in answer.splitlines():
+            if (match := _ANSWER_LINE.match(line)) is not None:
+                parsed.setdefault(int(match.group(1)), match.group(2))
+
+        # llms occasionally skip or merge excerpts, those are asked again one by one.
+        return [
+            parsed[i] if i in parsed else await self._aextract_single(context_str)
+            for i, context_str in enumerate(context_strs, start=1)
+        ]
+
+    async def aextract(self, nodes: t.Sequence[BaseNode]) -> list[dict]:
+        context_strs = [
+            node.get_content(metadata_mode=self.metadata_mode)
+            if not self.is_text_node_only or isinstance(node, TextNode)
+            else None
+            for node in nodes
+        ]
+        keys = [self._key(context_str) if context_str is not None else None for context_str in context_strs]
+        found = self._cache.get_many([key for key in keys if key is not None]) if self._cache is not None else {}
+
+        # unique cache misses, identical chunks (e.g. boilerplate pages) are extracted once.
+        misses = list(dict.fromkeys(key for key in keys if key is not None and key not in found))
+        if self._cache is not None:
+            count('keywords_cache_lookups', len(found), result='hit')
+            count('keywords_cache_lookups', len(misses), result='miss')
+        miss_context = {key: context_str for key, context_str in zip(keys, context_strs) if key in misses}
+        batches = [misses[start : start + self.batch_size] for start in range(0, len(misses), self.batch_size)]
+        results = await run_jobs(
+            [self._aextract_batch([miss_context[key] for key in batch]) for batch in batches],
+            show_progress=self.show_progress,
+            workers=self.num_workers,
+        )
+
+        extracted = {
+            key: keywords
+            for batch, batch_keywords in zip(batches, results)
+            for key, keywords in zip(batch, batch_keywords)
+        }
+        if self._cache is not None and extracted:
+            self._cache.set_many({key: keywords.encode() for key, keywords in extracted.items()})
+
+        keywords_by_key = {**{key: value.decode() for key, value in found.items()}, **extracted}
+        return [{'excerpt_keywords': keywords_by_key[key]} if key is not None else {} for key in keys]
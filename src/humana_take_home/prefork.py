@@ -0,0 +1,343 @@
+import asyncio
+import gc
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import typing as t
+from logging import getLogger
+
+from humana_take_home.caches.sqlite import SQLiteCache
+from humana_take_home.stores.io import atomic_write
+from humana_take_home.telemetry import count, telemetry
+
+if t.TYPE_CHECKING:
+    from humana_take_home.server import ChatServer
+
+logger = getLogger(__name__)
+
+SUPERVISOR = 'supervisor'
+# fields of `/proc/self/smaps_rollup` (kB) added up into the reported memory.
+_SMAPS_FIELDS = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'private',
+    'Private_Dirty': 'private',
+}
+
+
+def process_memory() -> dict[str, int]:
+    """function to measure the memory of the current process, in bytes.
+    `shared` counts the resident pages also mapped by other processes, e.g. the index and models inherited from
+    the prefork parent, `private` the pages of this process only, and `pss` splits every shared page evenly
+    between the processes mapping it, so the `pss` of all the processes adds up to their actual footprint.
+    Only the peak `rss` is known where `/proc/self/smaps_rollup` is not available.
+
+    Returns:
+        dict[str, int]: `rss`, `pss`, `shared` and `private` bytes, or `peak_rss` only.
+    """
+    memory = dict.fromkeys(('rss', 'pss', 'shared', 'private'), 0)
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if (key := _SMAPS_FIELDS.get(name)) is not None:
+                    memory[key] += int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+
+        # kilobytes on linux, bytes on macos.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'peak_rss': peak_rss if sys.platform == 'darwin' else peak_rss * 1024}
+    return memory
+
+
+class WorkerStatusBoard:
+    """Directory of json status files, one per worker of a prefork server and one for the supervisor.
+    Every worker rewrites its own file every `interval` seconds, with its requests, memory and metrics, so any
+    worker reports the health and the metrics of the whole pool, and the supervisor restarts the workers whose
+    file is older than `timeout` seconds. Files are replaced atomically, readers never see a partial status.
+    """
+
+    def __init__(self, path: str, interval: float = 1.0, timeout: float = 30.0) -> None:
+        """constructor to initialize the board in an existing directory.
+
+        Args:
+            path (str): directory of the status files.
+            interval (float, optional): seconds between two status updates of a process. Defaults to 1.0.
+            timeout (float, optional): seconds without update after which a worker is unresponsive. Defaults to 30.0.
+        """
+        self.path = path
+        self.interval = interval
+        self.timeout = timeout
+
+    def write(self, name: str, status: dict[str, t.Any]) -> None:
+        """method to publish the status of a process, named `worker-<n>` or `supervisor`."""
+        atomic_write(os.path.join(self.path, f'{name}.json'), json.dumps(status).encode())
+
+    def read(self) -> dict[str, dict[str, t.Any]]:
+        """method to read the last status of every process.
+
+        Returns:
+            dict[str, dict[str, t.Any]]: status by process name, workers in order.
+        """
+        statuses = {}
+        for file_name in sorted(os.listdir(self.path), key=lambda name: (len(name), name)):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, file_name)) as f:
+                    statuses[file_name.removesuffix('.json')] = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed in the meantime.
+        return statuses
+
+    def remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, f'{name}.json'))
+        except FileNotFoundError:
+            pass
+
+    def is_alive(self, status: dict[str, t.Any]) -> bool:
+        """check if a process updated its status within the timeout."""
+        return time.time() - status['heartbeat'] <= self.timeout
+
+
+def render_worker_gauges(workers: list[dict[str, t.Any]], board: WorkerStatusBoard, namespace: str) -> str:
+    """function to render the health of the workers as Prometheus gauges, labelled by worker.
+
+    Args:
+        workers (list[dict[str, t.Any]]): status of every worker, see `ChatServer.status`.
+        board (WorkerStatusBoard): board the statuses were read from.
+        namespace (str): prefix of the metric names.
+
+    Returns:
+        str: `# TYPE` header followed by the samples of every gauge.
+    """
+    lines = [f'# TYPE {namespace}_worker_up gauge']
+    lines.extend(f'{namespace}_worker_up{{worker="{w["worker"]}"}} {int(board.is_alive(w))}' for w in workers)
+    lines.append(f'# TYPE {namespace}_worker_in_flight gauge')
+    lines.extend(f'{namespace}_worker_in_flight{{worker="{w["worker"]}"}} {w["in_flight"]}' for w in workers)
+    lines.append(f'# TYPE {namespace}_worker_memory_bytes gauge')
+    lines.extend(
+        f'{namespace}_worker_memory_bytes{{worker="{w["worker"]}",kind="{kind}"}} {value}'
+        for w in workers
+        for kind, value in w['memory'].items()
+    )
+    return '\n'.join(lines) + '\n'
+
+
+class PreforkServer:
+    """Supervisor serving a `ChatServer` with several forked worker processes.
+    The agent (vector index, models and caches) is loaded once by this process before forking, and the workers
+    share its memory copy-on-write instead of loading their own copy: memory-mapped vectors, codes and node
+    records are shared page cache, and the python objects loaded so far are frozen out of the garbage
+    collector, whose passes would otherwise write to, and copy, every page holding them.
+    Every worker runs its own event loop and GIL on its own listening socket bound to the same port with
+    `SO_REUSEPORT`, so the kernel spreads connections evenly across them (one socket accepted by all the workers
+    where not supported). Chat sessions are kept in a SQLite file shared by the workers, so the turns of a
+    session can land on any of them. Workers that exit, or stop updating their status, are restarted.
+    """
+
+    def __init__(
+        self,
+        server: 'ChatServer',
+        workers: int = 2,
+        heartbeat_timeout: float = 30.0,
+        status_interval: float = 1.0,
+        shutdown_timeout: float = 30.0,
+    ) -> None:
+        """constructor to initialize the supervisor with a loaded server.
+
+        Args:
+            server (ChatServer): server to run in every worker, with its agent already loaded.
+            workers (int, optional): number of worker processes. Defaults to 2.
+            heartbeat_timeout (float, optional): seconds without status update after which a worker is killed and
+            restarted, e.g. stuck in a blocking call. Defaults to 30.0.
+            status_interval (float, optional): seconds between two status updates of a worker. Defaults to 1.0.
+            shutdown_timeout (float, optional): seconds given to the workers to answer the requests in flight
+            when stopping, before they are killed. Defaults to 30.0.
+        """
+        if workers < 1:
+            raise ValueError(f'at least one worker is required, got {workers}')
+        self.server = server
+        self.workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.status_interval = status_interval
+        self.shutdown_timeout = shutdown_timeout
+        self._pids: dict[int, int] = {}  # worker of every live pid.
+        self._started: dict[int, float] = {}
+        self._killed: set[int] = set()
+        self._restarts = 0
+        self._stopping = False
+
+    def _bind(self, host: str, port: int) -> list[socket.socket]:
+        """method to open the listening sockets, one per worker when `SO_REUSEPORT` is supported."""
+        reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        sockets = []
+        for _ in range(self.workers if reuse_port else 1):
+            sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            sock.listen(1024)
+            sock.setblocking(False)
+            port = sock.getsockname()[1]  # the port picked by the first socket, if 0.
+            sockets.append(sock)
+        return sockets
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8000) -> None:
+        """method to fork the workers and supervise them until SIGINT or SIGTERM.
+
+        Args:
+            host (str, optional): interface to bind. Defaults to '127.0.0.1'.
+            port (int, optional): port to bind. Defaults to 8000.
+        """
+        self._sockets = self._bind(host, port)
+        run_dir = tempfile.mkdtemp(prefix='hth-prefork-')
+        self.board = WorkerStatusBoard(run_dir, interval=self.status_interval, timeout=self.heartbeat_timeout)
+        self.sessions_path = os.path.join(run_dir, 'sessions.sqlite')
+        logger.info(f'Serving on http://{host}:{self._sockets[0].getsockname()[1]} with {self.workers} workers')
+
+        # nothing loaded so far is freed in the workers, collect once and keep it out of the later passes.
+        gc.collect()
+        gc.freeze()
+        telemetry.flush()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._stop)
+        try:
+            for worker in range(self.workers):
+                self._spawn(worker)
+            while not self._stopping:
+                self._publish()
+                time.sleep(self.status_interval)
+                self._reap()
+                self._kill_unresponsive()
+        finally:
+            self._stop_workers()
+            for sock in self._sockets:
+                sock.close()
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    def _stop(self, signum: int, frame: t.Any) -> None:
+        self._stopping = True
+
+    def _spawn(self, worker: int) -> None:
+        """method to fork a worker process, that never returns into the supervisor loop."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if pid := os.fork():
+            self._pids[pid] = worker
+            self._started[pid] = time.time()
+            logger.info(f'Started worker {worker} (pid {pid})')
+            return
+
+        exit_code = 0
+        try:
+            self._run_worker(worker)
+        except BaseException:
+            logger.exception(f'worker {worker} failed')
+            exit_code = 1
+        finally:
+            telemetry.close()
+            # skips the exit handlers inherited from the supervisor.
+            os._exit(exit_code)
+
+    def _run_worker(self, worker: int) -> None:
+        sock = self._sockets[worker % len(self._sockets)]
+        for other in self._sockets:
+            if other is not sock:
+                other.close()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)  # until the event loop of the server handles them.
+        telemetry.after_fork()
+        self._limit_torch_threads()
+
+        sessions = SQLiteCache(self.sessions_path, table='sessions', max_entries=self.server.sessions.max_sessions)
+        self.server.join_pool(worker, self.board, sessions)
+        asyncio.run(self.server.serve(sock=sock))
+
+    def _limit_torch_threads(self) -> None:
+        """split the cores between the workers, unless `EMBEDDINGS_NUM_THREADS` is set, instead of every worker
+        running forward passes on all of them."""
+        if (torch := sys.modules.get('torch')) is not None and not os.getenv('EMBEDDINGS_NUM_THREADS'):
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+
+    def _publish(self) -> None:
+        """method to publish the status of the supervisor, its metrics include the restarts and loading time."""
+        self.board.write(
+            SUPERVISOR,
+            {
+                'pid': os.getpid(),
+                'heartbeat': time.time(),
+                'workers': self.workers,
+                'restarts': self._restarts,
+                'memory': process_memory(),
+                'telemetry': telemetry.snapshot(),
+            },
+        )
+
+    def _reap(self) -> None:
+        """method to collect the workers that exited, and start them again unless stopping."""
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if (worker := self._pids.pop(pid, None)) is None:
+                continue
+            del self._started[pid]
+            if self._stopping:
+                continue
+
+            reason = 'timeout' if pid in self._killed else 'exit'
+            self._killed.discard(pid)
+            self._restarts += 1
+            count('prefork_worker_restarts', reason=reason)
+            logger.warning(
+                f'worker {worker} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting it'
+            )
+            self.board.remove(f'worker-{worker}')
+            self._spawn(worker)
+
+    def _kill_unresponsive(self) -> None:
+        """method to kill the workers that did not update their status within the heartbeat timeout."""
+        heartbeats = {
+            status['pid']: status['heartbeat'] for name, status in self.board.read().items() if name != SUPERVISOR
+        }
+        now = time.time()
+        for pid, worker in self._pids.items():
+            if pid in self._killed:
+                continue
+            if now - max(heartbeats.get(pid, 0.0), self._started[pid]) > self.heartbeat_timeout:
+                logger.warning(f'worker {worker} (pid {pid}) is unresponsive, killing it')
+                self._killed.add(pid)
+                os.kill(pid, signal.SIGKILL)
+
+    def _stop_workers(self) -> None:
+        """method to stop the workers gracefully, and kill the ones still running after the shutdown timeout."""
+        self._stopping = True
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self._pids and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self._reap()
+        for pid, worker in self._pids.items():
+            logger.warning(f'worker {worker} (pid {pid}) did not stop in time, killing it')
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._pids.clear()
@@ -0,0 +1,8 @@
+BATCH_KEYWORD_EXTRACT_PROMPT = (
+    'Below are {num_excerpts} numbered excerpts of a document.\n'
+    '{excerpts}\n'
+    'Give {keywords} unique keywords for every excerpt. Answer with exactly one line per excerpt, '
+    'formatted as `<excerpt number>: <comma separated keywords>`, and nothing else.'
+)  # several nodes share a single llm call, parsed back line by line.
+
+EXCERPT_TEMPLATE = '[{number}]\n{context_str}\n'
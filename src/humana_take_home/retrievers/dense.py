@@ -0,0 +1,186 @@
+import typing as t
+
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+from llama_index.core.vector_stores.simple import SimpleVectorStore
+
+from ..embeddings.batching import embed_queries
+from ..stores.ivf import IVFIndex
+from ..stores.quantization import DEFAULT_RERANK_FACTOR, QuantizedMatrix, rerank_exact
+from ..stores.search import normalize_rows, top_k_similarity
+from ..stores.vector import MMapVectorStore
+from ..telemetry import count, span
+
+
+class DenseRetriever(BaseRetriever):
+    """Retriever scoring queries against a numpy matrix of pre-normalized embeddings.
+    Every query is scored with a single matrix-vector product and the top k rows are picked
+    with `argpartition`, batches of queries are scored with a single matrix-matrix product.
+    When an `IVFIndex` is provided, only the rows of the `n_probe` closest lists are scored.
+    When quantized `codes` are provided, they are scored instead of the matrix, and the
+    `rerank_factor * top_k` best candidates are re-scored exactly with the matrix.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        node_ids: list[str],
+        docstore: BaseDocumentStore,
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 3,
+        ann_index: IVFIndex | None = None,
+        n_probe: int = 8,
+        codes: QuantizedMatrix | None = None,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to initialize the retriever with embedding matrix and the docstore.
+
+        Args:
+            matrix (np.ndarray): (n, dim) matrix of L2-normalized embeddings.
+            node_ids (list[str]): node id for each row of the matrix.
+            docstore (BaseDocumentStore): docstore to fetch the retrieved nodes from.
+            embed_model (BaseEmbedding): embedding model to embed the queries.
+            similarity_top_k (int, optional): Number of nodes to retrieve. Defaults to 3.
+            ann_index (IVFIndex | None, optional): approximate index to search with, exact search if None.
+            Defaults to None.
+            n_probe (int, optional): number of ivf lists to scan per query, higher is slower but more accurate.
+            Defaults to 8.
+            codes (QuantizedMatrix | None, optional): quantized matrix for the first pass of the search.
+            Defaults to None, the matrix is searched directly.
+            rerank_factor (int, optional): first-pass candidates re-scored exactly per retrieved node, 0 returns
+            the approximate scores of the codes. Defaults to 4.
+
+        Raises:
+            ValueError: if the ann index or the codes do not cover the given matrix.
+        """
+        super().__init__(**kwargs)
+        if ann_index is not None and ann_index.count != len(matrix):
+            raise ValueError(f'ann index covers {ann_index.count} rows but the vector store has {len(matrix)}')
+        if codes is not None and len(codes) != len(matrix):
+            raise ValueError(f'codes cover {len(codes)} rows but the vector store has {len(matrix)}')
+
+        self.matrix = matrix
+        self.node_ids = node_ids
+        self.docstore = docstore
+        self.embed_model = embed_model
+        self.similarity_top_k = similarity_top_k
+        self.ann_index = ann_index
+        self.n_probe = n_probe
+        self.codes = codes
+        self.rerank_factor = rerank_factor
+
+    @classmethod
+    def from_vector_index(
+        cls, vector_index: VectorStoreIndex, similarity_top_k: int = 3, **kwargs: t.Any
+    ) -> 'DenseRetriever':
+        """method to build the retriever from a loaded vector index.
+        Binary stores are used as is (memory-mapped) along with their codes, json stores are converted to
+        a matrix once.
+
+        Args:
+            vector_index (VectorStoreIndex): vector index to retrieve the nodes from.
+            similarity_top_k (int, optional): Number of nodes to retrieve. Defaults to 3.
+            **kwargs: forwarded to the constructor, e.g. `ann_index`, `n_probe` and `rerank_factor`.
+
+        Raises:
+            TypeError: if the vector store of the index is not supported.
+
+        Returns:
+            DenseRetriever
+        """
+        vector_store = vector_index.vector_store
+        if isinstance(vector_store, SimpleVectorStore):
+            vector_store = MMapVectorStore.from_simple_vector_store(vector_store)
+        if not isinstance(vector_store, MMapVectorStore):
+            raise TypeError(f'unsupported vector store {type(vector_store).__name__} for dense retrieval')
+
+        # vector store ids map to docstore node ids through the index struct.
+        nodes_dict = vector_index.index_struct.nodes_dict
+        return cls(
+            matrix=vector_store.matrix,
+            node_ids=[nodes_dict.get(node_id, node_id) for node_id in vector_store.node_ids],
+            docstore=vector_index.docstore,
+            embed_model=vector_index._embed_model,
+            similarity_top_k=similarity_top_k,
+            codes=vector_store.codes,
+            callback_manager=vector_index._callback_manager,
+            **kwargs,
+        )
+
+    def search(
+        self, query_embeddings: np.ndarray | list[list[float]], top_k: int | None = None
+    ) -> list[list[tuple[str, float]]]:
+        """method to find the most similar nodes for a batch of query embeddings.
+
+        Args:
+            query_embeddings (np.ndarray | list[list[float]]): (q, dim) query embeddings, need not be normalized.
+            top_k (int | None, optional): Number of nodes per query. Defaults to `similarity_top_k`.
+
+        Returns:
+            list[list[tuple[str, float]]]: (node_id, similarity) pairs per query, best first.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        top_k = top_k or self.similarity_top_k
+        rerank = self.codes is not None and self.rerank_factor > 0
+        matrix = self.matrix if self.codes is None else self.codes
+        n_candidates = top_k * self.rerank_factor if rerank else top_k
+        if self.ann_index is not None:
+            rows, scores = self.ann_index.search(matrix, queries, n_candidates, self.n_probe)
+        else:
+            rows, scores = top_k_similarity(matrix, queries, n_candidates)
+
+        if rerank:
+            rows, scores = rerank_exact(self.matrix, queries, rows, top_k)
+
+        # ann search and re-ranking pad with -1 when there are less than k candidates.
+        return [
+            [(self.node_ids[row], float(score)) for row, score in zip(query_rows, query_scores) if row >= 0]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
+
+    def batch_retrieve(self, queries: list[str]) -> list[list[NodeWithScore]]:
+        """method to retrieve nodes for several queries with a single scoring pass.
+
+        Args:
+            queries (list[str]): list of user queries.
+
+        Returns:
+            list[list[NodeWithScore]]: retrieved nodes per query, best first.
+        """
+        query_embeddings = embed_queries(self.embed_model, queries)
+        return [self._to_nodes(hits) for hits in self._search_hits(queries, query_embeddings)]
+
+    def _search_hits(self, queries: list[str], query_embeddings: list[list[float]]) -> list[list[tuple[str, float]]]:
+        """(node_id, similarity) pairs per query, the query texts are only searched by subclasses."""
+        return self.search(query_embeddings)
+
+    def _to_nodes(self, hits: list[tuple[str, float]]) -> list[NodeWithScore]:
+        nodes = self.docstore.get_nodes([node_id for node_id, _ in hits])
+        return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, hits)]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with span('agent.retrieve'):
+            query_embedding = query_bundle.embedding
+            if query_embedding is None:
+                with span('agent.query_embedding'):
+                    query_embedding = self.embed_model.get_query_embedding(query_bundle.query_str)
+            return self._search_nodes(query_bundle.query_str, query_embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with span('agent.retrieve'):
+            query_embedding = query_bundle.embedding
+            if query_embedding is None:
+                with span('agent.query_embedding'):
+                    query_embedding = await self.embed_model.aget_query_embedding(query_bundle.query_str)
+            return self._search_nodes(query_bundle.query_str, query_embedding)
+
+    def _search_nodes(self, query_str: str, query_embedding: list[float]) -> list[NodeWithScore]:
+        with span('agent.search'):
+            nodes = self._to_nodes(self._search_hits([query_str], [query_embedding])[0])
+        count('retrieved_nodes', len(nodes))
+        return nodes
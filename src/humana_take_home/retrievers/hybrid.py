@@ -0,0 +1,58 @@
+import typing as t
+
+from ..stores.sparse import BM25Index, reciprocal_rank_fusion
+from .dense import DenseRetriever
+
+
+class HybridRetriever(DenseRetriever):
+    """Retriever fusing the dense search of `DenseRetriever` with a `BM25Index` over the text of the nodes.
+    Both retrievers return `candidate_factor * top_k` candidates, fused with reciprocal rank fusion, so nodes
+    matching the exact terms of the query (numbers, gene names, table references) are retrieved at small k.
+    Scores of the retrieved nodes are the fused scores.
+    """
+
+    def __init__(
+        self,
+        *args: t.Any,
+        sparse_index: BM25Index,
+        sparse_weight: float = 1.0,
+        candidate_factor: int = 4,
+        rrf_k: int = 60,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to initialize the dense retriever along with the sparse index.
+
+        Args:
+            *args: forwarded to `DenseRetriever`.
+            sparse_index (BM25Index): bm25 index over the same nodes as the vector store.
+            sparse_weight (float, optional): weight of the bm25 ranking, the dense one weighs 1. Defaults to 1.0.
+            candidate_factor (int, optional): candidates fetched from each retriever per retrieved node.
+            Defaults to 4.
+            rrf_k (int, optional): smoothing constant of the reciprocal rank fusion. Defaults to 60.
+            **kwargs: forwarded to `DenseRetriever`.
+
+        Raises:
+            ValueError: if the sparse index does not cover the nodes of the vector store.
+        """
+        super().__init__(*args, **kwargs)
+        if sparse_index.count != len(self.node_ids):
+            raise ValueError(
+                f'bm25 index covers {sparse_index.count} nodes but the vector store has {len(self.node_ids)}'
+            )
+
+        self.sparse_index = sparse_index
+        self.sparse_weight = sparse_weight
+        self.candidate_factor = candidate_factor
+        self.rrf_k = rrf_k
+
+    def _search_hits(self, queries: list[str], query_embeddings: list[list[float]]) -> list[list[tuple[str, float]]]:
+        n_candidates = self.similarity_top_k * self.candidate_factor
+        dense_hits = self.search(query_embeddings, top_k=n_candidates)
+        sparse_rows, _ = self.sparse_index.search(queries, n_candidates)
+
+        fused_hits = []
+        for hits, rows in zip(dense_hits, sparse_rows):
+            rankings = [[node_id for node_id, _ in hits], [self.sparse_index.node_ids[row] for row in rows if row >= 0]]
+            fused = reciprocal_rank_fusion(rankings, weights=[1.0, self.sparse_weight], k=self.rrf_k)
+            fused_hits.append(fused[: self.similarity_top_k])
+        return fused_hits
@@ -0,0 +1,88 @@
+import threading
+import typing as t
+from collections import OrderedDict
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from ..telemetry import count, span
+
+
+class CrossEncoderReranker(BaseNodePostprocessor):
+    """Node postprocessor re-scoring the retrieved candidates with a cross-encoder and keeping the `top_n` best.
+    A cross-encoder reads the query and the node together, so it ranks far better than the embedding
+    similarity, and fewer nodes are needed in the context. All the candidates of a query are scored in a
+    single batched forward pass, and scores are cached per (query, node content) pair, in memory and least
+    recently used first evicted, so repeated questions skip the model.
+    """
+
+    top_n: int = Field(default=3, gt=0, description='number of nodes kept.')
+    batch_size: int = Field(default=32, gt=0, description='pairs per forward pass.')
+    cache_size: int = Field(default=65536, ge=0, description='max number of cached scores, 0 disables the cache.')
+    _model: t.Any = PrivateAttr()
+    _cache: OrderedDict[tuple[str, str], float] = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, model: t.Any, **kwargs: t.Any) -> None:
+        """constructor to initialize the re-ranker.
+
+        Args:
+            model (t.Any): cross-encoder scoring (query, text) pairs with `predict`, see `get_default_cross_encoder`.
+            **kwargs: `top_n`, `batch_size` and `cache_size`.
+        """
+        super().__init__(**kwargs)
+        self._model = model
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'CrossEncoderReranker'
+
+    def _cached_scores(self, keys: list[tuple[str, str]]) -> list[float | None]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                if (score := self._cache.get(key)) is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def _cache_scores(self, keys: list[tuple[str, str]], scores: list[float]) -> None:
+        with self._lock:
+            self._cache.update(zip(keys, scores))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _postprocess_nodes(
+        self, nodes: list[NodeWithScore], query_bundle: QueryBundle | None = None
+    ) -> list[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError('a query is required to re-rank nodes')
+        if not nodes:
+            return []
+
+        with span('agent.rerank'):
+            # content hash, so the scores of a node updated in place are not reused.
+            keys = [(query_bundle.query_str, node_with_score.node.hash) for node_with_score in nodes]
+            scores = self._cached_scores(keys)
+            misses = [i for i, score in enumerate(scores) if score is None]
+            count('rerank_cache_lookups', len(nodes) - len(misses), result='hit')
+            count('rerank_cache_lookups', len(misses), result='miss')
+
+            if misses:
+                pairs = [
+                    (query_bundle.query_str, nodes[i].node.get_content(metadata_mode=MetadataMode.EMBED))
+                    for i in misses
+                ]
+                predicted = [
+                    float(score)
+                    for score in self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                ]
+                for i, score in zip(misses, predicted):
+                    scores[i] = score
+                if self.cache_size:
+                    self._cache_scores([keys[i] for i in misses], predicted)
+
+        # stable sort, retrieval order breaks ties.
+        ranked = sorted(range(len(nodes)), key=lambda i: -scores[i])[: self.top_n]
+        return [NodeWithScore(node=nodes[i].node, score=scores[i]) for i in ranked]
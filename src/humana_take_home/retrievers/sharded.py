@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import os
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from ..embeddings.batching import embed_queries
+from ..telemetry import count, span
+from .dense import DenseRetriever
+
+
+class ShardedRetriever(BaseRetriever):
+    """Retriever fanning queries out to the retrievers of several index shards, and merging their top k.
+    The query is embedded once, then every shard is searched in parallel by a thread pool: the matrix
+    products and the reads of memory-mapped stores release the GIL, so shards are searched on separate cores
+    without copying them into worker processes. Every shard returns its own top k, and the k best hits
+    overall are fetched from the docstore of their shard.
+    Dense similarities compare across shards. Fused hybrid scores are rank based, so the best hits of
+    every shard are interleaved.
+    """
+
+    def __init__(
+        self,
+        retrievers: list[DenseRetriever],
+        shard_names: list[str] | None = None,
+        similarity_top_k: int = 3,
+        max_workers: int | None = None,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to initialize the retriever with one retriever per shard.
+
+        Args:
+            retrievers (list[DenseRetriever]): retriever of every shard, dense or hybrid, sharing the embedding model.
+            shard_names (list[str] | None, optional): name of every shard. Defaults to None, their position.
+            similarity_top_k (int, optional): Number of nodes to retrieve. Defaults to 3.
+            max_workers (int | None, optional): threads searching the shards. Defaults to None, one per shard up to
+            the number of cpus.
+
+        Raises:
+            ValueError: if no retriever is provided.
+        """
+        super().__init__(**kwargs)
+        if not retrievers:
+            raise ValueError('at least one shard is required')
+
+        self.retrievers = retrievers
+        self.shard_names = shard_names or [str(i) for i in range(len(retrievers))]
+        self.similarity_top_k = similarity_top_k
+        self.embed_model = retrievers[0].embed_model
+        # node ids are unique across shards, retrieved nodes are fetched from the docstore of their shard.
+        self._shard_of = {
+            node_id: shard for shard, retriever in enumerate(retrievers) for node_id in retriever.node_ids
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(len(retrievers), os.cpu_count() or 1), thread_name_prefix='shard-search'
+        )
+
+    def _merge_hits(self, shard_hits: list[list[list[tuple[str, float]]]]) -> list[list[tuple[str, float]]]:
+        """k best (node_id, score) pairs per query out of the hits of every shard."""
+        return [
+            heapq.nlargest(self.similarity_top_k, (hit for hits in query_hits for hit in hits), key=lambda hit: hit[1])
+            for query_hits in zip(*shard_hits)
+        ]
+
+    def _search_hits(self, queries: list[str], query_embeddings: list[list[float]]) -> list[list[tuple[str, float]]]:
+        if len(self.retrievers) == 1:
+            return self.retrievers[0]._search_hits(queries, query_embeddings)
+        futures = [
+            self._executor.submit(retriever._search_hits, queries, query_embeddings) for retriever in self.retrievers
+        ]
+        return self._merge_hits([future.result() for future in futures])
+
+    async def _asearch_hits(
+        self, queries: list[str], query_embeddings: list[list[float]]
+    ) -> list[list[tuple[str, float]]]:
+        """async counterpart of `_search_hits`, the event loop is not blocked while the shards are searched."""
+        futures = [
+            asyncio.wrap_future(self._executor.submit(retriever._search_hits, queries, query_embeddings))
+            for retriever in self.retrievers
+        ]
+        return self._merge_hits(await asyncio.gather(*futures))
+
+    def _to_nodes(self, hits: list[tuple[str, float]]) -> list[NodeWithScore]:
+        nodes_by_id = {}
+        for shard, retriever in enumerate(self.retrievers):
+            shard_hits = [hit for hit in hits if self._shard_of[hit[0]] == shard]
+            if shard_hits:
+                nodes_by_id.update((node.node.node_id, node) for node in retriever._to_nodes(shard_hits))
+        return [nodes_by_id[node_id] for node_id, _ in hits]
+
+    def batch_retrieve(self, queries: list[str]) -> list[list[NodeWithScore]]:
+        """method to retrieve nodes for several queries with a single scoring pass per shard.
+
+        Args:
+            queries (list[str]): list of user queries.
+
+        Returns:
+            list[list[NodeWithScore]]: retrieved nodes per query, best first.
+        """
+        query_embeddings = embed_queries(self.embed_model, queries)
+        return [self._to_nodes(hits) for hits in self._search_hits(queries, query_embeddings)]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with span('agent.retrieve'):
+            query_embedding = query_bundle.embedding
+            if query_embedding is None:
+                with span('agent.query_embedding'):
+                    query_embedding = self.embed_model.get_query_embedding(query_bundle.query_str)
+            with span('agent.search'):
+                nodes = self._to_nodes(self._search_hits([query_bundle.query_str], [query_embedding])[0])
+        count('retrieved_nodes', len(nodes))
+        return nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with span('agent.retrieve'):
+            query_embedding = query_bundle.embedding
+            if query_embedding is None:
+                with span('agent.query_embedding'):
+                    query_embedding = await self.embed_model.aget_query_embedding(query_bundle.query_str)
+            with span('agent.search'):
+                hits = await self._asearch_hits([query_bundle.query_str], [query_embedding])
+                nodes = self._to_nodes(hits[0])
+        count('retrieved_nodes', len(nodes))
+        return nodes
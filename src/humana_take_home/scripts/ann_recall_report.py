@@ -0,0 +1,172 @@
+import os
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from humana_take_home.stores.ivf import IVFIndex
+from humana_take_home.stores.quantization import (
+    DEFAULT_RERANK_FACTOR,
+    SUPPORTED_QUANTIZATIONS,
+    QuantizedMatrix,
+    rerank_exact,
+)
+from humana_take_home.stores.search import normalize_rows, top_k_similarity
+from humana_take_home.stores.vector import MMapVectorStore
+from humana_take_home.timer import Timer
+from humana_take_home.utils import get_default_embedding_models, load_environment
+
+
+def _recall(exact_rows: list[np.ndarray], approximate_rows: list[np.ndarray]) -> float:
+    recalls = []
+    for exact, rows in zip(exact_rows, approximate_rows):
+        # rows are padded with -1 past the nodes of the index, a query without any neighbour has nothing to miss.
+        exact = set(exact[exact >= 0].tolist())
+        recalls.append(len(exact & set(rows.tolist())) / len(exact) if exact else 1.0)
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def main(
+    path_to_csv_file: str,
+    top_k: int,
+    n_probes: list[int],
+    rerank_factors: list[int] | None = None,
+    export_results_path: str | None = None,
+) -> pd.DataFrame:
+    """runner function to compare recall, latency and memory of the ivf index and quantized codes against exact search.
+
+    Args:
+        path_to_csv_file (str): path to the csv file containing the evaluation questions.
+        top_k (int): number of nodes retrieved per question.
+        n_probes (list[int]): ivf `n_probe` settings to report, skipped if no ivf index was persisted.
+        rerank_factors (list[int] | None, optional): re-rank factors to report for every quantization, 0 reports
+        the codes alone. Defaults to None, [0, 4].
+        export_results_path (str | None, optional): path to export the report as csv. Defaults to None.
+
+    Returns:
+        pd.DataFrame: recall@k, mean latency per query and bytes per vector for exact search, every `n_probe`
+        setting, and every quantization and re-rank factor.
+    """
+    load_environment()
+    _vector_index_path = os.getenv('VECTOR_INDEX_PATH')
+    if _vector_index_path is None or not MMapVectorStore.exists(_vector_index_path):
+        raise EnvironmentError('valid `VECTOR_INDEX_PATH` with a persisted binary vector store is required')
+
+    matrix = MMapVectorStore.from_persist_dir(_vector_index_path).matrix
+    bytes_per_vector = matrix.shape[1] * np.dtype(np.float32).itemsize
+
+    # embed the questions once, the report only measures the search itself.
+    questions = pd.read_csv(path_to_csv_file)['questions'].tolist()
+    embed_model = get_default_embedding_models()
+    queries = normalize_rows([embed_model.get_query_embedding(question) for question in questions])
+
+    with Timer() as exact_timer:
+        exact_rows = [top_k_similarity(matrix, query, top_k)[0][0] for query in queries]
+
+    report = [
+        {
+            'method': 'exact',
+            'n_probe': None,
+            'rerank_factor': None,
+            'recall': 1.0,
+            'latency_ms': exact_timer.exec_time / len(queries) * 1e3,
+            'bytes_per_vector': bytes_per_vector,
+        }
+    ]
+    if IVFIndex.exists(_vector_index_path):
+        ann_index = IVFIndex.from_persist_dir(_vector_index_path)
+        for n_probe in n_probes:
+            with Timer() as ann_timer:
+                ann_rows = [ann_index.search(matrix, query, top_k, n_probe=n_probe)[0][0] for query in queries]
+
+            report.append(
+                {
+                    'method': 'ivf',
+                    'n_probe': n_probe,
+                    'rerank_factor': None,
+                    'recall': _recall(exact_rows, ann_rows),
+                    'latency_ms': ann_timer.exec_time / len(queries) * 1e3,
+                    'bytes_per_vector': bytes_per_vector,
+                }
+            )
+
+    # codes are quantized from the float matrix, whether or not the index was vectorized with a quantization.
+    for quantization in SUPPORTED_QUANTIZATIONS:
+        codes = QuantizedMatrix.quantize(matrix, quantization)
+        for rerank_factor in rerank_factors if rerank_factors is not None else [0, DEFAULT_RERANK_FACTOR]:
+            with Timer() as quantized_timer:
+                quantized_rows = []
+                for query in queries:
+                    rows, _ = top_k_similarity(codes, query, top_k * max(rerank_factor, 1))
+                    if rerank_factor > 0:
+                        rows, _ = rerank_exact(matrix, query, rows, top_k)
+                    quantized_rows.append(rows[0][rows[0] >= 0])
+
+            report.append(
+                {
+                    'method': quantization,
+                    'n_probe': None,
+                    'rerank_factor': rerank_factor,
+                    'recall': _recall(exact_rows, quantized_rows),
+                    'latency_ms': quantized_timer.exec_time / len(queries) * 1e3,
+                    'bytes_per_vector': codes.nbytes / len(codes),
+                }
+            )
+
+    df = pd.DataFrame(report).astype({'n_probe': 'Int64', 'rerank_factor': 'Int64'})
+    print(f'Recall@{top_k} over {len(questions)} questions and {len(matrix)} vectors:')
+    print(df.to_string(index=False))
+
+    if export_results_path is not None:
+        df.to_csv(export_results_path, index=False)
+
+    return df
+
+
+if __name__ == '__main__':
+
+    @dataclass
+    class CommandLine:
+        path_to_csv_file: str
+        top_k: int
+        n_probes: list[int]
+        rerank_factors: list[int]
+        export_results_path: str | None = None
+
+    argparser = ArgumentParser('report recall of the ivf index and quantized codes against exact search')
+    argparser.add_argument(
+        '--path_to_csv_file',
+        help='path to the csv file containing the evaluation questions',
+        required=True,
+    )
+    argparser.add_argument('--top_k', help='number of nodes retrieved per question', type=int, default=3)
+    argparser.add_argument(
+        '--n_probes',
+        help='ivf n_probe settings to report',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4, 8, 16],
+    )
+    argparser.add_argument(
+        '--rerank_factors',
+        help='candidates re-scored exactly per retrieved node for quantized codes, 0 for the codes alone',
+        type=int,
+        nargs='+',
+        default=[0, 1, 2, 4, 8],
+    )
+    argparser.add_argument(
+        '--export_results_path',
+        help='path to export the recall report',
+        required=False,
+    )
+
+    args = CommandLine(**vars(argparser.parse_args()))
+
+    main(
+        path_to_csv_file=args.path_to_csv_file,
+        top_k=args.top_k,
+        n_probes=args.n_probes,
+        rerank_factors=args.rerank_factors,
+        export_results_path=args.export_results_path,
+    )
@@ -0,0 +1,113 @@
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+import pandas as pd
+
+# budgets in milliseconds, measured in a fresh interpreter. Light modules must not pull in llama_index or torch,
+# modules of the agent are bound by `llama_index.core`, the embedding and llm stacks are loaded on first use.
+DEFAULT_BUDGETS_MS = {
+    'humana_take_home.timer': 50,
+    'humana_take_home.telemetry': 50,
+    'humana_take_home.utils': 100,
+    'humana_take_home.agents.research': 5000,
+    'humana_take_home.server': 5000,
+    'humana_take_home.vectorizers.pdf': 5000,
+}
+
+# `import time:  self [us] | cumulative | imported package` lines of `python -X importtime`.
+_IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure_import(module: str) -> tuple[float, list[tuple[str, float]]]:
+    """function to measure the import time of a module in a fresh interpreter.
+
+    Args:
+        module (str): dotted path of the module.
+
+    Raises:
+        RuntimeError: if the module fails to import.
+
+    Returns:
+        tuple[float, list[tuple[str, float]]]: cumulative import time in ms, and the (package, ms) of its slowest
+        direct dependencies.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'failed to import {module}:\n{process.stderr[-2000:]}')
+
+    # children are listed before their parent, nesting is given by the indentation (two spaces per level).
+    total, dependencies, children = 0.0, [], []
+    for line in process.stderr.splitlines():
+        if (match := _IMPORT_TIME_LINE.match(line)) is None:
+            continue
+        cumulative_ms, depth, package = int(match.group(2)) / 1e3, len(match.group(3)), match.group(4)
+        if depth == 3:
+            children.append((package, cumulative_ms))
+        elif depth == 1:
+            if package == module:
+                total, dependencies = cumulative_ms, children
+            children = []
+
+    return total, sorted(dependencies, key=lambda dependency: -dependency[1])[:3]
+
+
+def main(
+    modules: list[str] | None = None, budget_ms: float | None = None, export_results_path: str | None = None
+) -> pd.DataFrame:
+    """runner function to check the import time of the package modules against a budget.
+
+    Args:
+        modules (list[str] | None, optional): modules to check. Defaults to None, the `DEFAULT_BUDGETS_MS` ones.
+        budget_ms (float | None, optional): budget of every module, overrides the default ones. Defaults to None.
+        export_results_path (str | None, optional): path to export the report as csv. Defaults to None.
+
+    Returns:
+        pd.DataFrame: import time, budget and slowest dependencies per module.
+    """
+    report = []
+    for module in modules or DEFAULT_BUDGETS_MS:
+        import_ms, dependencies = measure_import(module)
+        budget = budget_ms if budget_ms is not None else DEFAULT_BUDGETS_MS.get(module)
+        report.append(
+            {
+                'module': module,
+                'import_ms': import_ms,
+                'budget_ms': budget,
+                'within_budget': budget is None or import_ms <= budget,
+                'slowest_imports': ', '.join(f'{package} ({ms:.0f}ms)' for package, ms in dependencies),
+            }
+        )
+
+    df = pd.DataFrame(report)
+    print(df.to_string(index=False, float_format='{:.1f}'.format))
+
+    if export_results_path is not None:
+        df.to_csv(export_results_path, index=False)
+
+    return df
+
+
+if __name__ == '__main__':
+
+    @dataclass
+    class CommandLine:
+        modules: list[str] | None = None
+        budget_ms: float | None = None
+        export_results_path: str | None = None
+
+    argparser = ArgumentParser('check the import time of the package modules')
+    argparser.add_argument('--modules', help='modules to check, defaults to the budgeted ones', nargs='*')
+    argparser.add_argument('--budget_ms', help='budget of every module in ms, overrides the defaults', type=float)
+    argparser.add_argument('--export_results_path', help='path to export the import time report', required=False)
+
+    args = CommandLine(**vars(argparser.parse_args()))
+
+    df = main(modules=args.modules, budget_ms=args.budget_ms, export_results_path=args.export_results_path)
+
+    # non-zero exit code so a ci pipeline stops on slow imports.
+    sys.exit(0 if df['within_budget'].all() else 1)
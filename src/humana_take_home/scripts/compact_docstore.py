@@ -0,0 +1,64 @@
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+from humana_take_home.stores.docstore import CompactDocumentStore
+from humana_take_home.stores.shards import is_sharded, list_shards, shard_path
+from humana_take_home.stores.vector import MMapVectorStore, load_storage_context
+from humana_take_home.timer import Timer
+
+
+def compact_docstore(persist_dir: str) -> int:
+    """function to write the compact docstore of an index from its `docstore.json`, e.g. an index persisted
+    before compact docstores were written. No model is loaded and the vectors are left as they are.
+
+    Args:
+        persist_dir (str): directory of the persisted index.
+
+    Raises:
+        ValueError: if the index has no binary vector store, the compact docstore follows its rows.
+
+    Returns:
+        int: number of persisted nodes.
+    """
+    if not MMapVectorStore.exists(persist_dir):
+        raise ValueError(f'no binary vector store @ {persist_dir}, re-index or merge into it first')
+
+    storage_ctx = load_storage_context(persist_dir=persist_dir)
+    # vector store ids map to docstore node ids through the index struct, the same way the ingest persists it.
+    nodes_dict = storage_ctx.index_store.index_structs()[0].nodes_dict
+    return CompactDocumentStore.persist_from(
+        storage_ctx.docstore,
+        [nodes_dict.get(node_id, node_id) for node_id in storage_ctx.vector_store.node_ids],
+        persist_dir,
+    )
+
+
+def main(vector_path: str) -> None:
+    """runner function to write the compact docstore of an index, or of every shard of a sharded index.
+
+    Args:
+        vector_path (str): path of the persisted index.
+    """
+    persist_dirs = (
+        [shard_path(vector_path, shard) for shard in list_shards(vector_path)]
+        if is_sharded(vector_path)
+        else [vector_path]
+    )
+    for persist_dir in persist_dirs:
+        with Timer() as timer:
+            num_nodes = compact_docstore(persist_dir)
+        print(f'Flushed compact docstore of {num_nodes} nodes @ {persist_dir} in {timer.exec_time:.2f}s')
+
+
+if __name__ == '__main__':
+
+    @dataclass
+    class CommandLineArgs:
+        vector_path: str
+
+    argparser = ArgumentParser('write the compact docstore of an index from its docstore.json')
+    argparser.add_argument('--vector_path', help='path of the persisted index', default='embeddings')
+
+    args = CommandLineArgs(**vars(argparser.parse_args()))
+
+    main(vector_path=args.vector_path)
@@ -0,0 +1,333 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import pandas as pd
+from llama_index.core.schema import MetadataMode, QueryBundle
+
+from humana_take_home.agents.research import ResearchAgent
+from humana_take_home.benchmarks.latency import LatencyRecorder, find_regressions
+from humana_take_home.stores.vector import load_storage_context
+from humana_take_home.timer import Timer
+from humana_take_home.utils import load_environment
+from humana_take_home.vectorizers.pdf import PDFDataLoader
+
+
+def _git_commit() -> str | None:
+    """helper function to label the results with the benchmarked commit, None outside of a git checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_ingest(
+    input_dir: str | None, input_files: list[str] | None, persist_index_path: str, workers: int = 1
+) -> dict[str, t.Any]:
+    """function to measure the throughput of `PDFDataLoader.build_vector_index`.
+
+    Args:
+        input_dir (str | None): path to the directory containing documents.
+        input_files (list[str] | None): list of files to vectorize.
+        persist_index_path (str): path of a new directory to build the index into.
+        workers (int, optional): number of ingest processes. Defaults to 1.
+
+    Returns:
+        dict[str, t.Any]: number of documents and nodes, wall time and nodes per second.
+    """
+    with Timer() as timer:
+        PDFDataLoader(vector_index_path=persist_index_path, workers=workers).build_vector_index(
+            input_dir=input_dir, input_files=input_files, persist_index_path=persist_index_path
+        )
+
+    docstore = load_storage_context(persist_dir=persist_index_path).docstore
+    num_nodes = len(docstore.docs)
+    return {
+        'documents': len(docstore.get_all_ref_doc_info() or {}),
+        'nodes': num_nodes,
+        'seconds': timer.exec_time,
+        'nodes_per_sec': timer.throughput(num_nodes),
+    }
+
+
+def benchmark_queries(agent: ResearchAgent, questions: list[str], repeats: int = 3, warmup: int = 1) -> LatencyRecorder:
+    """function to measure the latency of every stage of a first-turn question.
+    Stages are timed one after the other with the same components the chat engine uses, then the whole
+    turn is timed end to end through the chat engine to catch overhead in between the stages.
+
+    Args:
+        agent (ResearchAgent): agent to benchmark, without response cache.
+        questions (list[str]): questions to ask.
+        repeats (int, optional): number of measured passes over the questions. Defaults to 3.
+        warmup (int, optional): number of passes discarded first, e.g. to load models. Defaults to 1.
+
+    Returns:
+        LatencyRecorder: samples of the measured passes.
+    """
+    recorder = LatencyRecorder()
+    for run in range(warmup + repeats):
+        current = recorder if run >= warmup else LatencyRecorder()
+        for question in questions:
+            memory = agent.new_memory()
+            chat_engine = agent.get_chat_engine(memory)
+
+            with current.measure('query_embedding'):
+                embedding = agent.retriever.embed_model.get_query_embedding(question)
+            with current.measure('retrieval'):
+                nodes = agent.retriever.retrieve(QueryBundle(question, embedding=embedding))
+            if agent.reranker is not None:
+                with current.measure('rerank'):
+                    nodes = agent.reranker.postprocess_nodes(nodes, query_bundle=QueryBundle(question))
+            with current.measure('prompt_assembly'):
+                if agent.context_packer is not None:
+                    nodes = agent.context_packer.postprocess_nodes(nodes, query_bundle=QueryBundle(question))
+                # same steps as the compact synthesizer of the chat engine before it calls the llm.
+                synthesizer = chat_engine._get_response_synthesizer(memory.get(input=question), streaming=True)
+                text_qa_template = synthesizer.get_prompts()['text_qa_template'].partial_format(query_str=question)
+                context_strs = synthesizer._make_compact_text_chunks(
+                    question, [node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes]
+                )
+            current.record_stream('generation', agent.llm.stream(text_qa_template, context_str=context_strs[0]))
+
+            start = time.perf_counter()
+            response = agent.get_chat_engine(agent.new_memory()).stream_chat(question)
+            current.record_stream('end_to_end', response.response_gen, start=start)
+
+    return recorder
+
+
+def main(
+    path_to_csv_file: str,
+    repeats: int = 3,
+    warmup: int = 1,
+    similarity_top_k: int = 3,
+    use_ann: bool = False,
+    n_probe: int = 8,
+    rerank_candidates: int | None = None,
+    stand_in: bool = False,
+    prompt_latency: float = 0.0,
+    token_latency: float = 0.0,
+    ingest_dir: str | None = None,
+    ingest_files: list[str] | None = None,
+    ingest_workers: int = 1,
+    export_results_path: str | None = None,
+    baseline_path: str | None = None,
+    tolerance: float = 0.2,
+) -> dict[str, t.Any]:
+    """runner function to benchmark latency per stage of the chatbot, and optionally the ingest throughput.
+    With `ingest_dir` or `ingest_files` the documents are vectorized into a temporary index that is then
+    queried, otherwise the index at `VECTOR_INDEX_PATH` is queried.
+
+    Args:
+        path_to_csv_file (str): path to the csv file containing the questions.
+        repeats (int, optional): number of measured passes over the questions. Defaults to 3.
+        warmup (int, optional): number of discarded passes. Defaults to 1.
+        similarity_top_k (int, optional): number of nodes used for the context. Defaults to 3.
+        use_ann (bool, optional): retrieve with the persisted ivf index. Defaults to False.
+        n_probe (int, optional): number of ivf lists to scan per query. Defaults to 8.
+        rerank_candidates (int | None, optional): nodes re-ranked with the cross-encoder. Defaults to None,
+        `RERANK_CANDIDATES`.
+        stand_in (bool, optional): use the deterministic stand-in llm and embedder. Defaults to False.
+        prompt_latency (float, optional): seconds per prompt word of the stand-in llm. Defaults to 0.0.
+        token_latency (float, optional): seconds per output token of the stand-in llm. Defaults to 0.0.
+        ingest_dir (str | None, optional): directory of documents to benchmark ingest with. Defaults to None.
+        ingest_files (list[str] | None, optional): documents to benchmark ingest with. Defaults to None.
+        ingest_workers (int, optional): number of ingest processes. Defaults to 1.
+        export_results_path (str | None, optional): path to export the results, `.json` or `.csv`. Defaults to None.
+        baseline_path (str | None, optional): json results of a previous run to compare with. Defaults to None.
+        tolerance (float, optional): relative slow down allowed against the baseline. Defaults to 0.2.
+
+    Returns:
+        dict[str, t.Any]: run metadata, latency summary per stage, ingest throughput and regressions.
+    """
+    load_environment()  # before the overrides below, the `.env` file takes precedence over the environment.
+    if stand_in:
+        # read by the model factories, also from the spawned ingest workers.
+        os.environ['USE_STAND_IN_MODELS'] = '1'
+        os.environ['STAND_IN_PROMPT_LATENCY'] = str(prompt_latency)
+        os.environ['STAND_IN_TOKEN_LATENCY'] = str(token_latency)
+    # cached keywords and embeddings would make every ingest and repeat after the first one faster.
+    os.environ['KEYWORDS_CACHE_PATH'] = ''
+    os.environ['EMBEDDINGS_CACHE_PATH'] = ''
+
+    questions = pd.read_csv(path_to_csv_file)['questions'].tolist()
+    results: dict[str, t.Any] = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'stand_in': stand_in,
+            'llm': 'stand-in' if stand_in else os.getenv('OLLAMA_MODEL'),
+            'embeddings_model': 'stand-in' if stand_in else os.getenv('EMBEDDINGS_MODEL'),
+            'questions': len(questions),
+            'repeats': repeats,
+            'similarity_top_k': similarity_top_k,
+            'use_ann': use_ann,
+            'n_probe': n_probe,
+            'rerank_candidates': rerank_candidates,
+        },
+        'ingest': None,
+    }
+
+    ingest_root = None
+    if ingest_dir is not None or ingest_files:
+        ingest_root = tempfile.mkdtemp(prefix='benchmark_')
+        ingest_path = os.path.join(ingest_root, 'index')  # the loader expects a new directory.
+        results['ingest'] = benchmark_ingest(ingest_dir, ingest_files, ingest_path, workers=ingest_workers)
+        os.environ['VECTOR_INDEX_PATH'] = ingest_path
+
+    try:
+        # cold start of the agent, models are already loaded when ingest was benchmarked first.
+        startup = LatencyRecorder()
+        with startup.measure('agent_startup'):
+            agent = ResearchAgent.from_local_storage(
+                similarity_top_k=similarity_top_k,
+                use_ann=use_ann,
+                n_probe=n_probe,
+                cache_responses=False,
+                rerank_candidates=rerank_candidates,
+            )
+        queries = benchmark_queries(agent, questions, repeats=repeats, warmup=warmup)
+        results['latency'] = startup.summary() + queries.summary()
+    finally:
+        if ingest_root is not None:
+            shutil.rmtree(ingest_root, ignore_errors=True)
+
+    results['regressions'] = []
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        # only the commit is expected to differ, anything else makes the numbers incomparable.
+        changed = [
+            key
+            for key, value in results['meta'].items()
+            if key not in ('commit', 'timestamp') and baseline['meta'].get(key) != value
+        ]
+        if changed:
+            print(f'WARNING baseline was measured with a different {", ".join(changed)}')
+        results['regressions'] = find_regressions(results['latency'], baseline['latency'], tolerance=tolerance)
+        if results['ingest'] and baseline.get('ingest'):
+            before, after = baseline['ingest']['nodes_per_sec'], results['ingest']['nodes_per_sec']
+            if after < before * (1 - tolerance):
+                results['regressions'].append(
+                    {
+                        'stage': 'ingest_nodes_per_sec',
+                        'baseline': before,
+                        'current': after,
+                        'change': after / before - 1,
+                    }
+                )
+
+    print(f'Latency over {len(questions)} questions x {repeats} runs @ {results["meta"]["commit"]}:')
+    print(pd.DataFrame(results['latency']).to_string(index=False, float_format='{:.2f}'.format))
+    if results['ingest']:
+        print('Ingest: ' + ', '.join(f'{key}={value:.2f}' for key, value in results['ingest'].items()))
+    for regression in results['regressions']:
+        print(f'REGRESSION {regression["stage"]}: {regression["baseline"]:.2f} -> {regression["current"]:.2f}')
+
+    if export_results_path is not None:
+        if export_results_path.endswith('.json'):
+            with open(export_results_path, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            rows = results['latency'] + ([{'stage': 'ingest', **results['ingest']}] if results['ingest'] else [])
+            df = pd.DataFrame(rows).assign(commit=results['meta']['commit']).astype({'count': 'Int64'})
+            df.to_csv(export_results_path, index=False)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    @dataclass
+    class CommandLine:
+        path_to_csv_file: str
+        repeats: int = 3
+        warmup: int = 1
+        similarity_top_k: int = 3
+        use_ann: bool = False
+        n_probe: int = 8
+        rerank_candidates: int | None = None
+        stand_in: bool = False
+        prompt_latency: float = 0.0
+        token_latency: float = 0.0
+        ingest_dir: str | None = None
+        ingest_files: list[str] | None = None
+        ingest_workers: int = 1
+        export_results_path: str | None = None
+        baseline_path: str | None = None
+        tolerance: float = 0.2
+
+    argparser = ArgumentParser('benchmark latency and ingest throughput of the chatbot')
+    argparser.add_argument(
+        '--path_to_csv_file',
+        help='path to the csv file containing the benchmark questions',
+        required=True,
+    )
+    argparser.add_argument('--repeats', help='number of measured passes over the questions', type=int, default=3)
+    argparser.add_argument('--warmup', help='number of discarded passes over the questions', type=int, default=1)
+    argparser.add_argument('--similarity_top_k', help='number of nodes used for the context', type=int, default=3)
+    argparser.add_argument('--use_ann', help='retrieve with the persisted ivf index', action='store_true')
+    argparser.add_argument('--n_probe', help='number of ivf lists to scan per query', type=int, default=8)
+    argparser.add_argument(
+        '--rerank_candidates', help='nodes re-ranked with the cross-encoder', type=int, required=False
+    )
+    argparser.add_argument(
+        '--stand_in',
+        help='use the deterministic stand-in llm and embedder, reproducible without Ollama',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--prompt_latency', help='seconds per prompt word of the stand-in llm', type=float, default=0.0
+    )
+    argparser.add_argument(
+        '--token_latency', help='seconds per output token of the stand-in llm', type=float, default=0.0
+    )
+    argparser.add_argument('--ingest_dir', help='directory of documents to benchmark ingest with', required=False)
+    argparser.add_argument('--ingest_files', help='documents to benchmark ingest with', nargs='*', required=False)
+    argparser.add_argument('--ingest_workers', help='number of ingest processes', type=int, default=1)
+    argparser.add_argument(
+        '--export_results_path',
+        help='path to export the results, json when ending with `.json`, csv otherwise',
+        required=False,
+    )
+    argparser.add_argument('--baseline_path', help='json results of a previous run to compare with', required=False)
+    argparser.add_argument(
+        '--tolerance', help='relative slow down allowed against the baseline', type=float, default=0.2
+    )
+
+    args = CommandLine(**vars(argparser.parse_args()))
+
+    results = main(
+        path_to_csv_file=args.path_to_csv_file,
+        repeats=args.repeats,
+        warmup=args.warmup,
+        similarity_top_k=args.similarity_top_k,
+        use_ann=args.use_ann,
+        n_probe=args.n_probe,
+        rerank_candidates=args.rerank_candidates,
+        stand_in=args.stand_in,
+        prompt_latency=args.prompt_latency,
+        token_latency=args.token_latency,
+        ingest_dir=args.ingest_dir,
+        ingest_files=args.ingest_files,
+        ingest_workers=args.ingest_workers,
+        export_results_path=args.export_results_path,
+        baseline_path=args.baseline_path,
+        tolerance=args.tolerance,
+    )
+
+    # non-zero exit code so a deploy pipeline stops on regressions.
+    sys.exit(1 if results['regressions'] else 0)
@@ -1,35 +1,57 @@
 import asyncio
+import os
 from argparse import ArgumentParser
 from dataclasses import dataclass
 
 import pandas as pd
 
 from humana_take_home.agents.research import ResearchAgent
+from humana_take_home.caches.evaluation import EvaluationCache
 from humana_take_home.evaluators.evaluator import ResponseEvaluator
 from humana_take_home.evaluators.utils import get_correctness_eval_df, get_eval_results
+from humana_take_home.stores.vector import index_fingerprint
 
 
-async def main(path_to_csv_file: str, use_correctness: bool, export_results_path: str | None = None) -> None:
+async def main(
+    path_to_csv_file: str, use_correctness: bool, export_results_path: str | None = None, response_workers: int = 4
+) -> None:
     """runner function to evaluate the chatbot using the csv file containing evaluation data.
+    If `EVALUATION_CACHE_PATH` is set, answers and judge results are cached there and reused by later runs
+    as long as the index and the settings of the agent (see `ResearchAgent.settings`) are unchanged.
 
     Args:
         path_to_csv_file (str): path to the csv file containing the evaluation data.
         use_correctness (bool): if correctness evaluator should be used.
         export_results_path (str | None, optional): path to export correctness evaluation results dataframe.
         Defaults to None.
+        response_workers (int, optional): number of questions answered concurrently. Defaults to 4.
     """
 
     # read the csv file and convert it to dict.
     data = pd.read_csv(path_to_csv_file).to_dict(orient='list')
 
     # define evaluator and agent to be evaluated.
+    similarity_top_k = 3
+    agent = ResearchAgent.from_local_storage(similarity_top_k=similarity_top_k)
+
+    cache = None
+    if cache_path := os.getenv('EVALUATION_CACHE_PATH'):
+        # every setting of the built agent is part of the key, answers of another configuration are not reused.
+        cache = EvaluationCache(
+            cache_path, system_key={'index': index_fingerprint(os.getenv('VECTOR_INDEX_PATH')), **agent.settings}
+        )
+
     evaluator = ResponseEvaluator(
         use_correctness=use_correctness,
+        response_workers=response_workers,
+        cache=cache,
     )
-    agent = ResearchAgent.from_local_storage(similarity_top_k=3)
 
     # run evaluation on test data and chat engine.
-    eval_results = await evaluator.evaluate(data=data, chat_engine=agent.get_chat_engine())
+    # an engine with its own memory per question, so the questions are answered concurrently.
+    eval_results = await evaluator.evaluate(
+        data=data, chat_engine=lambda: agent.get_chat_engine(memory=agent.new_memory())
+    )
 
     # print the evaluation scores for all metrics.
     for key in ['relevancy', 'faithfullness']:
@@ -51,6 +73,7 @@ if __name__ == '__main__':
         path_to_csv_file: str
         use_correctness: bool
         export_results_path: str | None = None
+        response_workers: int = 4
 
     argparser = ArgumentParser('evaluate trained chatbot')
     argparser.add_argument(
@@ -68,6 +91,12 @@ if __name__ == '__main__':
         help='path to export the evaluation results',
         required=False,
     )
+    argparser.add_argument(
+        '--response_workers',
+        help='number of questions answered concurrently',
+        type=int,
+        default=4,
+    )
 
     args = CommandLine(**vars(argparser.parse_args()))
 
@@ -77,5 +106,6 @@ if __name__ == '__main__':
             path_to_csv_file=args.path_to_csv_file,
             use_correctness=args.use_correctness,
             export_results_path=args.export_results_path,
+            response_workers=args.response_workers,
         )
     )
@@ -1,18 +1,91 @@
 from argparse import ArgumentParser
 from dataclasses import dataclass
 
+from humana_take_home.stores.quantization import SUPPORTED_QUANTIZATIONS
+from humana_take_home.stores.shards import SHARD_STRATEGIES, shard_path
+from humana_take_home.stores.vector import SUPPORTED_DTYPES
 from humana_take_home.vectorizers.pdf import PDFDataLoader
 
 
-def main(vector_path: str, input_dir: str | None, input_files: str | list[str] | None) -> None:
+def main(
+    vector_path: str,
+    input_dir: str | None,
+    input_files: str | list[str] | None,
+    vector_dtype: str = 'float32',
+    quantization: str | None = None,
+    build_ann: bool = False,
+    ann_lists: int | None = None,
+    build_bm25: bool = False,
+    merge: bool = False,
+    workers: int = 1,
+    ingest_batch_size: int = 512,
+    stream: bool = False,
+    checkpoint_every: int = 10,
+    shard_by: str | None = None,
+    shard_size_mb: float = 512.0,
+    shard: str | None = None,
+    pool_embeddings: bool = False,
+) -> None:
     """runner function to vectorize documents into text embeddings.
 
     Args:
         vector_path (str): path to flush vectorized indexes
         input_dir (str | None): path to the directory containing documents
         input_files (str | list[str] | None): list of files to vectorize
+        vector_dtype (str, optional): dtype of the persisted embedding matrix. Defaults to 'float32'.
+        quantization (str | None, optional): `int8` or `binary` codes for the first pass of the search.
+        Defaults to None.
+        build_ann (bool, optional): build an ivf index for approximate retrieval. Defaults to False.
+        ann_lists (int | None, optional): number of ivf lists. Defaults to None.
+        build_bm25 (bool, optional): build a bm25 index for hybrid retrieval. Defaults to False.
+        merge (bool, optional): incrementally merge the documents into the existing index. Defaults to False.
+        workers (int, optional): number of processes parsing and splitting files. Defaults to 1.
+        ingest_batch_size (int, optional): nodes embedded together when streaming. Defaults to 512.
+        stream (bool, optional): ingest file by file with checkpoints. Defaults to False.
+        checkpoint_every (int, optional): batches between two checkpoints when streaming. Defaults to 10.
+        shard_by (str | None, optional): `collection` or `size`, build `vector_path` as several shards.
+        Defaults to None, a single index.
+        shard_size_mb (float, optional): max size of the files of a shard when sharding by size. Defaults to 512.0.
+        shard (str | None, optional): build or merge only this shard of a sharded `vector_path`. Defaults to None.
+        pool_embeddings (bool, optional): embed the nodes by pooling the embeddings of the semantic splitter.
+        Defaults to False.
+
+    Raises:
+        ValueError: if `shard_by` is combined with `merge` or `shard`, shards are merged one at a time.
     """
-    pdf_dataloader = PDFDataLoader(vector_index_path=vector_path)
+    if shard_by is not None and (merge or shard is not None):
+        raise ValueError('`shard_by` builds all the shards, merge or build a single one with `shard`')
+    if shard is not None:
+        # a shard is a complete index of its own.
+        vector_path = shard_path(vector_path, shard)
+
+    pdf_dataloader = PDFDataLoader(
+        vector_index_path=vector_path,
+        vector_dtype=vector_dtype,
+        quantization=quantization,
+        build_ann=build_ann,
+        ann_lists=ann_lists,
+        build_bm25=build_bm25,
+        workers=workers,
+        ingest_batch_size=ingest_batch_size,
+        stream=stream,
+        checkpoint_every=checkpoint_every,
+        pool_embeddings=pool_embeddings,
+    )
+
+    if merge:
+        pdf_dataloader.merge_new_documents(input_dir=input_dir, input_files=input_files, persist_index_path=vector_path)
+        return
+
+    if shard_by is not None:
+        pdf_dataloader.build_sharded_index(
+            input_dir=input_dir,
+            input_files=input_files,
+            persist_index_path=vector_path,
+            shard_by=shard_by,
+            shard_size_mb=shard_size_mb,
+        )
+        return
 
     pdf_dataloader.build_vector_index(input_dir=input_dir, input_files=input_files, persist_index_path=vector_path)
 
@@ -24,11 +97,85 @@ if __name__ == '__main__':
         input_dir: str | None
         input_files: str | list[str] | None
         vector_path: str
+        vector_dtype: str = 'float32'
+        quantization: str | None = None
+        build_ann: bool = False
+        ann_lists: int | None = None
+        build_bm25: bool = False
+        merge: bool = False
+        workers: int = 1
+        ingest_batch_size: int = 512
+        stream: bool = False
+        checkpoint_every: int = 10
+        shard_by: str | None = None
+        shard_size_mb: float = 512.0
+        shard: str | None = None
+        pool_embeddings: bool = False
 
     argparser = ArgumentParser('vectorize documents into text embeddings')
     argparser.add_argument('--input_dir', help='directory path to index all the documents', required=False)
     argparser.add_argument('--input_files', help='list of files to index', nargs='*', required=False)
     argparser.add_argument('--vector_path', help='path to flush vectorized indexes')
+    argparser.add_argument(
+        '--vector_dtype',
+        help='dtype of the persisted embedding matrix',
+        choices=SUPPORTED_DTYPES,
+        default='float32',
+    )
+    argparser.add_argument(
+        '--quantization',
+        help='quantized codes searched before an exact re-rank with the embedding matrix',
+        choices=SUPPORTED_QUANTIZATIONS,
+    )
+    argparser.add_argument('--build_ann', help='build an ivf index for approximate retrieval', action='store_true')
+    argparser.add_argument('--ann_lists', help='number of ivf lists, defaults to ~4 * sqrt(num nodes)', type=int)
+    argparser.add_argument(
+        '--build_bm25',
+        help='build a bm25 index over the text and keywords of the nodes for hybrid retrieval',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--merge',
+        help='only process new, changed or deleted files of an existing index',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--workers',
+        help='number of processes parsing and splitting files, nodes are streamed into batched embedding',
+        type=int,
+        default=1,
+    )
+    argparser.add_argument(
+        '--ingest_batch_size',
+        help='number of nodes embedded together when streaming or ingesting with multiple workers',
+        type=int,
+        default=512,
+    )
+    argparser.add_argument(
+        '--stream',
+        help='ingest file by file keeping vectors and node text on disk, an interrupted run resumes from a checkpoint',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--checkpoint_every',
+        help='number of batches between two checkpoints when streaming',
+        type=int,
+        default=10,
+    )
+    argparser.add_argument(
+        '--shard_by',
+        help='build the index as shards, one per subdirectory of `input_dir` (collection) or per `shard_size_mb`',
+        choices=SHARD_STRATEGIES,
+    )
+    argparser.add_argument(
+        '--shard_size_mb', help='max size of the files of a shard when sharding by size', type=float, default=512.0
+    )
+    argparser.add_argument('--shard', help='build or merge a single shard of a sharded `vector_path`', required=False)
+    argparser.add_argument(
+        '--pool_embeddings',
+        help='embed the nodes by pooling the sentence embeddings of the splitter instead of a second pass',
+        action='store_true',
+    )
 
     args = CommandLineArgs(**vars(argparser.parse_args()))
 
@@ -36,4 +183,18 @@ if __name__ == '__main__':
         vector_path=args.vector_path,
         input_dir=args.input_dir,
         input_files=args.input_files,
+        vector_dtype=args.vector_dtype,
+        quantization=args.quantization,
+        build_ann=args.build_ann,
+        ann_lists=args.ann_lists,
+        build_bm25=args.build_bm25,
+        merge=args.merge,
+        workers=args.workers,
+        ingest_batch_size=args.ingest_batch_size,
+        stream=args.stream,
+        checkpoint_every=args.checkpoint_every,
+        shard_by=args.shard_by,
+        shard_size_mb=args.shard_size_mb,
+        shard=args.shard,
+        pool_embeddings=args.pool_embeddings,
     )
@@ -0,0 +1,498 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+import typing as t
+import uuid
+from argparse import ArgumentParser
+from collections import OrderedDict
+from dataclasses import dataclass
+from logging import basicConfig, getLogger
+from urllib.parse import urlsplit
+
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.memory.chat_memory_buffer import ChatMemoryBuffer
+from llama_index.core.schema import NodeWithScore
+
+from humana_take_home.agents.research import ResearchAgent
+from humana_take_home.caches.sqlite import SQLiteCache
+from humana_take_home.prefork import SUPERVISOR, PreforkServer, WorkerStatusBoard, process_memory, render_worker_gauges
+from humana_take_home.telemetry import count, merge_snapshots, span, telemetry
+
+logger = getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20  # chat requests only carry a message, anything larger is rejected.
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    """Error answered to the client with the given status code."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Session:
+    """Chat memory of a session, turns of the same session are serialized by the lock."""
+
+    memory: ChatMemoryBuffer
+    lock: asyncio.Lock
+    last_access: float
+    restored: int = 0  # messages read from the shared cache at the start of the turn.
+
+
+class SessionStore:
+    """Bounded store of chat sessions, idle sessions expire after `ttl` seconds and the least recently used
+    ones are evicted past `max_sessions`.
+    With a `shared` cache, e.g. between the workers of a prefork server, the history of a session is read from
+    it by `restore` at the start of every turn and written back by `save`, both with the lock of the session
+    held, so consecutive turns can be answered by different processes. Turns of a session are only serialized
+    within a process, a turn answered by another process in the meantime is kept, the messages of the turn
+    being appended to the stored history instead of overwriting it.
+    """
+
+    def __init__(
+        self, agent: ResearchAgent, max_sessions: int = 1024, ttl: float = 1800.0, shared: SQLiteCache | None = None
+    ) -> None:
+        self.agent = agent
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.shared = shared
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.shared) if self.shared is not None else len(self._sessions)
+
+    @property
+    def loaded(self) -> int:
+        """number of sessions held in memory by this process."""
+        return len(self._sessions)
+
+    def get(self, session_id: str | None) -> tuple[str, Session]:
+        """method to fetch a session, a new one is created if the id is unknown or None."""
+        now = time.monotonic()
+        # sessions are kept in lru order, expired ones are at the front.
+        while self._sessions and now - next(iter(self._sessions.values())).last_access > self.ttl:
+            self._sessions.popitem(last=False)
+
+        session_id = session_id or uuid.uuid4().hex
+        if session_id not in self._sessions:
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[session_id] = Session(memory=self.agent.new_memory(), lock=asyncio.Lock(), last_access=now)
+
+        session = self._sessions[session_id]
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session_id, session
+
+    def _stored_messages(self, session_id: str) -> list[dict[str, t.Any]]:
+        """messages of a session in the shared cache, none if unknown or expired."""
+        payload = self.shared.get(session_id)
+        state = json.loads(payload) if payload is not None else None
+        if state is None or time.time() - state['updated'] > self.ttl:
+            return []
+        return state['messages']
+
+    def restore(self, session_id: str, session: Session) -> None:
+        """method to load the history of a session from the shared cache, if any, as left by the last turn.
+        Called at the start of a turn, with the lock of the session held.
+        """
+        if self.shared is None:
+            return
+        messages = self._stored_messages(session_id)
+        session.memory.set([ChatMessage.model_validate(message) for message in messages])
+        session.restored = len(messages)
+
+    def save(self, session_id: str, session: Session) -> None:
+        """method to append the messages of a turn to the history of a session in the shared cache, if any.
+        Called at the end of a turn, with the lock of the session held.
+        """
+        if self.shared is None:
+            return
+        turn = [message.model_dump(mode='json') for message in session.memory.get_all()[session.restored :]]
+        messages = self._stored_messages(session_id) + turn
+        self.shared.set(session_id, json.dumps({'updated': time.time(), 'messages': messages}).encode())
+        session.restored = len(messages)
+
+    def delete(self, session_id: str) -> bool:
+        deleted = self._sessions.pop(session_id, None) is not None
+        if self.shared is not None and self.shared.get(session_id) is not None:
+            self.shared.delete(session_id)
+            deleted = True
+        return deleted
+
+
+def _sources(source_nodes: list[NodeWithScore]) -> list[dict[str, t.Any]]:
+    return [
+        {
+            'node_id': source.node.node_id,
+            'score': source.score,
+            'file_name': source.node.metadata.get('file_name'),
+            'page_label': source.node.metadata.get('page_label'),
+        }
+        for source in source_nodes
+    ]
+
+
+class ChatServer:
+    """Asyncio HTTP server answering chats with a single shared `ResearchAgent`.
+
+    Endpoints:
+      - `POST /chat`: `{"message": ..., "session_id": ...}`, answers `{"session_id", "response", "sources",
+        "context"}`, `context` being the token counts of the prompt (see `ResearchAgent.context_stats`).
+      - `POST /chat/stream`: same body, streams `{"delta": ...}` server-sent events, then a `done` event
+        carrying `{"session_id", "response", "sources", "context"}`.
+      - `DELETE /sessions/<session_id>`: drops the memory of a session.
+      - `GET /health`: liveness probe with the number of live sessions, the requests and memory of the process.
+      - `GET /metrics`: spans, counters and histograms of the process in the Prometheus text format.
+
+    Omitting `session_id` starts a new session, its id is returned with the response.
+    In a worker of a `PreforkServer`, `/health` and `/metrics` report all the workers of the pool.
+    """
+
+    def __init__(
+        self,
+        agent: ResearchAgent,
+        max_sessions: int = 1024,
+        session_ttl: float = 1800.0,
+        shutdown_timeout: float = 30.0,
+    ) -> None:
+        self.agent = agent
+        self.sessions = SessionStore(agent, max_sessions=max_sessions, ttl=session_ttl)
+        self.shutdown_timeout = shutdown_timeout
+        self.worker: int | None = None
+        self.status_board: WorkerStatusBoard | None = None
+        self.started = time.time()
+        self.requests = 0
+        self.in_flight = 0
+
+    def join_pool(self, worker: int, status_board: WorkerStatusBoard, sessions: SQLiteCache) -> None:
+        """method to serve as a worker of a `PreforkServer`, called in the worker process before `serve`.
+
+        Args:
+            worker (int): index of the worker.
+            status_board (WorkerStatusBoard): board to publish the status of the worker to, and read the pool from.
+            sessions (SQLiteCache): cache of the chat sessions shared by the workers.
+        """
+        self.worker = worker
+        self.status_board = status_board
+        self.sessions.shared = sessions
+        self.started = time.time()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000, sock: socket.socket | None = None) -> None:
+        """method to serve until SIGINT or SIGTERM, then stop accepting connections and answer the requests in
+        flight for at most `shutdown_timeout` seconds.
+
+        Args:
+            host (str, optional): interface to bind. Defaults to '127.0.0.1'.
+            port (int, optional): port to bind. Defaults to 8000.
+            sock (socket.socket | None, optional): listening socket to accept connections from instead, e.g.
+            opened by a `PreforkServer`. Defaults to None.
+        """
+        if sock is None:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info(f'Serving on http://{host}:{port}')
+        else:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        heartbeat = asyncio.create_task(self._heartbeat()) if self.status_board is not None else None
+        async with server:
+            await stopping.wait()
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if heartbeat is not None:
+            heartbeat.cancel()
+
+    async def _heartbeat(self) -> None:
+        """task publishing the status of the worker, with its metrics, every interval of the board."""
+        name = f'worker-{self.worker}'
+        while True:
+            self.status_board.write(name, {**self.status(), 'telemetry': telemetry.snapshot()})
+            await asyncio.sleep(self.status_board.interval)
+
+    def status(self) -> dict[str, t.Any]:
+        """status of this process: requests answered and in flight, sessions held in memory and memory usage, see
+        `process_memory`."""
+        return {
+            'worker': self.worker,
+            'pid': os.getpid(),
+            'started': self.started,
+            'heartbeat': time.time(),
+            'requests': self.requests,
+            'in_flight': self.in_flight,
+            'loaded_sessions': self.sessions.loaded,
+            'memory': process_memory(),
+        }
+
+    def _pool_statuses(self) -> tuple[list[dict[str, t.Any]], dict[str, t.Any] | None]:
+        """status of every worker of the pool, this one up to date, and of the supervisor."""
+        statuses = self.status_board.read()
+        supervisor = statuses.pop(SUPERVISOR, None)
+        statuses[f'worker-{self.worker}'] = {**self.status(), 'telemetry': telemetry.snapshot()}
+        return sorted(statuses.values(), key=lambda status: status['worker']), supervisor
+
+    def health(self) -> dict[str, t.Any]:
+        """method to report the health of the process, and of every worker of the pool if any.
+
+        Returns:
+            dict[str, t.Any]: `status`, `sessions` and the status of this process. In a pool, `workers` lists
+            the status of every worker, `alive` if updated within the heartbeat timeout, `status` is `degraded`
+            when one is not, and `memory_total` adds up the memory of the workers and the supervisor.
+        """
+        health = {'status': 'ok', 'sessions': len(self.sessions), **self.status()}
+        if self.status_board is None:
+            return health
+
+        workers, supervisor = self._pool_statuses()
+        processes = workers + ([supervisor] if supervisor is not None else [])
+        health['workers'] = [
+            {
+                **{key: value for key, value in worker.items() if key != 'telemetry'},
+                'alive': self.status_board.is_alive(worker),
+            }
+            for worker in workers
+        ]
+        health['restarts'] = supervisor['restarts'] if supervisor is not None else 0
+        health['memory_total'] = {
+            kind: sum(process['memory'].get(kind, 0) for process in processes) for kind in processes[0]['memory']
+        }
+        if not all(worker['alive'] for worker in health['workers']):
+            health['status'] = 'degraded'
+        return health
+
+    def render_metrics(self) -> str:
+        """method to render the metrics of the process, or the metrics of all the workers of the pool added up
+        along with gauges of their health, in the Prometheus text format."""
+        if self.status_board is None:
+            return telemetry.render_prometheus()
+
+        workers, supervisor = self._pool_statuses()
+        processes = workers + ([supervisor] if supervisor is not None else [])
+        snapshot = merge_snapshots(process['telemetry'] for process in processes)
+        return telemetry.render_prometheus(snapshot) + render_worker_gauges(
+            workers, self.status_board, telemetry.namespace
+        )
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.in_flight += 1
+        try:
+            method, path, body = await self._read_request(reader)
+            await self._route(method, path, body, writer)
+        except HTTPError as e:
+            await self._write_json(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # client went away, nothing to answer.
+        except Exception as e:
+            logger.exception('failed to handle request')
+            await self._write_json(writer, 500, {'error': str(e)})
+        finally:
+            writer.close()
+            self.in_flight -= 1
+            self.requests += 1
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, t.Any]]:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise HTTPError(400, 'malformed request line')
+        method, target, _ = request_line
+
+        headers = {}
+        while (line := (await reader.readline()).decode('latin-1').strip()) != '':
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError as e:
+            raise HTTPError(400, f'invalid content-length: {headers["content-length"]}') from e
+        if length < 0:
+            raise HTTPError(400, f'invalid content-length: {length}')
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f'request body larger than {MAX_BODY_BYTES} bytes')
+
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except json.JSONDecodeError as e:
+                raise HTTPError(400, f'invalid json body: {e}') from e
+        return method.upper(), urlsplit(target).path, body
+
+    async def _route(self, method: str, path: str, body: dict[str, t.Any], writer: asyncio.StreamWriter) -> None:
+        if path == '/health':
+            if method != 'GET':
+                raise HTTPError(405, f'{method} not allowed on {path}')
+            return await self._write_json(writer, 200, self.health())
+
+        if path == '/metrics':
+            if method != 'GET':
+                raise HTTPError(405, f'{method} not allowed on {path}')
+            return await self._write(writer, 200, self.render_metrics().encode(), PROMETHEUS_CONTENT_TYPE)
+
+        if path.startswith('/sessions/'):
+            if method != 'DELETE':
+                raise HTTPError(405, f'{method} not allowed on {path}')
+            deleted = self.sessions.delete(path.removeprefix('/sessions/'))
+            return await self._write_json(writer, 200 if deleted else 404, {'deleted': deleted})
+
+        if path not in ('/chat', '/chat/stream'):
+            raise HTTPError(404, f'no route for {path}')
+        if method != 'POST':
+            raise HTTPError(405, f'{method} not allowed on {path}')
+
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, '`message` is required')
+
+        session_id, session = self.sessions.get(body.get('session_id'))
+        async with session.lock:
+            self.sessions.restore(session_id, session)
+            if path == '/chat':
+                with span('http.chat'):
+                    response = await self.agent.achat(message, session.memory)
+                self.sessions.save(session_id, session)
+                return await self._write_json(
+                    writer,
+                    200,
+                    {
+                        'session_id': session_id,
+                        'response': response.response,
+                        'sources': _sources(response.source_nodes),
+                        'context': self.agent.context_stats(response.source_nodes, session.memory),
+                    },
+                )
+
+            with span('http.chat_stream'):
+                response = await self.agent.astream_chat(message, session.memory)
+                count('http_responses', status=200)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\n'
+                    b'Content-Type: text/event-stream\r\n'
+                    b'Cache-Control: no-cache\r\n'
+                    b'Connection: close\r\n\r\n'
+                )
+                try:
+                    async for delta in response.async_response_gen():
+                        writer.write(f'data: {json.dumps({"delta": delta})}\n\n'.encode())
+                        await writer.drain()
+
+                    done = {
+                        'session_id': session_id,
+                        'response': response.response,
+                        'sources': _sources(response.source_nodes),
+                        'context': self.agent.context_stats(response.source_nodes, session.memory),
+                    }
+                    self.sessions.save(session_id, session)
+                    writer.write(f'event: done\ndata: {json.dumps(done)}\n\n'.encode())
+                except ConnectionError:
+                    raise
+                except Exception as e:
+                    # the status line is already sent, the error ends the stream as an event instead of a 500.
+                    logger.exception('failed to stream the answer')
+                    count('http_stream_errors')
+                    writer.write(f'event: error\ndata: {json.dumps({"error": str(e)})}\n\n'.encode())
+                await writer.drain()
+
+    @classmethod
+    async def _write_json(cls, writer: asyncio.StreamWriter, status: int, payload: dict[str, t.Any]) -> None:
+        await cls._write(writer, status, json.dumps(payload).encode(), 'application/json')
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str) -> None:
+        count('http_responses', status=status)
+        writer.write(
+            f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode()
+            + body
+        )
+        await writer.drain()
+
+
+if __name__ == '__main__':
+
+    @dataclass
+    class CommandLine:
+        host: str
+        port: int
+        max_sessions: int
+        session_ttl: float
+        similarity_top_k: int
+        use_ann: bool
+        n_probe: int
+        rerank_factor: int
+        rerank_candidates: int | None
+        workers: int
+        heartbeat_timeout: float
+
+    argparser = ArgumentParser('serve the research agent over http')
+    argparser.add_argument('--host', help='interface to bind', default='127.0.0.1')
+    argparser.add_argument('--port', help='port to bind', type=int, default=8000)
+    argparser.add_argument('--max_sessions', help='max number of chat sessions kept in memory', type=int, default=1024)
+    argparser.add_argument(
+        '--session_ttl', help='seconds after which an idle session expires', type=float, default=1800
+    )
+    argparser.add_argument('--similarity_top_k', help='number of nodes to use for the context', type=int, default=3)
+    argparser.add_argument('--use_ann', help='retrieve with the persisted ivf index', action='store_true')
+    argparser.add_argument('--n_probe', help='number of ivf lists to scan per query', type=int, default=8)
+    argparser.add_argument(
+        '--rerank_factor', help='candidates of a quantized index re-scored exactly per node', type=int, default=4
+    )
+    argparser.add_argument(
+        '--rerank_candidates',
+        help='nodes retrieved and re-ranked with the cross-encoder, defaults to `RERANK_CANDIDATES`',
+        type=int,
+        required=False,
+    )
+    argparser.add_argument(
+        '--workers',
+        help='worker processes forked after loading the agent, sharing the index and models',
+        type=int,
+        default=1,
+    )
+    argparser.add_argument(
+        '--heartbeat_timeout',
+        help='seconds without status update after which a worker is restarted',
+        type=float,
+        default=30,
+    )
+
+    args = CommandLine(**vars(argparser.parse_args()))
+    basicConfig(level='INFO')
+
+    # index and models are loaded once, and shared by all the sessions, and all the workers if forked.
+    agent = ResearchAgent.from_local_storage(
+        similarity_top_k=args.similarity_top_k,
+        use_ann=args.use_ann,
+        n_probe=args.n_probe,
+        rerank_factor=args.rerank_factor,
+        rerank_candidates=args.rerank_candidates,
+    )
+    server = ChatServer(agent, max_sessions=args.max_sessions, session_ttl=args.session_ttl)
+    if args.workers > 1:
+        PreforkServer(server, workers=args.workers, heartbeat_timeout=args.heartbeat_timeout).serve(
+            host=args.host, port=args.port
+        )
+    else:
+        asyncio.run(server.serve(host=args.host, port=args.port))
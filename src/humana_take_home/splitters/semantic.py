@@ -0,0 +1,85 @@
+import numpy as np
+from llama_index.core.base.embeddings.base import Embedding
+from llama_index.core.node_parser import SemanticSplitterNodeParser
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.node_parser.text.semantic_splitter import SentenceCombination
+from llama_index.core.schema import BaseNode, Document
+
+from ..stores.search import normalize_rows
+from ..telemetry import count
+
+
+class PooledSemanticSplitterNodeParser(SemanticSplitterNodeParser):
+    """Semantic splitter also embedding the nodes it builds, out of the embeddings computed to split them.
+    To find the breakpoints, every sentence is embedded along with its `buffer_size` neighbours. The embedding of
+    a node is the normalized mean of the embeddings of its sentence groups, so the vector index does not run the
+    transformer over the nodes a second time, which about halves the embedding time of an ingest.
+    Pooled vectors approximate the embedding of the node text, without its metadata (file name, keywords), so
+    hybrid retrieval still matches the keywords through BM25. Nodes of a single sentence are embedded as usual.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'PooledSemanticSplitterNodeParser'
+
+    def _chunk_ranges(self, distances: list[float], num_sentences: int) -> list[tuple[int, int]]:
+        """(start, end) sentence ranges of the chunks, the same breakpoints as `_build_node_chunks`."""
+        threshold = np.percentile(distances, self.breakpoint_percentile_threshold)
+        starts = [0] + [i + 1 for i, distance in enumerate(distances) if distance > threshold]
+        return list(zip(starts, [*starts[1:], num_sentences]))
+
+    def _build_pooled_nodes(
+        self, document: Document, sentences: list[SentenceCombination], embeddings: list[Embedding]
+    ) -> list[BaseNode]:
+        """method to split a document at the semantic breakpoints, and pool the embeddings of every chunk.
+
+        Args:
+            document (Document): document to split.
+            sentences (list[SentenceCombination]): sentence groups of the document.
+            embeddings (list[Embedding]): embedding of every sentence group.
+
+        Returns:
+            list[BaseNode]: nodes of the document, with their pooled embedding.
+        """
+        for sentence, embedding in zip(sentences, embeddings):
+            sentence['combined_sentence_embedding'] = embedding
+        distances = self._calculate_distances_between_sentence_groups(sentences)
+        if not distances:
+            return build_nodes_from_splits(
+                self._build_node_chunks(sentences, distances), document, id_func=self.id_func
+            )
+
+        ranges = self._chunk_ranges(distances, len(sentences))
+        chunks = [''.join(sentence['sentence'] for sentence in sentences[start:end]) for start, end in ranges]
+        nodes = build_nodes_from_splits(chunks, document, id_func=self.id_func)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        pooled = normalize_rows(np.stack([matrix[start:end].mean(axis=0) for start, end in ranges]))
+        for node, embedding in zip(nodes, pooled):
+            node.embedding = embedding.tolist()
+
+        count('pooled_node_embeddings', len(nodes))
+        return nodes
+
+    def build_semantic_nodes_from_documents(
+        self, documents: list[Document], show_progress: bool = False
+    ) -> list[BaseNode]:
+        all_nodes: list[BaseNode] = []
+        for document in documents:
+            sentences = self._build_sentence_groups(self.sentence_splitter(document.text))
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [sentence['combined_sentence'] for sentence in sentences], show_progress=show_progress
+            )
+            all_nodes.extend(self._build_pooled_nodes(document, sentences, embeddings))
+        return all_nodes
+
+    async def abuild_semantic_nodes_from_documents(
+        self, documents: list[Document], show_progress: bool = False
+    ) -> list[BaseNode]:
+        all_nodes: list[BaseNode] = []
+        for document in documents:
+            sentences = self._build_sentence_groups(self.sentence_splitter(document.text))
+            embeddings = await self.embed_model.aget_text_embedding_batch(
+                [sentence['combined_sentence'] for sentence in sentences], show_progress=show_progress
+            )
+            all_nodes.extend(self._build_pooled_nodes(document, sentences, embeddings))
+        return all_nodes
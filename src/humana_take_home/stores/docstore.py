@@ -0,0 +1,346 @@
+import json
+import os
+import typing as t
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from llama_index.core.storage.docstore.keyval_docstore import (
+    DEFAULT_COLLECTION_DATA_SUFFIX,
+    DEFAULT_NAMESPACE,
+    KVDocumentStore,
+)
+from llama_index.core.storage.docstore.types import DEFAULT_PERSIST_PATH, BaseDocumentStore
+from llama_index.core.storage.docstore.utils import doc_to_json
+from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+
+from .io import atomic_save, atomic_write
+
+FORMAT_VERSION = 1
+# collection of the nodes in a `KVDocumentStore` with the default namespace.
+NODE_COLLECTION = f'{DEFAULT_NAMESPACE}{DEFAULT_COLLECTION_DATA_SUFFIX}'
+
+
+class NodeFileKVStore(BaseKVStore):
+    """Read-only key-value store of the nodes of an index, one compressed json record per node in a single file.
+
+    A persisted store is made of four files sharing the llama_index namespace prefix:
+      - `<namespace>__nodes.bin`: zlib compressed json record of every node, as stored in `docstore.json`.
+      - `<namespace>__nodes.offsets.npy`: (n + 1,) start offset of every record.
+      - `<namespace>__nodes.ids`: node id of every record, one per line.
+      - `<namespace>__nodes.meta.json`: number of nodes and format version of the records.
+
+    Loading only parses the id table, the records and offsets are memory-mapped and a record is read and decoded
+    when its node is fetched, so memory use and load time do not grow with the text of the corpus.
+    """
+
+    def __init__(
+        self, records: np.ndarray, offsets: np.ndarray, node_ids: list[str], collection: str = NODE_COLLECTION
+    ) -> None:
+        """constructor to initialize the store from its records.
+
+        Args:
+            records (np.ndarray): uint8 buffer of the concatenated records.
+            offsets (np.ndarray): (n + 1,) start offset of every record in `records`.
+            node_ids (list[str]): node id of every record.
+            collection (str, optional): collection holding the nodes, other collections are empty.
+            Defaults to the node collection of a docstore with the default namespace.
+        """
+        self.records = records
+        self.offsets = offsets
+        self.node_ids = node_ids
+        self.collection = collection
+        self._rows = {node_id: row for row, node_id in enumerate(node_ids)}
+
+    @staticmethod
+    def _file_prefix(persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> str:
+        return os.path.join(persist_dir, f'{namespace}{NAMESPACE_SEP}nodes')
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """check if a node file is persisted in the given directory."""
+        return os.path.exists(f'{cls._file_prefix(persist_dir, namespace)}.meta.json')
+
+    @classmethod
+    def write(
+        cls,
+        persist_dir: str,
+        records: t.Iterable[tuple[str, dict]],
+        namespace: str = DEFAULT_VECTOR_STORE,
+    ) -> int:
+        """method to persist the records one by one, they are never all held in memory.
+
+        Args:
+            persist_dir (str): directory to persist the store in, next to the vector store.
+            records (t.Iterable[tuple[str, dict]]): (node id, json record) of every node.
+            namespace (str, optional): namespace of the files. Defaults to 'default'.
+
+        Returns:
+            int: number of persisted records.
+        """
+        prefix = cls._file_prefix(persist_dir, namespace)
+        node_ids, offsets = [], [0]
+        with open(tmp_path := f'{prefix}.bin.tmp', 'wb') as f:
+            for node_id, record in records:
+                payload = zlib.compress(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                f.write(payload)
+                node_ids.append(node_id)
+                offsets.append(offsets[-1] + len(payload))
+        os.replace(tmp_path, f'{prefix}.bin')
+        atomic_write(f'{prefix}.ids', ''.join(f'{node_id}\n' for node_id in node_ids).encode())
+        atomic_save(f'{prefix}.offsets.npy', np.asarray(offsets, dtype=np.int64))
+        # meta is written last, it acts as the commit marker of the other files.
+        meta = {'format_version': FORMAT_VERSION, 'count': len(node_ids), 'compression': 'zlib'}
+        atomic_write(f'{prefix}.meta.json', json.dumps(meta).encode())
+        return len(node_ids)
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE, collection: str = NODE_COLLECTION
+    ) -> 'NodeFileKVStore':
+        """method to load the store from the given directory, memory-mapping its records.
+
+        Args:
+            persist_dir (str): directory containing the persisted store.
+            namespace (str, optional): namespace of the files. Defaults to 'default'.
+            collection (str, optional): collection holding the nodes. Defaults to `NODE_COLLECTION`.
+
+        Raises:
+            ValueError: if the files do not match their meta, e.g. written by an interrupted run.
+
+        Returns:
+            NodeFileKVStore
+        """
+        prefix = cls._file_prefix(persist_dir, namespace)
+        with open(f'{prefix}.meta.json') as f:
+            meta = json.load(f)
+        with open(f'{prefix}.ids', encoding='utf-8') as f:
+            node_ids = f.read().splitlines()
+        offsets = np.load(f'{prefix}.offsets.npy', mmap_mode='r')
+        if len(node_ids) != meta['count'] or len(offsets) != meta['count'] + 1:
+            raise ValueError(f'node file @ {prefix} has {len(node_ids)} ids for {meta["count"]} records')
+
+        # an empty file cannot be memory-mapped.
+        records = np.memmap(f'{prefix}.bin', dtype=np.uint8, mode='r') if meta['count'] else np.empty(0, np.uint8)
+        return cls(records=records, offsets=offsets, node_ids=node_ids, collection=collection)
+
+    def _record(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(zlib.decompress(self.records[start:end].tobytes()))
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> dict | None:
+        if collection != self.collection or (row := self._rows.get(key)) is None:
+            return None
+        return self._record(row)
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> dict | None:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        """all the records of the collection, decodes the whole corpus."""
+        if collection != self.collection:
+            return {}
+        return {node_id: self._record(row) for row, node_id in enumerate(self.node_ids)}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        return self.get_all(collection)
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        raise NotImplementedError('NodeFileKVStore is read-only, update the index with the ingest pipeline')
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        raise NotImplementedError('NodeFileKVStore is read-only, update the index with the ingest pipeline')
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+
+class JournalKVStore(BaseKVStore):
+    """Append-only key-value store of a streaming ingest, every put and delete is appended to a json lines file.
+
+    Only the offset of the last record of every node is kept in memory, a node is read back from the file when
+    it is fetched. The other collections (ref doc info and document hashes) hold ids and hashes, they are kept
+    in memory and rebuilt by replaying the file. A checkpoint only flushes the records appended since the
+    previous one, and `persist` writes the `docstore.json` of a `SimpleDocumentStore` one record at a time.
+    """
+
+    def __init__(self, path: str, size: int | None = None, node_collection: str = NODE_COLLECTION) -> None:
+        """constructor to open the journal, replaying its records.
+
+        Args:
+            path (str): journal file.
+            size (int | None, optional): bytes of the journal to replay, as returned by `flush` at the last
+            checkpoint, records past it belong to an interrupted run and are dropped. Defaults to None, the
+            journal is started over.
+            node_collection (str, optional): collection holding the nodes. Defaults to `NODE_COLLECTION`.
+
+        Raises:
+            ValueError: if the journal is shorter than `size`.
+        """
+        self.path = path
+        self.node_collection = node_collection
+        self._offsets: dict[str, tuple[int, int]] = {}  # node id -> (offset, length) of its last record.
+        self._collections: dict[str, dict[str, dict]] = defaultdict(dict)
+
+        if size is None:
+            self._file = open(path, 'w+b')
+            return
+        if os.path.getsize(path) < size:
+            raise ValueError(f'journal @ {path} holds {os.path.getsize(path)} bytes, expected at least {size}')
+
+        self._file = open(path, 'r+b')
+        self._file.truncate(size)
+        offset = 0
+        for line in self._file:
+            collection, key, val = json.loads(line)
+            self._apply(collection, key, val, offset, len(line))
+            offset += len(line)
+
+    def _apply(self, collection: str, key: str, val: dict | None, offset: int, length: int) -> None:
+        if collection == self.node_collection:
+            if val is None:
+                self._offsets.pop(key, None)
+            else:
+                self._offsets[key] = (offset, length)
+        elif val is None:
+            self._collections[collection].pop(key, None)
+        else:
+            self._collections[collection][key] = val
+
+    def _append(self, collection: str, key: str, val: dict | None) -> None:
+        line = json.dumps([collection, key, val], ensure_ascii=False).encode('utf-8') + b'\n'
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(line)
+        self._apply(collection, key, val.copy() if val is not None else None, offset, len(line))
+
+    def _read(self, key: str) -> dict:
+        offset, length = self._offsets[key]
+        self._file.seek(offset)
+        return json.loads(self._file.read(length))[2]
+
+    def flush(self) -> int:
+        """method to flush the appended records to disk.
+
+        Returns:
+            int: size of the journal, to be passed back as `size` to resume from this point.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self._append(collection, key, val)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> dict | None:
+        if collection == self.node_collection:
+            return self._read(key) if key in self._offsets else None
+        val = self._collections[collection].get(key)
+        return val.copy() if val is not None else None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> dict | None:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        """all the records of the collection, reads the whole corpus for the node collection."""
+        if collection == self.node_collection:
+            return {key: self._read(key) for key in list(self._offsets)}
+        return {key: val.copy() for key, val in self._collections[collection].items()}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        if collection == self.node_collection:
+            exists = key in self._offsets
+        else:
+            exists = key in self._collections[collection]
+        if exists:
+            self._append(collection, key, None)
+        return exists
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    def persist(self, persist_path: str, fs: t.Any | None = None) -> None:
+        """method to write the store as the json of a `SimpleKVStore`, the nodes are read back one at a time."""
+        if fs is not None:
+            raise NotImplementedError('JournalKVStore only supports the local filesystem')
+
+        collections = [self.node_collection, *(name for name in self._collections if name != self.node_collection)]
+        with open(tmp_path := f'{persist_path}.tmp', 'w') as f:
+            for num_collection, collection in enumerate(collections):
+                f.write(f'{"{" if num_collection == 0 else ", "}{json.dumps(collection)}: {{')
+                keys = list(self._offsets) if collection == self.node_collection else self._collections[collection]
+                for num_key, key in enumerate(keys):
+                    val = self._read(key) if collection == self.node_collection else self._collections[collection][key]
+                    f.write(f'{", " if num_key else ""}{json.dumps(key)}: {json.dumps(val)}')
+                f.write('}')
+            f.write('}')
+        os.replace(tmp_path, persist_path)
+
+
+class JournalDocumentStore(KVDocumentStore):
+    """Docstore of a streaming ingest, backed by a `JournalKVStore` so node text is not held in memory.
+    Persisted as a regular `docstore.json`, the index it builds is loaded and merged like any other one.
+    """
+
+    @property
+    def journal(self) -> JournalKVStore:
+        return self._kvstore
+
+    def persist(self, persist_path: str = DEFAULT_PERSIST_PATH, fs: t.Any | None = None) -> None:
+        self._kvstore.persist(persist_path, fs=fs)
+
+
+class CompactDocumentStore(KVDocumentStore):
+    """Read-only docstore serving the nodes of a `NodeFileKVStore`, for the agents.
+    Only node ids are kept in memory and the text of a node is decoded when it is retrieved, instead of the
+    whole `docstore.json` and `index_store.json` loaded by every serving process. Document hashes and ref doc
+    info are not stored, the ingest pipeline keeps updating the full docstore.
+    """
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """check if a compact docstore is persisted in the given directory."""
+        return NodeFileKVStore.exists(persist_dir, namespace)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> 'CompactDocumentStore':
+        """method to load the compact docstore persisted in the given directory."""
+        return cls(NodeFileKVStore.from_persist_dir(persist_dir, namespace))
+
+    @property
+    def node_ids(self) -> list[str]:
+        """ids of the stored nodes."""
+        return self._kvstore.node_ids
+
+    @staticmethod
+    def persist_from(
+        docstore: BaseDocumentStore,
+        node_ids: list[str],
+        persist_dir: str,
+        namespace: str = DEFAULT_VECTOR_STORE,
+    ) -> int:
+        """function to persist the given nodes of a docstore as a compact docstore.
+
+        Args:
+            docstore (BaseDocumentStore): docstore holding the nodes.
+            node_ids (list[str]): ids of the nodes to persist, e.g. in the row order of the vector store.
+            persist_dir (str): directory to persist the compact docstore in.
+            namespace (str, optional): namespace of the files. Defaults to 'default'.
+
+        Returns:
+            int: number of persisted nodes.
+        """
+        records = ((node_id, doc_to_json(docstore.get_node(node_id))) for node_id in node_ids)
+        return NodeFileKVStore.write(persist_dir, records, namespace)
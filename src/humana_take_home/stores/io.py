@@ -0,0 +1,19 @@
+import os
+
+import numpy as np
+
+
+def atomic_write(path: str, payload: bytes) -> None:
+    """helper function to write a file atomically, so readers never see a half written file."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def atomic_save(path: str, array: np.ndarray) -> None:
+    """helper function to save a `.npy` array atomically, see `atomic_write`."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
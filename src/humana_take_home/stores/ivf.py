@@ -0,0 +1,146 @@
+import json
+import os
+from logging import getLogger
+
+import numpy as np
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+
+from .io import atomic_save, atomic_write
+from .search import normalize_rows, score_matrix, top_k_similarity
+
+logger = getLogger(__name__)
+
+# max number of training rows per list used to fit the centroids, same rule of thumb as faiss.
+TRAIN_ROWS_PER_LIST = 256
+
+
+class IVFIndex:
+    """Approximate nearest neighbour index using an inverted file (IVF) over spherical k-means centroids.
+    Rows of the embedding matrix are bucketed by their closest centroid, a query only scores the rows
+    of its `n_probe` closest buckets. Higher `n_probe` trades speed for recall, `n_probe == n_lists` is exact.
+
+    A persisted index is stored next to the binary vector store:
+      - `<namespace>__ivf.centroids.npy`: (n_lists, dim) normalized centroids.
+      - `<namespace>__ivf.rows.npy`: matrix row ids grouped by list.
+      - `<namespace>__ivf.offsets.npy`: (n_lists + 1,) start offset of every list in rows.
+      - `<namespace>__ivf.meta.json`: number of indexed rows, to detect stale indexes.
+    """
+
+    def __init__(self, centroids: np.ndarray, rows: np.ndarray, offsets: np.ndarray) -> None:
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def count(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: int | None = None, n_iter: int = 20, seed: int = 0) -> 'IVFIndex':
+        """method to build the index by clustering the rows with spherical k-means.
+
+        Args:
+            matrix (np.ndarray): (n, dim) matrix of normalized embeddings.
+            n_lists (int | None, optional): number of lists, defaults to ~4 * sqrt(n).
+            n_iter (int, optional): number of k-means iterations. Defaults to 20.
+            seed (int, optional): random seed for initialization and sampling. Defaults to 0.
+
+        Returns:
+            IVFIndex
+        """
+        n_rows = len(matrix)
+        if n_rows == 0:
+            raise ValueError("can't build an ivf index over an empty matrix")
+
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(n_rows))), n_rows)
+        rng = np.random.default_rng(seed)
+
+        # fit centroids on a sample, large corpora do not need every row to place the centroids.
+        sample_size = min(n_rows, n_lists * TRAIN_ROWS_PER_LIST)
+        sample = np.asarray(matrix[np.sort(rng.choice(n_rows, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignment = score_matrix(centroids, sample).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            # re-seed empty lists with random rows, otherwise they stay empty forever.
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        assignment = np.concatenate(
+            [
+                score_matrix(centroids, np.asarray(matrix[start : start + 65_536], dtype=np.float32)).argmax(axis=1)
+                for start in range(0, n_rows, 65_536)
+            ]
+        )
+        rows = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        return cls(centroids=centroids, rows=rows.astype(np.int64), offsets=offsets.astype(np.int64))
+
+    def search(
+        self, matrix: np.ndarray, queries: np.ndarray, top_k: int, n_probe: int = 8
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """method to find the approximate top k rows for a batch of queries.
+
+        Args:
+            matrix (np.ndarray): (n, dim) matrix of normalized embeddings the index was built on.
+            queries (np.ndarray): (q, dim) normalized query embeddings.
+            top_k (int): number of rows to return per query.
+            n_probe (int, optional): number of closest lists to scan per query. Defaults to 8.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (q, k) row indices and similarities, -1 / -inf padded if
+            the probed lists hold less than k rows.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_probe = min(n_probe, self.n_lists)
+        probes, _ = top_k_similarity(self.centroids, queries, n_probe)
+
+        all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for i, query_probes in enumerate(probes):
+            # sorted candidates turn the gather into a forward scan over the memory-mapped matrix.
+            candidates = np.sort(
+                np.concatenate([self.rows[self.offsets[p] : self.offsets[p + 1]] for p in query_probes])
+            )
+            top, scores = top_k_similarity(matrix[candidates], queries[i], top_k)
+            found = top.shape[1]
+            all_rows[i, :found] = candidates[top[0]]
+            all_scores[i, :found] = scores[0]
+        return all_rows, all_scores
+
+    @staticmethod
+    def _file_prefix(persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> str:
+        return os.path.join(persist_dir, f'{namespace}{NAMESPACE_SEP}ivf')
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """check if an ivf index is persisted in the given directory."""
+        return os.path.exists(f'{cls._file_prefix(persist_dir, namespace)}.meta.json')
+
+    def persist(self, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> None:
+        """method to persist the index next to the binary vector store, every file is replaced atomically."""
+        prefix = self._file_prefix(persist_dir, namespace)
+        if os.path.exists(f'{prefix}.meta.json'):
+            os.remove(f'{prefix}.meta.json')  # the arrays of the previous index are about to be replaced.
+        atomic_save(f'{prefix}.centroids.npy', self.centroids)
+        atomic_save(f'{prefix}.rows.npy', self.rows)
+        atomic_save(f'{prefix}.offsets.npy', self.offsets)
+        # meta is written last, it acts as the commit marker of the arrays.
+        atomic_write(f'{prefix}.meta.json', json.dumps({'count': self.count, 'n_lists': self.n_lists}).encode())
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> 'IVFIndex':
+        """method to load the persisted index, row ids are memory-mapped like the vector store."""
+        prefix = cls._file_prefix(persist_dir, namespace)
+        return cls(
+            centroids=np.load(f'{prefix}.centroids.npy'),
+            rows=np.load(f'{prefix}.rows.npy', mmap_mode='r'),
+            offsets=np.load(f'{prefix}.offsets.npy'),
+        )
@@ -0,0 +1,155 @@
+import numpy as np
+
+from .search import SCORE_BLOCK_SIZE, top_k_similarity
+
+SUPPORTED_QUANTIZATIONS = ('int8', 'binary')
+# first-pass candidates re-scored exactly per retrieved node, recovers the recall lost to the codes.
+DEFAULT_RERANK_FACTOR = 4
+# rows decoded per block when scoring, small enough for the decoded block to stay in the cpu cache.
+DECODE_BLOCK_SIZE = 1024
+# up to this many queries, binary codes are scored with lookup tables instead of being decoded.
+LOOKUP_MAX_QUERIES = 2
+
+# bits of every byte value, as packed by `np.packbits`.
+_BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32)
+
+
+class QuantizedMatrix:
+    """Compressed copy of a matrix of normalized embeddings, used for the first pass of a search.
+    Every row is stored as codes and a float32 scale, and is approximated by `scale * decode(codes)`:
+      - `int8`: codes are the row divided by `max(|row|) / 127` and rounded, 4x smaller than float32.
+      - `binary`: codes are the signs of the row packed into bits, the scale is `mean(|row|)`, ~30x smaller.
+
+    Queries stay in float32 and are scored against the decoded rows block by block, so only a small block
+    is ever decoded at once. A few queries against binary codes are scored with one lookup table per query
+    instead, holding the sum of the query over the bits of every byte value. Scores are approximate, the
+    candidates are meant to be re-scored with the float matrix by `rerank_exact`.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, kind: str, dim: int) -> None:
+        if kind not in SUPPORTED_QUANTIZATIONS:
+            raise ValueError(f'`kind` must be one of {SUPPORTED_QUANTIZATIONS}, got {kind}')
+        self.codes = codes
+        self.scales = scales
+        self.kind = kind
+        self.dim = dim
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows: np.ndarray | slice) -> 'QuantizedMatrix':
+        return QuantizedMatrix(self.codes[rows], self.scales[rows], self.kind, self.dim)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """shape of the matrix the codes approximate."""
+        return len(self.codes), self.dim
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    @staticmethod
+    def code_shape(kind: str, dim: int) -> tuple[int, np.dtype]:
+        """number of codes per row and their dtype, for the given kind and embedding size."""
+        return (dim, np.dtype(np.int8)) if kind == 'int8' else ((dim + 7) // 8, np.dtype(np.uint8))
+
+    @classmethod
+    def quantize(cls, matrix: np.ndarray, kind: str) -> 'QuantizedMatrix':
+        """method to quantize a matrix block by block, memory-mapped matrices are never read at once.
+
+        Args:
+            matrix (np.ndarray): (n, dim) matrix of normalized embeddings, float32 or float16.
+            kind (str): one of `int8` or `binary`.
+
+        Returns:
+            QuantizedMatrix
+        """
+        n_rows, dim = matrix.shape
+        width, dtype = cls.code_shape(kind, dim)
+        codes = np.empty((n_rows, width), dtype=dtype)
+        scales = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, SCORE_BLOCK_SIZE):
+            block = np.asarray(matrix[start : start + SCORE_BLOCK_SIZE], dtype=np.float32)
+            stop = start + len(block)
+            if kind == 'int8':
+                block_scales = np.abs(block).max(axis=1) / 127
+                safe_scales = np.maximum(block_scales, np.finfo(np.float32).tiny)[:, None]
+                codes[start:stop] = np.clip(np.rint(block / safe_scales), -127, 127)
+            else:
+                block_scales = np.abs(block).mean(axis=1)
+                codes[start:stop] = np.packbits(block > 0, axis=1)
+            scales[start:stop] = block_scales
+        return cls(codes=codes, scales=scales, kind=kind, dim=dim)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        """unscaled float32 rows of a block of codes, signs as -1 / 1 for binary codes."""
+        if self.kind == 'int8':
+            return codes.astype(np.float32)
+        return np.unpackbits(codes, axis=1, count=self.dim).astype(np.float32) * 2 - 1
+
+    def score(self, queries: np.ndarray) -> np.ndarray:
+        """method to score a batch of queries against all the rows, see `score_matrix`.
+
+        Args:
+            queries (np.ndarray): (q, dim) matrix of normalized float32 query embeddings.
+
+        Returns:
+            np.ndarray: (q, n) float32 matrix of approximate cosine similarities.
+        """
+        if self.kind == 'binary' and len(queries) <= LOOKUP_MAX_QUERIES:
+            return self._score_lookup(queries)
+
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), DECODE_BLOCK_SIZE):
+            stop = min(start + DECODE_BLOCK_SIZE, len(self))
+            block = self._decode(np.asarray(self.codes[start:stop]))
+            scores[:, start:stop] = (queries @ block.T) * self.scales[start:stop]
+        return scores
+
+    def _score_lookup(self, queries: np.ndarray) -> np.ndarray:
+        """method to score binary codes by summing, for every byte of a row, the query over its set bits.
+        With signs as -1 / 1, `query @ signs == 2 * query @ bits - sum(query)`.
+        """
+        width = self.codes.shape[1]
+        padded = np.zeros((len(queries), width * 8), dtype=np.float32)
+        padded[:, : self.dim] = queries
+        # (q, width * 256) flat tables, the value of byte `b` at position `j` is at `j * 256 + b`.
+        tables = (padded.reshape(len(queries), width, 8) @ _BYTE_BITS.T).reshape(len(queries), -1)
+        offsets = np.arange(width, dtype=np.intp) * 256
+
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), DECODE_BLOCK_SIZE):
+            stop = min(start + DECODE_BLOCK_SIZE, len(self))
+            indices = np.asarray(self.codes[start:stop]) + offsets
+            for i, table in enumerate(tables):
+                scores[i, start:stop] = table[indices].sum(axis=1)
+        return (2 * scores - queries.sum(axis=1, keepdims=True)) * self.scales
+
+
+def rerank_exact(
+    matrix: np.ndarray, queries: np.ndarray, candidates: np.ndarray, top_k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """function to re-score the candidates of an approximate search with the float matrix.
+    Only the candidate rows are read, in sorted order so a memory-mapped matrix is scanned forward.
+
+    Args:
+        matrix (np.ndarray): (n, dim) matrix of normalized embeddings.
+        queries (np.ndarray): (q, dim) normalized query embeddings.
+        candidates (np.ndarray): (q, c) candidate rows per query, -1 padded.
+        top_k (int): number of rows to return per query.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (q, k) row indices and exact similarities, best first, -1 / -inf padded
+        if there are less than k candidates.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+    all_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+    for i, query_candidates in enumerate(candidates):
+        rows = np.unique(query_candidates[query_candidates >= 0])
+        top, scores = top_k_similarity(matrix[rows], queries[i], top_k)
+        found = top.shape[1]
+        all_rows[i, :found] = rows[top[0]]
+        all_scores[i, :found] = scores[0]
+    return all_rows, all_scores
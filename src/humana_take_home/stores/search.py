@@ -0,0 +1,79 @@
+import typing as t
+
+import numpy as np
+
+if t.TYPE_CHECKING:
+    from .quantization import QuantizedMatrix
+
+# rows scored per block when the matrix is not stored as float32, keeps the upcast copy small.
+SCORE_BLOCK_SIZE = 65_536
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """helper function to L2-normalize the rows, so cosine similarity becomes a plain dot product.
+
+    Args:
+        embeddings (np.ndarray): 1d embedding or 2d matrix of embeddings.
+
+    Returns:
+        np.ndarray: float32 normalized embeddings with the same shape as input.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def score_matrix(matrix: 'np.ndarray | QuantizedMatrix', queries: np.ndarray) -> np.ndarray:
+    """helper function to score a batch of queries against all the rows of the matrix.
+
+    Args:
+        matrix (np.ndarray | QuantizedMatrix): (n, dim) matrix of normalized embeddings, float32, float16
+        or quantized.
+        queries (np.ndarray): (q, dim) matrix of normalized float32 query embeddings.
+
+    Returns:
+        np.ndarray: (q, n) float32 matrix of cosine similarities.
+    """
+    if not isinstance(matrix, np.ndarray):
+        return matrix.score(queries)
+    if matrix.dtype == np.float32:
+        return queries @ matrix.T
+
+    # float16 has no BLAS kernel, upcast block by block instead of copying the whole matrix.
+    scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_SIZE):
+        block = matrix[start : start + SCORE_BLOCK_SIZE].astype(np.float32)
+        scores[:, start : start + len(block)] = queries @ block.T
+    return scores
+
+
+def top_k_similarity(
+    matrix: 'np.ndarray | QuantizedMatrix', queries: np.ndarray, top_k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """helper function to find the top k most similar rows for a batch of queries.
+    Scores every query with a single matrix product and selects candidates with `argpartition`,
+    only the k selected candidates are sorted.
+
+    Args:
+        matrix (np.ndarray | QuantizedMatrix): (n, dim) matrix of normalized embeddings.
+        queries (np.ndarray): (dim,) or (q, dim) normalized query embeddings.
+        top_k (int): number of rows to return per query.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (q, k) row indices and (q, k) similarities, sorted by descending similarity.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    top_k = min(top_k, len(matrix))
+    if top_k <= 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    scores = score_matrix(matrix, queries)
+    if top_k < scores.shape[1]:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
@@ -0,0 +1,106 @@
+import os
+import re
+from dataclasses import dataclass
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.storage.docstore.types import DEFAULT_PERSIST_FNAME as DOCSTORE_FNAME
+
+from .ivf import IVFIndex
+from .sparse import BM25Index
+
+SHARD_STRATEGIES = ('collection', 'size')
+# shard of the files directly within the input directory when sharding by collection.
+DEFAULT_SHARD = 'default'
+# shards created when sharding by size, numbered after the existing ones.
+_SIZE_SHARD = re.compile(r'^shard-(\d+)$')
+
+
+@dataclass
+class IndexShard:
+    """Indexes persisted in one shard directory, loaded."""
+
+    name: str
+    vector_index: VectorStoreIndex
+    ann_index: IVFIndex | None = None
+    sparse_index: BM25Index | None = None
+
+
+def shard_path(persist_dir: str, shard: str) -> str:
+    """path of a shard within a sharded index directory."""
+    return os.path.join(persist_dir, shard)
+
+
+def list_shards(persist_dir: str) -> list[str]:
+    """function to list the shards of a sharded index, i.e. its subdirectories holding a persisted index.
+
+    Args:
+        persist_dir (str): root directory of the index.
+
+    Returns:
+        list[str]: sorted shard names, empty for a monolithic index.
+    """
+    if not os.path.isdir(persist_dir):
+        return []
+    return sorted(
+        entry.name
+        for entry in os.scandir(persist_dir)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, DOCSTORE_FNAME))
+    )
+
+
+def is_sharded(persist_dir: str) -> bool:
+    """check if the directory is a sharded index, a monolithic index has its docstore at the root."""
+    return not os.path.exists(os.path.join(persist_dir, DOCSTORE_FNAME)) and bool(list_shards(persist_dir))
+
+
+def plan_shards(
+    files: list[str],
+    shard_by: str = 'collection',
+    input_dir: str | None = None,
+    shard_size_mb: float = 512.0,
+    existing_shards: list[str] | None = None,
+) -> dict[str, list[str]]:
+    """function to assign the files of a corpus to shards.
+      - `collection`: one shard per subdirectory of `input_dir` (the parent directory of every file without it),
+        named after it, files directly within `input_dir` go to the `default` shard.
+      - `size`: files in path order are packed into shards of at most `shard_size_mb`, named `shard-000`,
+        `shard-001`... numbered after the `existing_shards`, so a new batch of files is added as new shards.
+
+    Args:
+        files (list[str]): paths of the files.
+        shard_by (str, optional): one of `collection` or `size`. Defaults to 'collection'.
+        input_dir (str | None, optional): root directory of the collections. Defaults to None.
+        shard_size_mb (float, optional): max size of the files of a shard when sharding by size. Defaults to 512.0.
+        existing_shards (list[str] | None, optional): shards already persisted. Defaults to None.
+
+    Raises:
+        ValueError: if `shard_by` is not supported.
+
+    Returns:
+        dict[str, list[str]]: files per shard name.
+    """
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f'`shard_by` must be one of {SHARD_STRATEGIES}, got {shard_by}')
+
+    shards: dict[str, list[str]] = {}
+    if shard_by == 'collection':
+        for file_path in files:
+            if input_dir is not None:
+                relative_dir = os.path.dirname(os.path.relpath(file_path, input_dir))
+                name = relative_dir.split(os.sep)[0] if relative_dir else DEFAULT_SHARD
+            else:
+                name = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+            shards.setdefault(name, []).append(file_path)
+        return shards
+
+    numbers = [int(match.group(1)) for name in existing_shards or [] if (match := _SIZE_SHARD.match(name))]
+    number, shard_bytes, max_bytes = max(numbers, default=-1) + 1, 0, shard_size_mb * 2**20
+    for file_path in sorted(files):
+        file_bytes = os.path.getsize(file_path)
+        name = f'shard-{number:03d}'
+        if name in shards and shard_bytes + file_bytes > max_bytes:
+            number, shard_bytes = number + 1, 0
+            name = f'shard-{number:03d}'
+        shards.setdefault(name, []).append(file_path)
+        shard_bytes += file_bytes
+    return shards
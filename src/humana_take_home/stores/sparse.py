@@ -0,0 +1,237 @@
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+
+from .io import atomic_save, atomic_write
+
+# words, numbers and compounds like `her-2/neu`, `p53` or `1.5`; compounds are indexed along with their parts.
+_TOKEN = re.compile(r'\w+(?:[-/.]\w+)*')
+_PART = re.compile(r'\w+')
+
+# frequent english words carrying no meaning of their own, dropped from documents and queries.
+STOP_WORDS = frozenset(
+    'a about above after again against all am an and any are as at be because been before being below between '
+    'both but by can could did do does doing down during each few for from further had has have having he her '
+    'here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not '
+    'now of off on once only or other our ours ourselves out over own same she should so some such than that the '
+    'their theirs them themselves then there these they this those through to too under until up very was we '
+    'were what when where which while who whom why will with would you your yours yourself yourselves'.split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """helper function to split a text into lowercase index terms, stop words removed.
+
+    Args:
+        text (str): text of a node or a query.
+
+    Returns:
+        list[str]: terms, compounds followed by their parts, e.g. `her-2/neu`, `her`, `2`, `neu`.
+    """
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOP_WORDS)
+    return terms
+
+
+class BM25Index:
+    """Sparse inverted index scoring nodes with Okapi BM25, for exact matches dense embeddings tend to miss,
+    e.g. numbers, gene names or table references.
+
+    Postings are stored per term in CSR layout, with the BM25 weight of every (term, node) pair computed
+    at build time, so scoring a query is a sum of the postings of its terms.
+    A persisted index is stored next to the vector store:
+      - `<namespace>__bm25.terms.json`: vocabulary, the position of a term is its id.
+      - `<namespace>__bm25.offsets.npy`: (n_terms + 1,) start offset of the postings of every term.
+      - `<namespace>__bm25.rows.npy`: int32 node rows of the postings, grouped by term.
+      - `<namespace>__bm25.weights.npy`: float32 BM25 weight of every posting.
+      - `<namespace>__bm25.ids`: node id of every row, one per line.
+      - `<namespace>__bm25.meta.json`: number of nodes and terms and BM25 parameters.
+    """
+
+    def __init__(
+        self,
+        terms: list[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        weights: np.ndarray,
+        node_ids: list[str],
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> None:
+        self.terms = terms
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.node_ids = node_ids
+        self.k1 = k1
+        self.b = b
+
+    @property
+    def count(self) -> int:
+        return len(self.node_ids)
+
+    @classmethod
+    def build(cls, texts: list[str], node_ids: list[str], k1: float = 1.2, b: float = 0.75) -> 'BM25Index':
+        """method to build the index over the texts of the nodes.
+
+        Args:
+            texts (list[str]): text of every node, e.g. its content followed by its keywords.
+            node_ids (list[str]): node id of every text.
+            k1 (float, optional): term frequency saturation. Defaults to 1.2.
+            b (float, optional): document length normalization. Defaults to 0.75.
+
+        Returns:
+            BM25Index
+        """
+        if len(texts) != len(node_ids):
+            raise ValueError(f'{len(texts)} texts were provided for {len(node_ids)} node ids')
+
+        term_ids: dict[str, int] = {}
+        posting_terms, posting_rows, posting_tfs, lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_rows.append(row)
+                posting_tfs.append(tf)
+
+        posting_terms = np.asarray(posting_terms, dtype=np.int64)
+        order = np.argsort(posting_terms, kind='stable')
+        rows = np.asarray(posting_rows, dtype=np.int32)[order]
+        tfs = np.asarray(posting_tfs, dtype=np.float32)[order]
+        df = np.bincount(posting_terms, minlength=len(term_ids))
+        offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avg_length = max(float(lengths.mean()) if len(lengths) else 0.0, 1.0)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths[rows] / avg_length)
+        weights = np.repeat(idf, df) * tfs * (k1 + 1) / (tfs + norm)
+
+        return cls(
+            terms=list(term_ids),
+            offsets=offsets,
+            rows=rows,
+            weights=weights.astype(np.float32),
+            node_ids=list(node_ids),
+            k1=k1,
+            b=b,
+        )
+
+    def score(self, query: str) -> np.ndarray:
+        """method to score all the nodes against a query, terms repeated in the query count repeatedly.
+
+        Args:
+            query (str): user query.
+
+        Returns:
+            np.ndarray: (n,) float32 BM25 scores, 0 for nodes sharing no term with the query.
+        """
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            if (term_id := self.term_ids.get(term)) is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            # a node appears once per term, so the fancy index update does not drop duplicates.
+            scores[self.rows[start:stop]] += query_tf * self.weights[start:stop]
+        return scores
+
+    def search(self, queries: list[str], top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """method to find the top k nodes for a batch of queries.
+
+        Args:
+            queries (list[str]): user queries.
+            top_k (int): number of rows to return per query.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (q, k) rows and BM25 scores, best first, -1 / 0 padded when less than
+            k nodes share a term with the query.
+        """
+        all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        all_scores = np.zeros((len(queries), top_k), dtype=np.float32)
+        for i, query in enumerate(queries):
+            scores = self.score(query)
+            matches = np.flatnonzero(scores)
+            if len(matches) > top_k:
+                matches = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+            matches = matches[np.argsort(-scores[matches], kind='stable')]
+            all_rows[i, : len(matches)] = matches
+            all_scores[i, : len(matches)] = scores[matches]
+        return all_rows, all_scores
+
+    @staticmethod
+    def _file_prefix(persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> str:
+        return os.path.join(persist_dir, f'{namespace}{NAMESPACE_SEP}bm25')
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """check if a bm25 index is persisted in the given directory."""
+        return os.path.exists(f'{cls._file_prefix(persist_dir, namespace)}.meta.json')
+
+    def persist(self, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> None:
+        """method to persist the index next to the vector store, every file is replaced atomically."""
+        prefix = self._file_prefix(persist_dir, namespace)
+        if os.path.exists(f'{prefix}.meta.json'):
+            os.remove(f'{prefix}.meta.json')  # the files of the previous index are about to be replaced.
+        atomic_write(f'{prefix}.terms.json', json.dumps(self.terms, ensure_ascii=False).encode('utf-8'))
+        atomic_save(f'{prefix}.offsets.npy', self.offsets)
+        atomic_save(f'{prefix}.rows.npy', self.rows)
+        atomic_save(f'{prefix}.weights.npy', self.weights)
+        atomic_write(f'{prefix}.ids', ''.join(f'{node_id}\n' for node_id in self.node_ids).encode('utf-8'))
+        # meta is written last, it acts as the commit marker of the other files.
+        meta = {'count': self.count, 'n_terms': len(self.terms), 'k1': self.k1, 'b': self.b}
+        atomic_write(f'{prefix}.meta.json', json.dumps(meta).encode())
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> 'BM25Index':
+        """method to load the persisted index, postings are memory-mapped like the vector store."""
+        prefix = cls._file_prefix(persist_dir, namespace)
+        with open(f'{prefix}.meta.json') as f:
+            meta = json.load(f)
+        with open(f'{prefix}.terms.json', encoding='utf-8') as f:
+            terms = json.load(f)
+        with open(f'{prefix}.ids', encoding='utf-8') as f:
+            node_ids = [line.rstrip('\n') for line in f]
+
+        return cls(
+            terms=terms,
+            offsets=np.load(f'{prefix}.offsets.npy'),
+            rows=np.load(f'{prefix}.rows.npy', mmap_mode='r'),
+            weights=np.load(f'{prefix}.weights.npy', mmap_mode='r'),
+            node_ids=node_ids,
+            k1=meta['k1'],
+            b=meta['b'],
+        )
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], weights: list[float] | None = None, k: int = 60
+) -> list[tuple[str, float]]:
+    """function to fuse rankings of the same nodes, e.g. dense and sparse, scoring `weight / (k + rank)` each.
+    Ranks are comparable across retrievers while their scores are not, cosine similarities and BM25 scores
+    live on different scales.
+
+    Args:
+        rankings (list[list[str]]): node ids ranked by every retriever, best first.
+        weights (list[float] | None, optional): weight of every ranking. Defaults to None, 1 each.
+        k (int, optional): smoothing constant, higher values flatten the head of the rankings. Defaults to 60.
+
+    Returns:
+        list[tuple[str, float]]: (node_id, fused score) pairs, best first.
+    """
+    weights = weights if weights is not None else [1.0] * len(rankings)
+    fused: dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, node_id in enumerate(ranking, start=1):
+            fused[node_id] = fused.get(node_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
@@ -0,0 +1,518 @@
+import hashlib
+import json
+import os
+import typing as t
+from logging import getLogger
+
+import numpy as np
+from llama_index.core import StorageContext
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP, SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from .io import atomic_write
+from .quantization import DEFAULT_RERANK_FACTOR, SUPPORTED_QUANTIZATIONS, QuantizedMatrix, rerank_exact
+from .search import normalize_rows, top_k_similarity
+
+logger = getLogger(__name__)
+
+SUPPORTED_DTYPES = ('float32', 'float16')
+FORMAT_VERSION = 1
+
+
+class MMapVectorStore(BasePydanticVectorStore):
+    """Vector store persisted as a contiguous row-major matrix, memory-mapped at load time.
+
+    A persisted store is made of three files sharing the llama_index namespace prefix:
+      - `<namespace>__vector_store.bin`: raw float32/float16 matrix of L2-normalized embeddings.
+      - `<namespace>__vector_store.ids`: node id table, one `node_id<TAB>ref_doc_id` line per matrix row.
+      - `<namespace>__vector_store.meta.json`: shape, dtype, quantization and format version of the matrix.
+
+    With a `quantization`, the codes and per-row scales of a `QuantizedMatrix` are persisted as well
+    (`<namespace>__vector_store.codes.bin` and `.scales.bin`). Queries are scored against the codes first and
+    the best candidates re-scored with the float matrix, so only a few rows of the latter are ever paged in.
+
+    Loading only parses the id table, the matrix itself is paged in lazily by the os and shared
+    between all the processes serving the same index.
+    """
+
+    stores_text: bool = False
+    dtype: str = 'float32'
+    quantization: str | None = None
+
+    _matrix: np.ndarray | None = PrivateAttr(default=None)
+    _node_ids: list[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: list[str] = PrivateAttr(default_factory=list)
+    _id_to_row: dict[str, int] = PrivateAttr(default_factory=dict)
+    # over-allocated matrix backing `_matrix` while nodes are being added, so appends are amortized O(1).
+    _buffer: np.ndarray | None = PrivateAttr(default=None)
+    # `.bin` file the buffer is memory-mapped from, set for stores opened with `open_appendable`.
+    _backing_path: str | None = PrivateAttr(default=None)
+    _persisted_count: int = PrivateAttr(default=0)
+    # codes of the matrix rows, loaded from disk or quantized on first use, dropped whenever rows change.
+    _codes: QuantizedMatrix | None = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        dtype: str = 'float32',
+        matrix: np.ndarray | None = None,
+        node_ids: list[str] | None = None,
+        ref_doc_ids: list[str] | None = None,
+        quantization: str | None = None,
+        codes: QuantizedMatrix | None = None,
+        **kwargs: t.Any,
+    ) -> None:
+        """constructor to initialize the store from an optional pre-computed matrix.
+
+        Args:
+            dtype (str, optional): storage dtype of the matrix, one of `float32` or `float16`. Defaults to 'float32'.
+            matrix (np.ndarray | None, optional): L2-normalized embedding matrix. Defaults to None.
+            node_ids (list[str] | None, optional): node id for each row of the matrix. Defaults to None.
+            ref_doc_ids (list[str] | None, optional): ref doc id for each row of the matrix. Defaults to None.
+            quantization (str | None, optional): quantization of the first-pass codes, one of `int8` or `binary`.
+            Defaults to None, queries are scored against the matrix only.
+            codes (QuantizedMatrix | None, optional): pre-computed codes of the matrix. Defaults to None.
+
+        Raises:
+            ValueError: if dtype or quantization is not supported or matrix and id table sizes do not match.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f'`dtype` must be one of {SUPPORTED_DTYPES}, got {dtype}')
+        if quantization is not None and quantization not in SUPPORTED_QUANTIZATIONS:
+            raise ValueError(f'`quantization` must be one of {SUPPORTED_QUANTIZATIONS}, got {quantization}')
+
+        super().__init__(dtype=dtype, quantization=quantization, **kwargs)
+
+        node_ids = node_ids or []
+        if matrix is not None and len(matrix) != len(node_ids):
+            raise ValueError(f'matrix has {len(matrix)} rows but {len(node_ids)} node ids were provided')
+
+        self._matrix = matrix
+        self._node_ids = list(node_ids)
+        self._ref_doc_ids = list(ref_doc_ids) if ref_doc_ids is not None else ['None'] * len(node_ids)
+        self._id_to_row = {node_id: row for row, node_id in enumerate(self._node_ids)}
+        self._codes = codes
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'MMapVectorStore'
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """L2-normalized embedding matrix, memory-mapped when loaded from disk."""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._matrix
+
+    @property
+    def codes(self) -> QuantizedMatrix | None:
+        """first-pass codes of the matrix, None without `quantization`."""
+        if self.quantization is None or self._matrix is None:
+            return None
+        if self._codes is None or len(self._codes) != len(self._node_ids):
+            self._codes = QuantizedMatrix.quantize(self._matrix, self.quantization)
+        return self._codes
+
+    @property
+    def node_ids(self) -> list[str]:
+        """node id for each row of the matrix."""
+        return self._node_ids
+
+    @staticmethod
+    def _file_prefix(persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> str:
+        return os.path.join(persist_dir, f'{namespace}{NAMESPACE_SEP}vector_store')
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """check if a binary vector store is persisted in the given directory."""
+        return os.path.exists(f'{cls._file_prefix(persist_dir, namespace)}.meta.json')
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE, mmap: bool = True
+    ) -> 'MMapVectorStore':
+        """method to load the binary vector store from the local storage.
+
+        Args:
+            persist_dir (str): directory containing the persisted store.
+            namespace (str, optional): vector store namespace. Defaults to 'default'.
+            mmap (bool, optional): memory-map the matrix instead of reading it into memory. Defaults to True.
+
+        Raises:
+            ValueError: if the persisted files are not consistent with each other.
+
+        Returns:
+            MMapVectorStore
+        """
+        prefix = cls._file_prefix(persist_dir, namespace)
+        with open(f'{prefix}.meta.json') as f:
+            meta = json.load(f)
+
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f'unsupported vector store format version {meta.get("format_version")} @ {prefix}')
+
+        count, dim = meta['count'], meta['dim']
+        with open(f'{prefix}.ids', encoding='utf-8') as f:
+            rows = [line.rstrip('\n').split('\t') for line in f][:count]
+
+        if len(rows) != count:
+            raise ValueError(f'id table @ {prefix}.ids has {len(rows)} rows, expected {count}')
+
+        quantization, codes = meta.get('quantization'), None
+        if count == 0:
+            matrix = None
+        elif mmap:
+            matrix = np.memmap(f'{prefix}.bin', dtype=meta['dtype'], mode='r', shape=(count, dim))
+        else:
+            matrix = np.fromfile(f'{prefix}.bin', dtype=meta['dtype'], count=count * dim).reshape(count, dim)
+
+        if quantization is not None and count:
+            width, code_dtype = QuantizedMatrix.code_shape(quantization, dim)
+            if mmap:
+                code_rows = np.memmap(f'{prefix}.codes.bin', dtype=code_dtype, mode='r', shape=(count, width))
+                scales = np.memmap(f'{prefix}.scales.bin', dtype=np.float32, mode='r', shape=(count,))
+            else:
+                code_rows = np.fromfile(f'{prefix}.codes.bin', dtype=code_dtype, count=count * width)
+                code_rows = code_rows.reshape(count, width)
+                scales = np.fromfile(f'{prefix}.scales.bin', dtype=np.float32, count=count)
+            codes = QuantizedMatrix(codes=code_rows, scales=scales, kind=quantization, dim=dim)
+
+        return cls(
+            dtype=meta['dtype'],
+            matrix=matrix,
+            node_ids=[row[0] for row in rows],
+            ref_doc_ids=[row[1] for row in rows],
+            quantization=quantization,
+            codes=codes,
+        )
+
+    @classmethod
+    def open_appendable(
+        cls,
+        persist_dir: str,
+        namespace: str = DEFAULT_VECTOR_STORE,
+        dtype: str = 'float32',
+        resume: bool = True,
+        quantization: str | None = None,
+    ) -> 'MMapVectorStore':
+        """method to open a store whose rows are written straight into the persisted `.bin` file.
+        Added rows live in the page cache instead of the heap, and `persist` only flushes them, appends
+        the new id rows and rewrites the meta file, so memory and checkpoint cost do not grow with the store.
+
+        Args:
+            persist_dir (str): directory of the persisted store.
+            namespace (str, optional): vector store namespace. Defaults to 'default'.
+            dtype (str, optional): storage dtype of a new store. Defaults to 'float32'.
+            resume (bool, optional): keep the rows of an existing store, otherwise start empty. Defaults to True.
+            quantization (str | None, optional): quantization of a new store. Defaults to None.
+
+        Raises:
+            ValueError: if the existing store has a different dtype or quantization.
+
+        Returns:
+            MMapVectorStore
+        """
+        os.makedirs(persist_dir, exist_ok=True)
+        prefix = cls._file_prefix(persist_dir, namespace)
+        if resume and cls.exists(persist_dir, namespace):
+            store = cls.from_persist_dir(persist_dir, namespace, mmap=True)
+            if store.dtype != dtype:
+                raise ValueError(f'existing store @ {prefix} has dtype {store.dtype}, expected {dtype}')
+            if store.quantization != quantization:
+                raise ValueError(
+                    f'existing store @ {prefix} has quantization {store.quantization}, expected {quantization}'
+                )
+        else:
+            if os.path.exists(f'{prefix}.meta.json'):
+                os.remove(f'{prefix}.meta.json')  # the old rows are about to be overwritten in place.
+            store = cls(dtype=dtype, quantization=quantization)
+
+        store._backing_path = f'{prefix}.bin'
+        store._persisted_count = len(store.node_ids)
+        if store._matrix is not None:
+            store._buffer = np.memmap(store._backing_path, dtype=store.dtype, mode='r+', shape=store._matrix.shape)
+            store._matrix = store._buffer
+
+        # rows past the meta count belong to an interrupted run, drop them from the id table.
+        atomic_write(f'{prefix}.ids', store._id_table())
+        return store
+
+    @classmethod
+    def from_simple_vector_store(cls, vector_store: SimpleVectorStore, dtype: str = 'float32') -> 'MMapVectorStore':
+        """method to convert the default json backed vector store into the binary one.
+
+        Args:
+            vector_store (SimpleVectorStore): vector store to be converted.
+            dtype (str, optional): storage dtype of the matrix. Defaults to 'float32'.
+
+        Returns:
+            MMapVectorStore
+        """
+        embedding_dict = vector_store.data.embedding_dict
+        node_ids = list(embedding_dict.keys())
+        matrix = None
+        if node_ids:
+            matrix = normalize_rows([embedding_dict[node_id] for node_id in node_ids])
+
+        return cls(
+            dtype=dtype,
+            matrix=matrix.astype(dtype) if matrix is not None else None,
+            node_ids=node_ids,
+            ref_doc_ids=[vector_store.data.text_id_to_ref_doc_id.get(node_id, 'None') for node_id in node_ids],
+        )
+
+    def _id_table(self, start: int = 0) -> bytes:
+        """id table rows from `start` onwards, as written to the `.ids` file."""
+        rows = zip(self._node_ids[start:], self._ref_doc_ids[start:])
+        return ''.join(f'{node_id}\t{ref_id}\n' for node_id, ref_id in rows).encode()
+
+    def _drop_rows(self, rows: t.Iterable[int]) -> None:
+        rows = sorted(set(rows))
+        if not rows:
+            return
+
+        keep = np.ones(len(self._node_ids), dtype=bool)
+        keep[rows] = False
+        self._matrix = np.ascontiguousarray(self.matrix[keep]) if keep.any() else None
+        self._buffer, self._backing_path, self._codes = None, None, None
+        self._node_ids = [node_id for node_id, k in zip(self._node_ids, keep) if k]
+        self._ref_doc_ids = [ref_doc_id for ref_doc_id, k in zip(self._ref_doc_ids, keep) if k]
+        self._id_to_row = {node_id: row for row, node_id in enumerate(self._node_ids)}
+
+    def add(self, nodes: t.Sequence[BaseNode], **add_kwargs: t.Any) -> list[str]:
+        """Add nodes to the store, existing nodes with same id are overwritten."""
+        if not nodes:
+            return []
+
+        self._drop_rows(self._id_to_row[node.node_id] for node in nodes if node.node_id in self._id_to_row)
+
+        embeddings = normalize_rows([node.get_embedding() for node in nodes]).astype(self.dtype)
+        self._append_rows(embeddings)
+
+        for node in nodes:
+            self._id_to_row[node.node_id] = len(self._node_ids)
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or 'None')
+
+        return [node.node_id for node in nodes]
+
+    def _append_rows(self, embeddings: np.ndarray) -> None:
+        """method to append rows to the matrix, growing the backing buffer geometrically.
+        Streaming ingestion adds nodes batch by batch, a plain concatenate would copy the matrix every batch.
+        """
+        count, (n_rows, dim) = len(self._node_ids), embeddings.shape
+        if self._backing_path is not None:
+            self._grow_backing_file(count + n_rows, dim)
+        elif self._buffer is None or len(self._buffer) < count + n_rows or self._buffer.shape[1] != dim:
+            buffer = np.empty((max(count + n_rows, 2 * count), dim), dtype=self.dtype)
+            if count:
+                buffer[:count] = self._matrix
+            self._buffer = buffer
+
+        self._buffer[count : count + n_rows] = embeddings
+        self._matrix = self._buffer[: count + n_rows]
+        self._codes = None
+
+    def _grow_backing_file(self, min_rows: int, dim: int) -> None:
+        """method to make sure the backing file holds at least `min_rows` rows, growing it geometrically."""
+        if self._buffer is not None and len(self._buffer) >= min_rows:
+            return
+
+        row_bytes = dim * np.dtype(self.dtype).itemsize
+        with open(self._backing_path, 'ab'):
+            pass  # create the file on first append.
+        size = max(os.path.getsize(self._backing_path), max(min_rows, 2 * len(self._node_ids)) * row_bytes)
+        os.truncate(self._backing_path, size)
+        self._buffer = np.memmap(self._backing_path, dtype=self.dtype, mode='r+', shape=(size // row_bytes, dim))
+
+    def trim(self) -> None:
+        """method to release the rows over-allocated by `_append_rows`, once no more rows are being added.
+        The backing file of an appendable store is truncated to the rows of the store, other stores copy
+        their rows out of the larger buffer.
+        """
+        count = len(self._node_ids)
+        if self._buffer is None or len(self._buffer) == count:
+            return
+
+        dim = self._buffer.shape[1]
+        if self._backing_path is None:
+            self._matrix = np.ascontiguousarray(self._matrix) if count else None
+            self._buffer = self._matrix
+            return
+
+        # the mapping must be released before truncating, pages past the end of the file can no longer be read.
+        self._buffer.flush()
+        self._matrix, self._buffer = None, None
+        os.truncate(self._backing_path, count * dim * np.dtype(self.dtype).itemsize)
+        if count:
+            self._buffer = np.memmap(self._backing_path, dtype=self.dtype, mode='r+', shape=(count, dim))
+            self._matrix = self._buffer
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: t.Any) -> None:
+        """Delete all the nodes belonging to the given ref doc id."""
+        self._drop_rows(row for row, ref_id in enumerate(self._ref_doc_ids) if ref_id == ref_doc_id)
+
+    def delete_nodes(
+        self,
+        node_ids: list[str] | None = None,
+        filters: MetadataFilters | None = None,
+        **delete_kwargs: t.Any,
+    ) -> None:
+        """Delete nodes by node ids, metadata filters are not supported as metadata lives in the docstore."""
+        if filters is not None:
+            raise NotImplementedError('MMapVectorStore does not support metadata filters')
+        if node_ids is None:
+            return self.clear()
+
+        self._drop_rows(self._id_to_row[node_id] for node_id in node_ids if node_id in self._id_to_row)
+
+    def clear(self) -> None:
+        self._matrix, self._buffer, self._backing_path, self._codes = None, None, None, None
+        self._node_ids, self._ref_doc_ids, self._id_to_row = [], [], {}
+
+    def query(
+        self, query: VectorStoreQuery, rerank_factor: int = DEFAULT_RERANK_FACTOR, **kwargs: t.Any
+    ) -> VectorStoreQueryResult:
+        """Score all the rows against the query embedding with a single matrix-vector product.
+        With a `quantization`, the codes are scored instead and the `rerank_factor * similarity_top_k` best
+        candidates are re-scored exactly with the matrix.
+        """
+        if query.filters is not None:
+            raise ValueError('MMapVectorStore does not support metadata filters')
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f'Invalid query mode: {query.mode}')
+        if self._matrix is None or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        rows = np.arange(len(self._node_ids))
+        if query.node_ids is not None:
+            rows = np.asarray([self._id_to_row[node_id] for node_id in query.node_ids if node_id in self._id_to_row])
+            if len(rows) == 0:
+                return VectorStoreQueryResult(similarities=[], ids=[])
+
+        matrix = self._matrix if query.node_ids is None else self._matrix[rows]
+        query_embedding = normalize_rows(query.query_embedding)
+        if (codes := self.codes) is None:
+            top, scores = top_k_similarity(matrix, query_embedding, query.similarity_top_k)
+        else:
+            codes = codes if query.node_ids is None else codes[rows]
+            candidates, _ = top_k_similarity(codes, query_embedding, query.similarity_top_k * rerank_factor)
+            top, scores = rerank_exact(matrix, query_embedding, candidates, query.similarity_top_k)
+
+        found = top[0] >= 0
+        return VectorStoreQueryResult(
+            similarities=scores[0][found].tolist(),
+            ids=[self._node_ids[rows[i]] for i in top[0][found]],
+        )
+
+    def persist(self, persist_path: str, fs: t.Any | None = None) -> None:
+        """Persist the store next to the given llama_index vector store path.
+
+        `StorageContext.persist` hands over `<dir>/<namespace>__vector_store.json`, the binary
+        files are written with the same prefix and the json suffix stripped.
+        """
+        if fs is not None:
+            raise NotImplementedError('MMapVectorStore only supports the local filesystem')
+
+        prefix = persist_path.removesuffix('.json')
+        os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+
+        matrix = self.matrix
+        if self._backing_path is not None and os.path.abspath(self._backing_path) == os.path.abspath(f'{prefix}.bin'):
+            # rows are already in place, only flush them and append the new ids and codes.
+            if self._buffer is not None:
+                self._buffer.flush()
+            with open(f'{prefix}.ids', 'ab') as f:
+                f.write(self._id_table(start=self._persisted_count))
+            self._persist_codes(prefix, start=self._persisted_count)
+            self._persisted_count = len(self._node_ids)
+        else:
+            atomic_write(f'{prefix}.bin', np.ascontiguousarray(matrix, dtype=self.dtype).tobytes())
+            atomic_write(f'{prefix}.ids', self._id_table())
+            self._persist_codes(prefix)
+        # meta is written last, it acts as the commit marker of the other files.
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'dtype': self.dtype,
+            'count': len(self._node_ids),
+            'dim': int(matrix.shape[1]) if len(self._node_ids) else 0,
+            'normalized': True,
+            'quantization': self.quantization,
+        }
+        atomic_write(f'{prefix}.meta.json', json.dumps(meta).encode())
+
+    def _persist_codes(self, prefix: str, start: int = 0) -> None:
+        """method to write the codes and scales of the rows from `start` onwards, earlier rows are kept as is."""
+        if self.quantization is None or not self._node_ids:
+            return
+        if start and not os.path.exists(f'{prefix}.codes.bin'):
+            start = 0
+
+        # rows are quantized independently, so appended rows never change the codes already written.
+        codes = QuantizedMatrix.quantize(self.matrix[start:], self.quantization)
+        if start == 0:
+            atomic_write(f'{prefix}.codes.bin', codes.codes.tobytes())
+            atomic_write(f'{prefix}.scales.bin', codes.scales.tobytes())
+            return
+
+        # rows past `start` belong to an interrupted run, they are overwritten.
+        width, code_dtype = QuantizedMatrix.code_shape(self.quantization, codes.dim)
+        for path, values, row_bytes in (
+            (f'{prefix}.codes.bin', codes.codes, width * code_dtype.itemsize),
+            (f'{prefix}.scales.bin', codes.scales, np.dtype(np.float32).itemsize),
+        ):
+            with open(path, 'r+b') as f:
+                f.truncate(start * row_bytes)
+                f.seek(0, os.SEEK_END)
+                f.write(values.tobytes())
+
+
+def index_fingerprint(persist_dir: str) -> str:
+    """helper function to fingerprint a persisted index from the name, size and mtime of its files.
+    Any rebuild or merge changes it. Files of subdirectories are included, so rebuilding any shard of a
+    sharded index changes the fingerprint of the whole index.
+
+    Args:
+        persist_dir (str): directory containing the persisted index.
+
+    Returns:
+        str: hex digest identifying the current state of the index.
+    """
+    digest = hashlib.sha256()
+    for directory, subdirectories, files in os.walk(persist_dir):
+        subdirectories.sort()
+        for name in sorted(files):
+            stat = os.stat(path := os.path.join(directory, name))
+            digest.update(f'{os.path.relpath(path, persist_dir)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+def load_storage_context(persist_dir: str, mmap: bool = True) -> StorageContext:
+    """helper function to load the storage context, preferring the binary vector store when persisted.
+
+    Args:
+        persist_dir (str): directory containing the persisted index.
+        mmap (bool, optional): memory-map the binary vector store. Defaults to True.
+
+    Returns:
+        StorageContext: storage context with docstore, index store and vector store loaded.
+    """
+    if MMapVectorStore.exists(persist_dir):
+        return StorageContext.from_defaults(
+            persist_dir=persist_dir,
+            vector_store=MMapVectorStore.from_persist_dir(persist_dir, mmap=mmap),
+        )
+
+    logger.warning(f'no binary vector store found @ {persist_dir}, falling back to json vector store')
+    return StorageContext.from_defaults(persist_dir=persist_dir)
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+import typing as t
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .timer import Timer
+
+# upper bounds in seconds, from sub-millisecond lookups up to multi-minute ingest stages.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+# id of the innermost open span of the current thread or asyncio task, parent of the next span opened in it.
+_current_span: ContextVar[int | None] = ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+
+
+def _labels(labels: dict[str, t.Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    pairs = [f'{key}="{value}"' for key, value in labels] + ([extra] if extra else [])
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Histogram of observations over fixed buckets, made cumulative when exported like Prometheus does."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot counts observations above the largest bucket.
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(upper bound, number of observations below it) pairs, `+Inf` last."""
+        bounds = [repr(bucket) for bucket in self.buckets] + ['+Inf']
+        return list(zip(bounds, itertools.accumulate(self.counts)))
+
+
+class Telemetry:
+    """Registry of spans, histograms and counters of a process.
+    Spans time a block with `Timer`, nest within the current thread or asyncio task, and are aggregated into
+    the `span_seconds` histogram. Metrics are rendered in the Prometheus text format, and when
+    `TELEMETRY_TRACE_PATH` is set every span is appended to that file as a json line, along with a
+    snapshot of all the metrics at exit. Recording takes a lock and a dict update, cheap enough to
+    leave on in production, `TELEMETRY_ENABLED=0` turns it off altogether.
+    """
+
+    def __init__(self, namespace: str = 'hth', trace_path: str | None = None, enabled: bool | None = None) -> None:
+        """constructor to initialize an empty registry.
+
+        Args:
+            namespace (str, optional): prefix of the exported metric names. Defaults to 'hth'.
+            trace_path (str | None, optional): json lines file to append spans to. Defaults to None,
+            `TELEMETRY_TRACE_PATH` read when the first span ends.
+            enabled (bool | None, optional): record anything at all. Defaults to None, `TELEMETRY_ENABLED`.
+        """
+        self.namespace = namespace
+        self._trace_path = trace_path
+        self._enabled = enabled
+        self._trace_file: t.TextIO | None = None
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+        atexit.register(self.close)
+
+    @property
+    def enabled(self) -> bool:
+        # resolved lazily, the environment is loaded from `.env` after this module is imported.
+        if self._enabled is None:
+            self._enabled = os.getenv('TELEMETRY_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        return self._enabled
+
+    @contextmanager
+    def span(self, name: str, **labels: t.Any) -> t.Iterator[Timer]:
+        """context to time a block as a span, nested in the enclosing one.
+
+        Args:
+            name (str): name of the span, e.g. `agent.retrieve`.
+            **labels: low cardinality labels of the span histogram, e.g. the evaluated metric.
+
+        Yields:
+            Timer: timer of the span, its `exec_time` is set once the block exits.
+        """
+        if not self.enabled:
+            with Timer() as timer:
+                yield timer
+            return
+
+        span_id = next(_span_ids)
+        token = _current_span.set(span_id)
+        error = False
+        try:
+            with Timer() as timer:
+                yield timer
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current_span.reset(token)
+            self._record_span(name, timer.exec_time, labels, span_id, _current_span.get(), error)
+
+    def observe(self, name: str, seconds: float, **labels: t.Any) -> None:
+        """method to record a span measured outside of `span`, e.g. the time to first token of a stream.
+
+        Args:
+            name (str): name of the span.
+            seconds (float): duration of the span.
+            **labels: labels of the span histogram.
+        """
+        if self.enabled:
+            self._record_span(name, seconds, labels, next(_span_ids), _current_span.get(), False)
+
+    def count(self, name: str, value: float = 1, **labels: t.Any) -> None:
+        """method to increment a counter, e.g. `count('response_cache_lookups', result='hit')`.
+
+        Args:
+            name (str): name of the counter, exported with a `_total` suffix.
+            value (float, optional): increment. Defaults to 1.
+            **labels: labels of the counter.
+        """
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _record_span(
+        self, name: str, seconds: float, labels: dict[str, t.Any], span_id: int, parent_id: int | None, error: bool
+    ) -> None:
+        key = ('span_seconds', _labels({'span': name, **labels}))
+        with self._lock:
+            if (histogram := self._histograms.get(key)) is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+            if (trace_file := self._open_trace()) is not None:
+                event = {'type': 'span', 'name': name, 'id': span_id, 'parent': parent_id, 'seconds': seconds}
+                event.update(start=time.time() - seconds, error=error, pid=os.getpid(), **labels)
+                trace_file.write(json.dumps(event) + '\n')
+
+    def _open_trace(self) -> t.TextIO | None:
+        """file to append the spans to, opened on first use. Called with the lock held."""
+        if self._trace_file is None:
+            self._trace_path = self._trace_path or os.getenv('TELEMETRY_TRACE_PATH') or ''
+            if self._trace_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self._trace_path)), exist_ok=True)
+                self._trace_file = open(self._trace_path, 'a', buffering=1 << 16)  # flushed by blocks and at exit.
+        return self._trace_file
+
+    def snapshot(self) -> dict[str, t.Any]:
+        """method to copy all the metrics into plain, json serializable, dicts.
+
+        Returns:
+            dict[str, t.Any]: counters and histograms (count, sum and cumulative buckets) with their labels.
+        """
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'buckets': dict(histogram.cumulative()),
+                    }
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+            }
+
+    def render_prometheus(self, snapshot: dict[str, t.Any] | None = None) -> str:
+        """method to render all the metrics in the Prometheus text exposition format.
+
+        Args:
+            snapshot (dict[str, t.Any] | None, optional): metrics to render, e.g. merged from several processes
+            with `merge_snapshots`. Defaults to None, the metrics of this registry.
+
+        Returns:
+            str: `# TYPE` header followed by the samples of every metric.
+        """
+        lines = []
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+        for name in dict.fromkeys(counter['name'] for counter in snapshot['counters']):
+            lines.append(f'# TYPE {self.namespace}_{name}_total counter')
+            lines.extend(
+                f'{self.namespace}_{name}_total{_format_labels(_labels(counter["labels"]))} {counter["value"]}'
+                for counter in snapshot['counters']
+                if counter['name'] == name
+            )
+
+        for name in dict.fromkeys(histogram['name'] for histogram in snapshot['histograms']):
+            metric = f'{self.namespace}_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            for histogram in snapshot['histograms']:
+                if histogram['name'] != name:
+                    continue
+                labels = _labels(histogram['labels'])
+                lines.extend(
+                    f'{metric}_bucket{_format_labels(labels, "le=" + json.dumps(bound))} {count}'
+                    for bound, count in histogram['buckets'].items()
+                )
+                lines.append(f'{metric}_sum{_format_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def flush(self) -> None:
+        """method to append a snapshot of all the metrics to the trace file, and flush it to disk."""
+        with self._lock:
+            # e.g. idle ingest worker processes, nothing worth a line.
+            if not self._counters and not self._histograms:
+                return
+            trace_file = self._open_trace()
+        if trace_file is None:
+            return
+
+        line = json.dumps({'type': 'metrics', 'time': time.time(), 'pid': os.getpid(), **self.snapshot()})
+        with self._lock:
+            trace_file.write(line + '\n')
+            trace_file.flush()
+
+    def close(self) -> None:
+        """method to flush and close the trace file, registered to run at exit."""
+        self.flush()
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+    def reset(self) -> None:
+        """method to drop all the recorded metrics, e.g. between two benchmark runs."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def after_fork(self) -> None:
+        """method to start afresh in a forked child process, call `flush` in the parent before forking.
+        Metrics recorded by the parent are dropped, so they are not reported once per child, and the trace file
+        is opened again on the next span instead of writing through the buffer inherited from the parent.
+        """
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self.reset()
+
+
+def merge_snapshots(snapshots: t.Iterable[dict[str, t.Any]]) -> dict[str, t.Any]:
+    """function to add up the metrics of several processes, e.g. the workers of a prefork server.
+
+    Args:
+        snapshots (t.Iterable[dict[str, t.Any]]): snapshots of every process, see `Telemetry.snapshot`.
+
+    Returns:
+        dict[str, t.Any]: a single snapshot, counters and histograms with the same name and labels are summed.
+    """
+    counters: dict[tuple[str, Labels], dict[str, t.Any]] = {}
+    histograms: dict[tuple[str, Labels], dict[str, t.Any]] = {}
+    for snapshot in snapshots:
+        for counter in snapshot['counters']:
+            key = (counter['name'], _labels(counter['labels']))
+            if (merged := counters.get(key)) is None:
+                counters[key] = dict(counter)
+            else:
+                merged['value'] += counter['value']
+
+        for histogram in snapshot['histograms']:
+            key = (histogram['name'], _labels(histogram['labels']))
+            if (merged := histograms.get(key)) is None:
+                histograms[key] = {**histogram, 'buckets': dict(histogram['buckets'])}
+                continue
+            merged['count'] += histogram['count']
+            merged['sum'] += histogram['sum']
+            for bound, count in histogram['buckets'].items():
+                merged['buckets'][bound] = merged['buckets'].get(bound, 0) + count
+
+    return {'counters': list(counters.values()), 'histograms': list(histograms.values())}
+
+
+# registry of the process, shared by the agent, the ingest pipeline, the evaluator and the http server.
+telemetry = Telemetry()
+span = telemetry.span
+observe = telemetry.observe
+count = telemetry.count
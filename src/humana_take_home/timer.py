@@ -19,3 +19,7 @@ class Timer:
     def __exit__(self, *_: t.Any) -> None:
         self.end = time.perf_counter()
         self.exec_time = self.end - self.start
+
+    def throughput(self, count: int) -> float:
+        """number of items processed per second within the timed block."""
+        return count / self.exec_time if self.exec_time > 0 else float('inf')
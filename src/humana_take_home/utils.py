@@ -1,49 +1,214 @@
+from __future__ import annotations
+
 import os
 import typing as t
+from functools import lru_cache
 
 from dotenv import load_dotenv
-from llama_index.core.node_parser import SemanticSplitterNodeParser
-from llama_index.core.extractors import KeywordExtractor
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.ollama import Ollama
 
-load_dotenv(override=True)
+# model stacks are imported on first use, importing torch alone takes seconds.
+if t.TYPE_CHECKING:
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.llms import LLM
+    from llama_index.core.node_parser import SemanticSplitterNodeParser
+
+# MiniLM cross-encoder (~22M parameters), small enough to score a few dozen chunks per query on cpu.
+DEFAULT_RERANKER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+
+@lru_cache(maxsize=None)
+def load_environment() -> None:
+    """load the `.env` file into the environment, once per process. Called by the factories below, entry points
+    reading the environment before any model is created call it first.
+    """
+    load_dotenv(override=True)
+
+
+def use_stand_in_models() -> bool:
+    """whether `USE_STAND_IN_MODELS` asks for the deterministic local models, e.g. to benchmark without Ollama."""
+    load_environment()
+    return os.getenv('USE_STAND_IN_MODELS', '').lower() in ('1', 'true', 'yes')
 
 
-def get_default_ollama_llm(**options: dict[str, t.Any]) -> Ollama:
+@lru_cache(maxsize=None)
+def get_default_ollama_llm(**options: dict[str, t.Any]) -> LLM:
     """helper function to get opensource llm for all the tasks
+    The client is created once per process and set of options, and shared by all its callers.
+    If `USE_STAND_IN_MODELS` is set, a deterministic stand-in llm is returned instead, its simulated speed is
+    set with `STAND_IN_PROMPT_LATENCY` and `STAND_IN_TOKEN_LATENCY` (seconds per prompt word / output token).
 
     Returns:
-        Ollama: Specialized subclass of LLM to perform all the llm related ops.
+        LLM: Ollama, specialized subclass of LLM to perform all the llm related ops.
     """
+    if use_stand_in_models():
+        from humana_take_home.benchmarks.stand_ins import StandInLLM
+
+        return StandInLLM(
+            prompt_latency=float(os.getenv('STAND_IN_PROMPT_LATENCY', 0.0)),
+            token_latency=float(os.getenv('STAND_IN_TOKEN_LATENCY', 0.0)),
+        )
+
+    from llama_index.llms.ollama import Ollama
+
     return Ollama(
-        model=os.getenv("OLLAMA_MODEL"),
+        model=os.getenv('OLLAMA_MODEL'),
         request_timeout=120.0,  # longer timeout to give local system to run inference fully.
         **options,
     )
 
 
-def get_default_embedding_models() -> HuggingFaceEmbedding:
+def _batch_queries(
+    embed_model: BaseEmbedding, embed_queries: t.Callable[[list[str]], list[list[float]]]
+) -> BaseEmbedding:
+    """wrap the model with the query micro-batcher, unless `EMBEDDINGS_MICRO_BATCH_SIZE` is 1 or less."""
+    max_batch_size = int(os.getenv('EMBEDDINGS_MICRO_BATCH_SIZE', 32))
+    if max_batch_size <= 1:
+        return embed_model
+
+    from humana_take_home.embeddings.batching import MicroBatchingEmbedding
+
+    return MicroBatchingEmbedding(
+        embed_model=embed_model,
+        embed_queries=embed_queries,
+        max_batch_size=max_batch_size,
+        max_wait_ms=float(os.getenv('EMBEDDINGS_MAX_WAIT_MS', 2.0)),
+        workers=int(os.getenv('EMBEDDINGS_WORKERS', 1)),
+    )
+
+
+def _load_huggingface_embedding() -> BaseEmbedding:
+    """load the `EMBEDDINGS_MODEL` sentence transformer with the runtime set by `EMBEDDINGS_BACKEND` (torch, onnx
+    or openvino), `EMBEDDINGS_MODEL_FILE` (e.g. a quantized onnx export), `EMBEDDINGS_QUANTIZE` (int8 dynamic
+    quantization of the torch linear layers, on cpu) and `EMBEDDINGS_NUM_THREADS` (torch intra-op threads).
+    """
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    backend = os.getenv('EMBEDDINGS_BACKEND', 'torch')
+    quantize = os.getenv('EMBEDDINGS_QUANTIZE', '').lower() in ('1', 'true', 'yes', 'int8')
+    model_kwargs: dict[str, t.Any] = {}
+    if backend != 'torch':
+        model_kwargs['backend'] = backend
+    if model_file := os.getenv('EMBEDDINGS_MODEL_FILE'):
+        model_kwargs['model_kwargs'] = {'file_name': model_file}
+    if quantize:
+        model_kwargs['device'] = 'cpu'  # quantized kernels only run on cpu.
+
+    embed_model = HuggingFaceEmbedding(model_name=os.getenv('EMBEDDINGS_MODEL'), **model_kwargs)
+    if backend == 'torch':
+        import torch
+
+        if num_threads := int(os.getenv('EMBEDDINGS_NUM_THREADS', 0)):
+            torch.set_num_threads(num_threads)
+        if quantize:
+            torch.ao.quantization.quantize_dynamic(
+                embed_model._model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
+    # another runtime gives slightly different embeddings, they are cached apart.
+    variant = '-'.join(filter(None, [backend if backend != 'torch' else '', model_file, 'int8' if quantize else '']))
+    if variant:
+        embed_model.model_name = f'{embed_model.model_name}:{variant}'
+    return embed_model
+
+
+@lru_cache(maxsize=None)
+def get_default_embedding_models() -> BaseEmbedding:
     """util function to get default embedding model defined in config
+    The model is loaded once per process, and shared by the splitter, the index and the agents.
+    Concurrent query embeddings are gathered into micro-batches of up to `EMBEDDINGS_MICRO_BATCH_SIZE` queries,
+    waiting at most `EMBEDDINGS_MAX_WAIT_MS` for each other, run by `EMBEDDINGS_WORKERS` threads.
+    If `EMBEDDINGS_CACHE_PATH` is set, the model is wrapped with an on-disk embedding cache, checked before
+    batching.
+    If `USE_STAND_IN_MODELS` is set, a deterministic hashing embedder is returned instead, never cached, its
+    simulated speed is set with `STAND_IN_EMBED_LATENCY` (seconds per forward pass).
 
     Returns:
-        HuggingFaceEmbedding: Embedding model instance
+        BaseEmbedding: Embedding model instance
     """
 
-    return HuggingFaceEmbedding(model_name=os.getenv("EMBEDDINGS_MODEL"))
+    if use_stand_in_models():
+        from humana_take_home.benchmarks.stand_ins import StandInEmbedding
 
+        stand_in = StandInEmbedding(forward_latency=float(os.getenv('STAND_IN_EMBED_LATENCY', 0.0)))
+        return _batch_queries(stand_in, stand_in._embed_batch)
 
-def get_default_transformations() -> list[t.Any]:
-    """Define set of transformation to applied on data before data ingestion."""
+    from humana_take_home.caches.embedding import CachedEmbedding
+    from humana_take_home.caches.sqlite import SQLiteCache
+
+    huggingface_model = _load_huggingface_embedding()
+    embed_model = _batch_queries(
+        huggingface_model, lambda queries: huggingface_model._embed(queries, prompt_name='query')
+    )
+    cache_path = os.getenv('EMBEDDINGS_CACHE_PATH')
+    if not cache_path:
+        return embed_model
+
+    cache = SQLiteCache(
+        cache_path,
+        table='embeddings',
+        max_entries=int(os.getenv('EMBEDDINGS_CACHE_SIZE', 1_000_000)),  # ~1.5GB for 384-dim float32 embeddings.
+    )
+    return CachedEmbedding(embed_model=embed_model, cache=cache)
+
+
+@lru_cache(maxsize=None)
+def get_default_cross_encoder() -> t.Any:
+    """util function to get the cross-encoder re-ranking the retrieved nodes, defined by `RERANKER_MODEL`.
+    The model is small enough to run on cpu, it is loaded once per process and shared by all the agents.
+    If `USE_STAND_IN_MODELS` is set, a deterministic word overlap scorer is returned instead.
+
+    Returns:
+        t.Any: `sentence_transformers.CrossEncoder`, scoring (query, text) pairs with `predict`.
+    """
+    if use_stand_in_models():
+        from humana_take_home.benchmarks.stand_ins import StandInCrossEncoder
+
+        return StandInCrossEncoder(pair_latency=float(os.getenv('STAND_IN_RERANK_LATENCY', 0.0)))
+
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(os.getenv('RERANKER_MODEL') or DEFAULT_RERANKER_MODEL, max_length=512, device='cpu')
+
+
+def get_default_text_splitter(pool_embeddings: bool = False) -> SemanticSplitterNodeParser:
+    """Define the text splitter used to chunk documents into nodes.
+    With `pool_embeddings`, the nodes are also embedded by pooling the sentence embeddings computed to split them,
+    so the vector index does not embed them again.
+    """
+    from llama_index.core.node_parser import SemanticSplitterNodeParser
+
+    splitter_cls = SemanticSplitterNodeParser
+    if pool_embeddings:
+        from humana_take_home.splitters.semantic import PooledSemanticSplitterNodeParser
+
+        splitter_cls = PooledSemanticSplitterNodeParser
+
+    return splitter_cls(buffer_size=1, embed_model=get_default_embedding_models(), breakpoint_percentile_threshold=95)
+
+
+def get_default_extractors() -> list[t.Any]:
+    """Define metadata extractors applied on the nodes after splitting.
+    Keywords are extracted `KEYWORDS_BATCH_SIZE` nodes per llm call with up to `KEYWORDS_CONCURRENCY`
+    concurrent calls, and cached on disk when `KEYWORDS_CACHE_PATH` is set.
+    """
+    from humana_take_home.caches.sqlite import SQLiteCache
+    from humana_take_home.extractors.keywords import BatchKeywordExtractor
 
     # define which llm to use for metadata extraction
     llm = get_default_ollama_llm(temperature=0.0)
-    embed_model = get_default_embedding_models()
-
-    # define transformations
-    text_splitter = SemanticSplitterNodeParser(
-        buffer_size=1, embed_model=embed_model, breakpoint_percentile_threshold=95
+    cache_path = os.getenv('KEYWORDS_CACHE_PATH')  # the environment was loaded by the llm factory.
+    keyword_extractor = BatchKeywordExtractor(
+        llm=llm,
+        batch_size=int(os.getenv('KEYWORDS_BATCH_SIZE', 8)),
+        num_workers=int(os.getenv('KEYWORDS_CONCURRENCY', 4)),
+        cache=SQLiteCache(cache_path, table='keywords', max_entries=None) if cache_path else None,
     )
-    keyword_extractor = KeywordExtractor(llm=llm)
 
-    return [text_splitter, keyword_extractor]
+    return [keyword_extractor]
+
+
+def get_default_transformations() -> list[t.Any]:
+    """Define set of transformation to applied on data before data ingestion."""
+
+    # define transformations
+    return [get_default_text_splitter(), *get_default_extractors()]
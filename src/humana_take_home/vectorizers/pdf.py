@@ -1,14 +1,65 @@
+import json
+import multiprocessing
 import os
 import typing as t
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from logging import getLogger
 
-from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex
+from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.simple import DEFAULT_PERSIST_FNAME, DEFAULT_VECTOR_STORE, NAMESPACE_SEP
 
-from ..timer import Timer
-from ..utils import get_default_embedding_models, get_default_ollama_llm, get_default_transformations
+from ..stores.docstore import CompactDocumentStore, JournalDocumentStore, JournalKVStore
+from ..stores.io import atomic_write
+from ..stores.ivf import IVFIndex
+from ..stores.shards import is_sharded, list_shards, plan_shards, shard_path
+from ..stores.sparse import BM25Index
+from ..stores.vector import MMapVectorStore, load_storage_context
+from ..telemetry import count, span
+from ..utils import (
+    get_default_embedding_models,
+    get_default_extractors,
+    get_default_ollama_llm,
+    get_default_text_splitter,
+)
 
 logger = getLogger(__name__)  # define logger
 
+REQUIRED_EXTS = ['.pdf', '.docx']
+CHECKPOINT_FILE = 'ingest_checkpoint.json'  # files indexed so far by an unfinished streaming run.
+JOURNAL_FILE = 'ingest_docstore.jsonl'  # docstore records appended by an unfinished streaming run.
+
+# text splitter of an ingest worker process, loaded once per process by `_init_ingest_worker`.
+_worker_text_splitter: t.Any = None
+
+
+def _normalize_path(path: str) -> str:
+    """helper function to compare file paths stored in the docstore with the ones on disk."""
+    return os.path.normpath(os.path.abspath(path))
+
+
+def _init_ingest_worker(pool_embeddings: bool = False) -> None:
+    """initializer of the ingest worker processes, loads the splitter (and its embedding model) once."""
+    global _worker_text_splitter
+    _worker_text_splitter = get_default_text_splitter(pool_embeddings)
+
+
+def _ingest_file(file_path: str) -> tuple[str, list[tuple[str, str]], list[BaseNode]]:
+    """function run by the ingest workers to parse a single file and split it into nodes.
+
+    Args:
+        file_path (str): path of the file to ingest.
+
+    Returns:
+        tuple[str, list[tuple[str, str]], list[BaseNode]]: the file path, (doc id, doc hash) of the parsed
+        documents, and their nodes.
+    """
+    documents = SimpleDirectoryReader(input_files=[file_path], required_exts=REQUIRED_EXTS).load_data()
+    nodes = run_transformations(documents, [_worker_text_splitter])
+    return file_path, [(document.get_doc_id(), document.hash) for document in documents], nodes
+
 
 class PDFDataLoader:
     """
@@ -16,17 +67,44 @@ class PDFDataLoader:
     The class uses the following methods:
       - _load_data: method to load data from the given directory or files.
       - build_vector_index: method to build vector index from the loaded data.
-      - __persist_vector_idx: method to persist the vector index to the local storage.
+      - build_sharded_index: method to build the vector index as several shards, e.g. one per collection.
+      - _build_vector_index_streaming: method to build the vector index file by file, with checkpoints.
+      - __persist_vector_idx: method to persist the vector index, and its ivf and bm25 indexes, to the local storage.
       - merge_new_documents: method to merge new documents into the existing vector index.
     """
 
-    def __init__(self, vector_index_path: str | None = None) -> None:
+    def __init__(
+        self,
+        vector_index_path: str | None = None,
+        vector_dtype: str = 'float32',
+        quantization: str | None = None,
+        build_ann: bool = False,
+        ann_lists: int | None = None,
+        build_bm25: bool = False,
+        workers: int = 1,
+        ingest_batch_size: int = 512,
+        stream: bool = False,
+        checkpoint_every: int = 10,
+        pool_embeddings: bool = False,
+    ) -> None:
         # define llm, embedding model and storage context
         self.llm = get_default_ollama_llm(temperature=0.0)  # zero temperature to minimize llm's creative thinking.
         self.embed_model = get_default_embedding_models()
+        self.vector_dtype = vector_dtype  # dtype of the persisted embedding matrix, float16 halves the index size.
+        self.quantization = quantization  # int8 or binary codes searched first, the matrix only re-scores the best.
+        self.build_ann = build_ann  # build an ivf index next to the vector store for large corpora.
+        self.ann_lists = ann_lists  # number of ivf lists, defaults to ~4 * sqrt(num nodes).
+        self.build_bm25 = build_bm25  # build a bm25 index next to the vector store for hybrid retrieval.
+        self.workers = workers  # number of processes parsing and splitting files, 1 to ingest serially.
+        self.ingest_batch_size = ingest_batch_size  # nodes extracted and embedded together in streaming ingest.
+        self.stream = stream  # ingest file by file with checkpoints, implied by `workers > 1`.
+        self.checkpoint_every = checkpoint_every  # batches between two checkpoints of a streaming ingest.
+        self.pool_embeddings = pool_embeddings  # nodes embedded by the splitter, instead of a second model pass.
+        self.vector_index_path = vector_index_path
 
-        if vector_index_path is not None and os.path.exists(vector_index_path):
-            self.storage_ctx = StorageContext.from_defaults(
+        # a sharded index has no storage of its own, every shard is loaded as an index of its own.
+        if vector_index_path is not None and os.path.exists(vector_index_path) and not is_sharded(vector_index_path):
+            self.storage_ctx = load_storage_context(
                 persist_dir=vector_index_path
             )  # useful if we want to merge new documents into existing vector index.
 
@@ -48,14 +126,15 @@ class PDFDataLoader:
         if input_dir is None and input_files is None:
             raise ValueError("both `input_dir` or `input_files` can't be none")
 
-        with Timer() as timer:
+        with span('ingest.load') as timer:
             documents = SimpleDirectoryReader(
                 input_dir=input_dir,
                 input_files=input_files,
-                required_exts=['.pdf', '.docx'],
+                required_exts=REQUIRED_EXTS,
             ).load_data(show_progress=True)
 
-        logger.info(f'Extracted {len(documents)=} in {timer.exec_time/60} mins')
+        count('ingested_documents', len(documents))
+        logger.info(f'Extracted {len(documents)=} in {timer.exec_time / 60} mins')
 
         return documents
 
@@ -81,40 +160,484 @@ class PDFDataLoader:
         if isinstance(input_files, str):
             input_files = [input_files]
 
-        # convert text files to document objects.
-        documents = self._load_data(input_dir=input_dir, input_files=input_files)
-
-        with Timer() as index_timer:
-            vector_index = VectorStoreIndex.from_documents(
-                documents=documents,
-                show_progress=True,
-                embed_model=self.embed_model,
-                transformations=get_default_transformations(),
+        if self.stream or self.workers > 1:
+            vector_index = self._build_vector_index_streaming(
+                input_dir=input_dir, input_files=input_files, persist_index_path=persist_index_path
             )
+        else:
+            # convert text files to document objects.
+            documents = self._load_data(input_dir=input_dir, input_files=input_files)
+
+            with span('ingest.build') as index_timer:
+                nodes = self._run_stage('split', documents, [get_default_text_splitter(self.pool_embeddings)])
+                nodes = self._run_stage('keyword extraction', nodes, get_default_extractors())
+                vector_store = MMapVectorStore(dtype=self.vector_dtype, quantization=self.quantization)
+                vector_index = VectorStoreIndex(
+                    nodes=[],
+                    embed_model=self.embed_model,
+                    storage_context=StorageContext.from_defaults(vector_store=vector_store),
+                )
+                self._insert_nodes(vector_index, nodes)
+                for document in documents:
+                    vector_index.docstore.set_document_hash(document.get_doc_id(), document.hash)
 
-        logger.info(f'Indexed all the documents in {index_timer.exec_time/60} mins')
+            logger.info(f'Indexed all the documents in {index_timer.exec_time / 60} mins')
 
         if persist_index_path is None:
             return vector_index
 
         self.__persist_vector_idx(vector_index, persist_index_path)  # flush the vector index to the local storage.
 
+        # the index is complete, nothing left to resume.
+        if isinstance(vector_index.docstore, JournalDocumentStore):
+            vector_index.docstore.journal.close()
+        for file_name in (CHECKPOINT_FILE, JOURNAL_FILE):
+            if os.path.exists(file_path := os.path.join(persist_index_path, file_name)):
+                os.remove(file_path)
+
+    def build_sharded_index(
+        self,
+        input_dir: str | None = None,
+        input_files: str | list[str] | None = None,
+        persist_index_path: str | None = None,
+        shard_by: str = 'collection',
+        shard_size_mb: float = 512.0,
+    ) -> dict[str, list[str]]:
+        """method to build the vector index as several shards, persisted as subdirectories of `persist_index_path`.
+        Every shard is a complete index (with its own ivf and bm25 indexes), built like `build_vector_index`,
+        so a shard can be rebuilt or merged on its own, e.g. `vectorize_documents.py --vector_path <path>/<shard>`,
+        without touching the other ones. Shards sharing a name with an existing one are rebuilt, the other
+        existing shards are kept. See `plan_shards` for the `collection` and `size` strategies.
+
+        Args:
+            input_dir (str | None, optional): directory of the collections, searched recursively. Defaults to None.
+            input_files (str | list[str] | None, optional): files to shard. Defaults to None.
+            persist_index_path (str | None, optional): root directory of the shards. Defaults to None,
+            `vector_index_path`.
+            shard_by (str, optional): one of `collection` or `size`. Defaults to 'collection'.
+            shard_size_mb (float, optional): max size of the files of a shard when sharding by size. Defaults to 512.0.
+
+        Raises:
+            ValueError: if no input or no persist path is provided, or if `persist_index_path` holds a monolithic index.
+
+        Returns:
+            dict[str, list[str]]: files indexed per shard name.
+        """
+        if input_dir is None and input_files is None:
+            raise ValueError("both `input_dir` or `input_files` can't be none")
+        persist_index_path = persist_index_path or self.vector_index_path
+        if persist_index_path is None:
+            raise ValueError('a `persist_index_path` is required to build a sharded index')
+        if os.path.isdir(persist_index_path) and os.listdir(persist_index_path) and not list_shards(persist_index_path):
+            raise ValueError(f'{persist_index_path} is not empty and holds no shards, pick a new directory')
+
+        if isinstance(input_files, str):
+            input_files = [input_files]
+        files = [
+            str(file)
+            for file in SimpleDirectoryReader(
+                input_dir=input_dir, input_files=input_files, required_exts=REQUIRED_EXTS, recursive=True
+            ).input_files
+        ]
+        shards = plan_shards(
+            files,
+            shard_by=shard_by,
+            input_dir=input_dir,
+            shard_size_mb=shard_size_mb,
+            existing_shards=list_shards(persist_index_path),
+        )
+
+        for num_shard, (name, shard_files) in enumerate(shards.items(), start=1):
+            logger.info(f'Building shard {name} ({num_shard}/{len(shards)}) from {len(shard_files)} files')
+            with span('ingest.shard', shard_by=shard_by):
+                self.build_vector_index(
+                    input_files=shard_files, persist_index_path=shard_path(persist_index_path, name)
+                )
+
+        return shards
+
+    def _run_stage(self, stage: str, nodes: t.Sequence[BaseNode], transformations: list[t.Any]) -> list[BaseNode]:
+        """method to run an ingestion stage, logging its throughput and tracing it as an `ingest.<stage>` span.
+
+        Args:
+            stage (str): name of the stage to log.
+            nodes (t.Sequence[BaseNode]): documents or nodes to transform.
+            transformations (list[t.Any]): transformations of the stage.
+
+        Returns:
+            list[BaseNode]: transformed nodes.
+        """
+        stage_name = stage.replace(' ', '_')
+        with span(f'ingest.{stage_name}') as stage_timer:
+            nodes = run_transformations(nodes, transformations, show_progress=True)
+        count('ingested_nodes', len(nodes), stage=stage_name)
+
+        logger.info(
+            f'Stage {stage}: {len(nodes)} nodes in {stage_timer.exec_time / 60} mins '
+            f'({stage_timer.throughput(len(nodes)):.2f} nodes/sec)'
+        )
+        return nodes
+
+    def _insert_nodes(self, vector_index: VectorStoreIndex, nodes: list[BaseNode]) -> None:
+        """method to embed and insert nodes into the vector index, logging the embedding throughput."""
+        with span('ingest.embed') as embed_timer:
+            vector_index.insert_nodes(nodes, show_progress=True)
+        count('ingested_nodes', len(nodes), stage='embed')
+
+        logger.info(
+            f'Stage embedding: {len(nodes)} nodes in {embed_timer.exec_time / 60} mins '
+            f'({embed_timer.throughput(len(nodes)):.2f} nodes/sec)'
+        )
+
+    def _iter_ingested_files(self, files: list[str]) -> t.Iterator[tuple[str, list[tuple[str, str]], list[BaseNode]]]:
+        """method to parse and split files one at a time, in a process pool when `workers > 1`.
+        Results are yielded as files complete, with at most `2 * workers` files in flight, so parsed files
+        never pile up faster than they are indexed.
+
+        Args:
+            files (list[str]): paths of the files to ingest.
+
+        Yields:
+            tuple[str, list[tuple[str, str]], list[BaseNode]]: the file path, (doc id, doc hash) of the parsed
+            documents, and their nodes.
+        """
+        if self.workers <= 1:
+            _init_ingest_worker(self.pool_embeddings)  # the main process acts as the only worker.
+            for file_path in files:
+                yield _ingest_file(file_path)
+            return
+
+        files = iter(files)
+        # spawn instead of fork, forking a process with torch or an sqlite connection loaded is unsafe.
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_ingest_worker,
+            initargs=(self.pool_embeddings,),
+        ) as executor:
+            pending: set[Future] = set()
+            while True:
+                for file_path in files:
+                    pending.add(executor.submit(_ingest_file, file_path))
+                    if len(pending) >= 2 * self.workers:
+                        break
+
+                if not pending:
+                    return
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def _open_streaming_index(self, persist_index_path: str | None) -> tuple[VectorStoreIndex, set[str]]:
+        """method to create the index of a streaming ingest, or reload it from the checkpoint of an interrupted run.
+        With a `persist_index_path`, embeddings are written straight into the vector store file and nodes are
+        appended to a docstore journal, so neither the vectors nor the node text are held in memory.
+
+        Args:
+            persist_index_path (str | None): path the index is persisted and checkpointed to.
+
+        Returns:
+            tuple[VectorStoreIndex, set[str]]: vector index, and normalized paths of the files already indexed.
+        """
+        if persist_index_path is None:
+            vector_index = VectorStoreIndex(
+                nodes=[],
+                embed_model=self.embed_model,
+                storage_context=StorageContext.from_defaults(
+                    vector_store=MMapVectorStore(dtype=self.vector_dtype, quantization=self.quantization)
+                ),
+            )
+            return vector_index, set()
+
+        done_files, journal_size = set(), None
+        checkpoint_path = os.path.join(persist_index_path, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if 'journal' in checkpoint:
+                done_files, journal_size = set(checkpoint['files']), checkpoint['journal']
+            else:
+                logger.warning(f'{checkpoint_path} has no docstore journal, ingesting all the files again')
+
+        vector_store = MMapVectorStore.open_appendable(
+            persist_index_path, dtype=self.vector_dtype, resume=journal_size is not None, quantization=self.quantization
+        )
+        docstore = JournalDocumentStore(JournalKVStore(os.path.join(persist_index_path, JOURNAL_FILE), journal_size))
+        vector_index = VectorStoreIndex(
+            nodes=[],
+            embed_model=self.embed_model,
+            storage_context=StorageContext.from_defaults(vector_store=vector_store, docstore=docstore),
+        )
+        if journal_size is None:
+            return vector_index, done_files
+
+        # vectors flushed after the last checkpoint have no docstore record, their files are ingested again.
+        stale_node_ids = [node_id for node_id in vector_store.node_ids if not docstore.document_exists(node_id)]
+        if stale_node_ids:
+            vector_store.delete_nodes(stale_node_ids)
+        vector_index.index_struct.nodes_dict.update({node_id: node_id for node_id in vector_store.node_ids})
+        vector_index.storage_context.index_store.add_index_struct(vector_index.index_struct)
+
+        logger.info(f'Resuming ingestion from {checkpoint_path}, {len(done_files)} files already indexed')
+        return vector_index, done_files
+
+    def _build_vector_index_streaming(
+        self,
+        input_dir: str | None,
+        input_files: list[str] | None,
+        persist_index_path: str | None = None,
+    ) -> VectorStoreIndex:
+        """method to build the vector index file by file, the corpus is never loaded at once.
+        Files are parsed and split (by `workers` processes), nodes are keyword extracted, embedded and
+        appended to the vector store in batches of `ingest_batch_size`. Every `checkpoint_every` batches the
+        rows and docstore records added since the previous checkpoint are flushed along with the list of indexed
+        files, an interrupted run resumes from there.
+
+        Args:
+            input_dir (str | None): input_dir to load all the files from a directory.
+            input_files (list[str] | None): list of files to load.
+            persist_index_path (str | None, optional): Path to persist and checkpoint the index. Defaults to None.
+
+        Returns:
+            VectorStoreIndex: vector index built from all the files.
+        """
+
+        if input_dir is None and input_files is None:
+            raise ValueError("both `input_dir` or `input_files` can't be none")
+
+        vector_index, done_files = self._open_streaming_index(persist_index_path)
+        files = [
+            str(file)
+            for file in SimpleDirectoryReader(
+                input_dir=input_dir, input_files=input_files, required_exts=REQUIRED_EXTS
+            ).input_files
+            if _normalize_path(str(file)) not in done_files
+        ]
+        extractors = get_default_extractors()
+
+        def index_batch(nodes: list[BaseNode], document_hashes: list[tuple[str, str]], batch_files: list[str]) -> None:
+            self._insert_nodes(vector_index, self._run_stage('keyword extraction', nodes, extractors))
+            for doc_id, doc_hash in document_hashes:
+                vector_index.docstore.set_document_hash(doc_id, doc_hash)
+            count('ingested_documents', len(document_hashes))
+            done_files.update(_normalize_path(file_path) for file_path in batch_files)
+
+        num_nodes, num_batches = 0, 0
+        batch_nodes, batch_hashes, batch_files = [], [], []
+        with span('ingest.build') as index_timer:
+            for num_files, (file_path, document_hashes, nodes) in enumerate(self._iter_ingested_files(files), start=1):
+                batch_nodes.extend(nodes)
+                batch_hashes.extend(document_hashes)
+                batch_files.append(file_path)
+                if len(batch_nodes) < self.ingest_batch_size:
+                    continue
+
+                index_batch(batch_nodes, batch_hashes, batch_files)
+                num_nodes, num_batches = num_nodes + len(batch_nodes), num_batches + 1
+                batch_nodes, batch_hashes, batch_files = [], [], []
+                logger.info(f'Indexed {num_files}/{len(files)} files, {num_nodes} nodes')
+
+                if persist_index_path is not None and num_batches % self.checkpoint_every == 0:
+                    self.__checkpoint(vector_index, persist_index_path, done_files)
+
+            if batch_files:
+                index_batch(batch_nodes, batch_hashes, batch_files)
+                num_nodes += len(batch_nodes)
+            vector_index.vector_store.trim()  # drop the rows over-allocated by the last appends.
+
+        logger.info(
+            f'Indexed {len(files)} files into {num_nodes} nodes with {self.workers} workers '
+            f'in {index_timer.exec_time / 60} mins ({index_timer.throughput(num_nodes):.2f} nodes/sec)'
+        )
+
+        return vector_index
+
+    def __checkpoint(self, vector_index: VectorStoreIndex, persist_path: str, done_files: set[str]) -> None:
+        """method to flush the partial index, and the files it covers, so an interrupted ingest can resume.
+        Only the vector rows and docstore records added since the previous checkpoint are written.
+        """
+
+        with span('ingest.checkpoint') as checkpoint_timer:
+            journal_size = vector_index.docstore.journal.flush()
+            vector_index.vector_store.persist(
+                os.path.join(persist_path, f'{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}')
+            )
+            checkpoint = {'files': sorted(done_files), 'journal': journal_size}
+            atomic_write(os.path.join(persist_path, CHECKPOINT_FILE), json.dumps(checkpoint).encode())
+
+        logger.info(f'Checkpointed {len(done_files)} files @ {persist_path} in {checkpoint_timer.exec_time:.2f}s')
+
     def __persist_vector_idx(self, vector_index: VectorStoreIndex, persist_path: str) -> None:
         """method to persist the vector index to the local storage.
+        Embeddings are flushed as a binary matrix (see `MMapVectorStore`) instead of the default json store.
 
         Args:
             vector_index (VectorStoreIndex): Vector index to be persisted.
             persist_path (str): path to persist the vector index.
         """
 
-        with Timer() as persist_timer:
+        with span('ingest.persist') as persist_timer:
             vector_index.storage_context.persist(persist_dir=persist_path)
 
         logger.info(f'Flushed vector index @ {persist_path} in {persist_timer.exec_time / 60}mins ')
 
+        # the full docstore is kept for merges, the agents load the compact one.
+        with span('ingest.docstore') as docstore_timer:
+            nodes_dict = vector_index.index_struct.nodes_dict
+            num_nodes = CompactDocumentStore.persist_from(
+                vector_index.docstore,
+                [nodes_dict.get(node_id, node_id) for node_id in vector_index.vector_store.node_ids],
+                persist_path,
+            )
+
+        logger.info(f'Flushed compact docstore of {num_nodes} nodes @ {persist_path} in {docstore_timer.exec_time}s')
+
+        # existing ivf and bm25 indexes are rebuilt as well, stale ones would no longer match the vector store.
+        if (self.build_ann or IVFIndex.exists(persist_path)) and len(vector_index.vector_store.node_ids):
+            self.__persist_ann_idx(vector_index, persist_path)
+        if (self.build_bm25 or BM25Index.exists(persist_path)) and len(vector_index.vector_store.node_ids):
+            self.__persist_bm25_idx(vector_index, persist_path)
+
+    def __persist_ann_idx(self, vector_index: VectorStoreIndex, persist_path: str) -> None:
+        """method to build and persist the ivf index over the embeddings of the vector index.
+
+        Args:
+            vector_index (VectorStoreIndex): Vector index to build the ivf index for.
+            persist_path (str): path to persist the ivf index, same as the vector index.
+        """
+
+        with span('ingest.ann') as ann_timer:
+            ann_index = IVFIndex.build(vector_index.vector_store.matrix, n_lists=self.ann_lists)
+            ann_index.persist(persist_path)
+
+        logger.info(
+            f'Built ivf index with {ann_index.n_lists} lists @ {persist_path} in {ann_timer.exec_time / 60}mins'
+        )
+
+    def __persist_bm25_idx(self, vector_index: VectorStoreIndex, persist_path: str) -> None:
+        """method to build and persist the bm25 index over the text and keywords of the nodes in the docstore.
+
+        Args:
+            vector_index (VectorStoreIndex): Vector index to build the bm25 index for.
+            persist_path (str): path to persist the bm25 index, same as the vector index.
+        """
+
+        with span('ingest.bm25') as bm25_timer:
+            nodes_dict = vector_index.index_struct.nodes_dict
+            node_ids = [nodes_dict.get(node_id, node_id) for node_id in vector_index.vector_store.node_ids]
+            texts = [
+                # keywords extracted by the llm add synonyms and key terms the text may only imply.
+                f'{node.get_content(metadata_mode=MetadataMode.NONE)}\n{node.metadata.get("excerpt_keywords", "")}'
+                for node in vector_index.docstore.get_nodes(node_ids)
+            ]
+            bm25_index = BM25Index.build(texts, node_ids)
+            bm25_index.persist(persist_path)
+
+        logger.info(
+            f'Built bm25 index with {len(bm25_index.terms)} terms @ {persist_path} in {bm25_timer.exec_time / 60}mins'
+        )
+
     def merge_new_documents(
-        self, input_dir: str | None = None, input_files: str | list[str] | None = None
-    ) -> t.Any: ...
+        self,
+        input_dir: str | None = None,
+        input_files: str | list[str] | None = None,
+        persist_index_path: str | None = None,
+    ) -> VectorStoreIndex:
+        """method to incrementally merge documents into the existing vector index.
+        Files are matched with the indexed documents by `file_path`, and compared using the `doc_hash` of
+        their documents stored in the docstore:
+          - unchanged files are skipped, they are not split, embedded or keyword extracted again.
+          - new or changed files are processed, nodes of the previous version of a file are removed.
+          - indexed files within `input_dir` (or listed in `input_files`) which no longer exist are removed.
+
+        Args:
+            input_dir (str): input_dir to sync all the files from a directory. Defaults to None.
+            input_files (str | list[str]): either a single file to sync or list of files to sync. Defaults to None.
+            persist_index_path (str | None, optional): Path to flush the updated index, defaults to `vector_index_path`.
+
+        Raises:
+            ValueError: if no existing vector index was loaded or no input is provided.
+
+        Returns:
+            VectorStoreIndex: updated vector index.
+        """
+
+        if not hasattr(self, 'storage_ctx'):
+            raise ValueError('an existing `vector_index_path` is required to merge new documents')
+        if input_dir is None and input_files is None:
+            raise ValueError("both `input_dir` or `input_files` can't be none")
+
+        # encapsulate into list if single file
+        if isinstance(input_files, str):
+            input_files = [input_files]
+
+        if not isinstance(self.storage_ctx.vector_store, MMapVectorStore):
+            # index persisted with the default json vector store, it is persisted back as a binary one.
+            logger.info('Converting the json vector store into a binary one')
+            self.storage_ctx.add_vector_store(
+                MMapVectorStore.from_simple_vector_store(self.storage_ctx.vector_store, dtype=self.vector_dtype),
+                namespace=DEFAULT_VECTOR_STORE,
+            )
+
+        vector_index = load_index_from_storage(storage_context=self.storage_ctx, embed_model=self.embed_model)
+        docstore = vector_index.docstore
+
+        # group indexed documents by their source file, along with their content hashes.
+        indexed_files: dict[str, dict[str, str | None]] = defaultdict(dict)
+        for ref_doc_id, ref_doc_info in docstore.get_all_ref_doc_info().items():
+            if 'file_path' in ref_doc_info.metadata:
+                file_path = _normalize_path(ref_doc_info.metadata['file_path'])
+                indexed_files[file_path][ref_doc_id] = docstore.get_document_hash(ref_doc_id)
+
+        # resolve files to sync, and which indexed files fall within the same scope.
+        if input_files is not None:
+            scope_files = [file for file in input_files if os.path.exists(file)]
+            listed_files = {_normalize_path(file) for file in input_files}
+            deleted_files = [path for path in indexed_files if path in listed_files and not os.path.exists(path)]
+        else:
+            reader = SimpleDirectoryReader(input_dir=input_dir, required_exts=REQUIRED_EXTS)
+            scope_files = [str(file) for file in reader.input_files]
+            scope_dir = _normalize_path(input_dir)
+            deleted_files = [
+                path for path in indexed_files if os.path.dirname(path) == scope_dir and not os.path.exists(path)
+            ]
+
+        documents = self._load_data(input_dir=None, input_files=scope_files) if scope_files else []
+        documents_by_file = defaultdict(list)
+        for document in documents:
+            documents_by_file[_normalize_path(document.metadata['file_path'])].append(document)
+
+        stale_ref_doc_ids = [ref_doc_id for path in deleted_files for ref_doc_id in indexed_files[path]]
+        changed_documents = []
+        for path, file_documents in documents_by_file.items():
+            if {document.hash for document in file_documents} == set(indexed_files[path].values()):
+                continue  # unchanged file, nothing to re-process.
+            stale_ref_doc_ids.extend(indexed_files[path])
+            changed_documents.extend(file_documents)
+
+        logger.info(
+            f'Merging {len(documents_by_file)} files: {len(changed_documents)} new or changed documents, '
+            f'{len(deleted_files)} deleted files, {len(stale_ref_doc_ids)} stale documents'
+        )
+
+        if not changed_documents and not stale_ref_doc_ids:
+            return vector_index
+
+        with span('ingest.merge') as merge_timer:
+            for ref_doc_id in stale_ref_doc_ids:
+                vector_index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+
+            if changed_documents:
+                nodes = self._run_stage('split', changed_documents, [get_default_text_splitter(self.pool_embeddings)])
+                nodes = self._run_stage('keyword extraction', nodes, get_default_extractors())
+                self._insert_nodes(vector_index, nodes)
+                for document in changed_documents:
+                    docstore.set_document_hash(document.get_doc_id(), document.hash)
+
+        logger.info(f'Merged all the documents in {merge_timer.exec_time / 60} mins')
+
+        persist_index_path = persist_index_path or self.vector_index_path
+        self.__persist_vector_idx(vector_index, persist_index_path)  # update the persisted index in place.
 
-    """method to merge new documents into the existing vector index."""
-    # TODO: implement this method in future, currently out of scope.
+        return vector_index